@@ -1,31 +1,52 @@
 """Main module for image splitter."""
 
+import json
+import logging
 import subprocess
 import sys
+import time
+from collections.abc import Iterator
 from pathlib import Path
 
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import QEvent, QObject, Qt, QTimer
 from PyQt6.QtGui import QImageReader, QKeyEvent
 from PyQt6.QtWidgets import (
     QApplication,
     QCheckBox,
+    QComboBox,
     QFrame,
     QHBoxLayout,
     QLabel,
     QLineEdit,
+    QProgressBar,
     QPushButton,
     QSpinBox,
     QVBoxLayout,
     QWidget,
 )
-from send2trash import send2trash
 from tendo import singleton
 
+from src.Archive import HeldArchives
+from src.Autopilot import Autopilot
 from src.BoxesWidget import BoxWidget
-from src.Components import Polygon
+from src.Components import AUTODRAW_ENGINES, Polygon
+from src.Export import OUTPUT_MANIFEST, OUTPUT_MODES
+from src.Filmstrip import Filmstrip
+from src.FolderIndex import GetFolderIndex
 from src.ImageWidget import ImageWidget
+from src.Journal import RestoreLast, TrashFile
+from src.LayoutStore import ContentHash, LoadLayout, StoredNames
 from src.LinesWidget import LineWidget
-from src.Utility import RestoreFromRecycle
+from src.Profiling import ENABLED as PROFILING
+from src.Profiling import Breakdown, DumpChromeTrace, ToggleCProfile
+from src.Scheduler import EXPORT, GetScheduler
+from src.Strip import IsStrip, SplitStrip
+from src.Tasks import Job, TaskRunner
+from src.Utility import AppDataDir, RecordFileAdded, RecordFileRemoved
+
+# everything above is the import cost the startup probe reports separately
+IMPORTED = time.perf_counter()
+STARTUP_PROBE = "--startup-probe"
 
 QImageReader.setAllocationLimit(0)
 
@@ -46,6 +67,7 @@ class MainWindow(QWidget):
         self.setStyleSheet(
             """
             QFrame {max-width: 250px}
+            Filmstrip {max-width: 100000px}
             QWidget { background-color: #2b2b2b; color: #f0f0f0; }
             QCheckBox, QPushButton {background-color: #3c3f41; border: none; padding: 5px;}
             QPushButton:hover, QCheckBox:hover { background-color: #4b4f51; }
@@ -72,6 +94,8 @@ class MainWindow(QWidget):
         self.loadNextCheck = QCheckBox("Load Next")
         self.loadNextCheck.setChecked(True)
         self.subfolderCheck = QCheckBox("Save to subfolder")
+        self.stripModeCheck = QCheckBox("Strip mode")
+        self.stripModeCheck.setToolTip("Leave tall strips undecoded for J to split from disk")
         self.previewLinesCheck = QCheckBox("Preview Lines")
         self.previewLinesCheck.setChecked(True)
         self.trimBtn = QPushButton("Trim Bounds")
@@ -82,6 +106,35 @@ class MainWindow(QWidget):
         self.gridEntry = QLineEdit()
         self.gridEntry.setText("1x1")
         self.gridEntry.setStyleSheet("max-width: 50px ")
+        self.engineCombo = QComboBox()
+        self.engineCombo.addItems(AUTODRAW_ENGINES)
+        self.engineCombo.setToolTip("Auto-draw engine")
+        # keep letter shortcuts from changing the selection
+        self.engineCombo.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.outputCombo = QComboBox()
+        self.outputCombo.addItems(OUTPUT_MODES)
+        self.outputCombo.setToolTip(
+            "Save panels as files, as a manifest of their rectangles, or into the folder's CBZ",
+        )
+        self.outputCombo.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.profileLabel = QLabel()
+        self.profileLabel.setVisible(PROFILING)
+        self.filmstrip = Filmstrip()
+        # a result only applies to the widget and image it was computed from; the pixmap is
+        # replaced whenever the image is, while its digest may still be on its way
+        self.tasks = TaskRunner(
+            lambda: (
+                self.ImageViewer,
+                self.ImageViewer.image_path,
+                self.ImageViewer.pixmap.cacheKey(),
+            ),
+            self,
+        )
+        self.taskProgress = QProgressBar()
+        self.taskProgress.setVisible(False)
+        self.cancelBtn = QPushButton("Cancel")
+        self.cancelBtn.setVisible(False)
+        self.autopilot = Autopilot(self)
 
         # Connect signals
         self.modeToggle.clicked.connect(self.ToggleMode)
@@ -91,18 +144,30 @@ class MainWindow(QWidget):
         self.resetBtn.clicked.connect(self.reset)
         self.previewLinesCheck.toggled.connect(self.ToggleLinePreview)
         self.polygonViewCheck.toggled.connect(self.DisplayPolygons)
+        self.stripModeCheck.toggled.connect(self.ToggleStripMode)
         self.addGridBtn.clicked.connect(self.AddGrid)
         self.trimBtn.clicked.connect(self.Trim)
+        self.filmstrip.pageChosen.connect(self.OpenPage)
+        self.cancelBtn.clicked.connect(self.CancelWork)
+        self.tasks.started.connect(self.OnTaskStarted)
+        self.tasks.progress.connect(self.OnTaskProgress)
+        self.tasks.finished.connect(self.OnTaskFinished)
+        self.autopilot.started.connect(self.OnTaskStarted)
+        self.autopilot.progress.connect(self.OnTaskProgress)
+        self.autopilot.paused.connect(self.OnAutopilotPaused)
+        self.autopilot.finished.connect(self.OnTaskFinished)
 
         # Layout setup
         self.SetupLayout()
         self.resize(1200, 800)
         self.ToggleMode()
 
-        if sys.argv and len(sys.argv) > 1:
-            imgPath = Path(sys.argv[1])
+        paths = [x for x in sys.argv[1:] if not x.startswith("--")]
+        if paths:
+            imgPath = Path(paths[0])
             if imgPath.is_file():
                 self.ImageViewer.LoadImage(imgPath)
+                self.update()
 
     def SetupLayout(self) -> None:
         """Define buttons and layouts."""
@@ -114,6 +179,7 @@ class MainWindow(QWidget):
         top_layout.addStretch()
         top_layout.addWidget(self.imageLabel)
         top_layout.addStretch()
+        top_layout.addWidget(self.engineCombo)
         top_layout.addWidget(self.deleteLastBtn)
         top_layout.addWidget(self.trimBtn)
         top_layout.addWidget(self.trimPad)
@@ -127,9 +193,14 @@ class MainWindow(QWidget):
         # Bottom row: Controls
         bottom_layout = QHBoxLayout()
         bottom_layout.addWidget(self.subfolderCheck)
+        bottom_layout.addWidget(self.outputCombo)
         bottom_layout.addWidget(self.previewLinesCheck)
         bottom_layout.addWidget(self.loadNextCheck)
+        bottom_layout.addWidget(self.stripModeCheck)
         bottom_layout.addStretch()
+        bottom_layout.addWidget(self.profileLabel)
+        bottom_layout.addWidget(self.taskProgress)
+        bottom_layout.addWidget(self.cancelBtn)
         for btn in (
             self.resetBtn,
             self.deleteImgBtn,
@@ -141,6 +212,7 @@ class MainWindow(QWidget):
         main_layout = QVBoxLayout()
         main_layout.addLayout(top_layout)
         main_layout.addLayout(self.middle_layout)
+        main_layout.addWidget(self.filmstrip)
         main_layout.addLayout(bottom_layout)
         self.setLayout(main_layout)
 
@@ -167,9 +239,10 @@ class MainWindow(QWidget):
             case Qt.Key.Key_T:
                 self.Trim()
             case Qt.Key.Key_U:
-                RestoreFromRecycle(self)
+                RestoreLast(self)
             case Qt.Key.Key_A:
-                self.ImageViewer.AutoDraw()
+                engine = self.engineCombo.currentText()
+                self.RunTask("AutoDraw", self.ImageViewer.AutoDrawJob(engine))
             case Qt.Key.Key_B:
                 self.ToggleMode()
             case Qt.Key.Key_P:
@@ -178,9 +251,9 @@ class MainWindow(QWidget):
             case Qt.Key.Key_S:
                 self.AddGrid()
             case Qt.Key.Key_L:
-                self.ImageViewer.Translate()
+                self.RunTask("Translate", self.ImageViewer.TranslateJob())
             case Qt.Key.Key_M:
-                self.ImageViewer.Translate(False)
+                self.RunTask("Translate", self.ImageViewer.TranslateJob(False))
             case Qt.Key.Key_K:
                 self.keepPolygonsCheck.setChecked(not self.keepPolygonsCheck.isChecked())
             case Qt.Key.Key_V:
@@ -190,7 +263,14 @@ class MainWindow(QWidget):
                     self.keepPolygonsCheck.isChecked(),
                 ) if self.ImageViewer.ReadyToCrop else self.Save()
             case Qt.Key.Key_Escape:
-                self.clear()
+                if self.tasks.busy or self.autopilot.running:
+                    self.CancelWork()
+                else:
+                    self.clear()
+            case Qt.Key.Key_N:
+                self.Autopilot()
+            case Qt.Key.Key_D:
+                self.ImageViewer.ApplyDuplicateLayout()
             case Qt.Key.Key_G:
                 self.gridEntry.setFocus()
                 self.gridEntry.selectAll()
@@ -202,31 +282,29 @@ class MainWindow(QWidget):
                 self.ImageViewer.Rename()
             case Qt.Key.Key_Backspace:
                 self.DeleteLastPolygon()
+            case Qt.Key.Key_Z if a0.modifiers() & Qt.KeyboardModifier.ControlModifier:
+                if a0.modifiers() & Qt.KeyboardModifier.ShiftModifier:
+                    self.ImageViewer.Redo()
+                else:
+                    self.ImageViewer.Undo()
+            case Qt.Key.Key_F11 if PROFILING:
+                trace = DumpChromeTrace(AppDataDir() / f"trace-{int(time.time())}.json")
+                self.profileLabel.setText(f"Trace written to {trace}")
+                return
+            case Qt.Key.Key_F12 if PROFILING:
+                dump = ToggleCProfile(AppDataDir() / f"profile-{int(time.time())}.prof")
+                self.profileLabel.setText(f"cProfile written to {dump}" if dump else "cProfile on")
+                return
             case Qt.Key.Key_O:
-                if self.ImageViewer.image_path and self.ImageViewer.image_path.parent.exists():
-                    bounds = self.ImageViewer.saveBounds
-                    start = self.ImageViewer.image_path
-                    (self.ImageViewer.image_path.parent / "processed").mkdir(exist_ok=True)
-                    for file in self.ImageViewer.image_path.parent.iterdir():
-                        if file.suffix.lower() in [".png", ".jpg", ".jpeg", ".bmp", ".gif"]:
-                            self.ImageViewer.LoadImage(file)
-                            self.ImageViewer.saveBounds = bounds
-                            self.ImageViewer.SaveSections(self.subfolderCheck.isChecked())
-                            file.rename(file.parent / "processed" / file.name)
-                    self.ImageViewer.LoadImage(start)
-                    self.ImageViewer.saveBounds = bounds
-                    self.update()
+                self.ExportFolder()
+            case Qt.Key.Key_X:
+                self.ExportStoredLayouts()
+            case Qt.Key.Key_J:
+                self.SplitStrip()
+            case Qt.Key.Key_F:
+                self.filmstrip.setVisible(not self.filmstrip.isVisible())
             case Qt.Key.Key_Y:
-                if self.ImageViewer.image_path and self.ImageViewer.image_path.parent.exists():
-                    start = self.ImageViewer.image_path
-                    for file in self.ImageViewer.image_path.parent.iterdir():
-                        if file.suffix.lower() in [".png", ".jpg", ".jpeg", ".bmp", ".gif"]:
-                            self.ImageViewer.LoadImage(file)
-                            self.ImageViewer.AddGrid(1, 1)
-                            self.Trim()
-                            self.ImageViewer.Crop()
-                    self.ImageViewer.LoadImage(start)
-                    self.update()
+                self.CropFolder()
             case (
                 Qt.Key.Key_0
                 | Qt.Key.Key_1
@@ -238,7 +316,7 @@ class MainWindow(QWidget):
                 | Qt.Key.Key_7
                 | Qt.Key.Key_8
                 | Qt.Key.Key_9
-            ):
+            ) if self.ImageViewer.image_obj is not None:
                 self.gridEntry.setText(
                     "1x" + chr(a0.key())
                     if self.ImageViewer.image_obj.size[0] < self.ImageViewer.image_obj.size[1]
@@ -250,28 +328,31 @@ class MainWindow(QWidget):
         self.update()
 
     def ToggleMode(self) -> None:
-        """Toggle between line and box modes."""
-        self.middle_layout.removeWidget(self.ImageViewer)
-        if isinstance(self.ImageViewer, BoxWidget):
+        """Toggle between line and box modes, keeping the loaded image and view."""
+        # its pages are split the way the current mode splits them
+        self.autopilot.Stop()
+        previous = self.ImageViewer
+        previous.StoreLayout()
+        self.middle_layout.removeWidget(previous)
+        previous.deleteLater()
+        # Keep Polygons carries the bounds across; otherwise each mode shows its own layout
+        polygons = list(previous.saveBounds) if self.keepPolygonsCheck.isChecked() else None
+        if isinstance(previous, BoxWidget):
             self.previewLinesCheck.setEnabled(False)
             self.modeToggle.setText("Switch to Box Mode")
             self.modeToggle.setStyleSheet("background-color: #4CAF50; font-weight: bold;")
             self.previewLinesCheck.setEnabled(True)
-            self.ImageViewer = LineWidget(
-                self.ImageViewer.image_path,
-                self.ImageViewer.saveBounds,
-            )
+            self.ImageViewer = LineWidget(polygons=polygons, document=previous.document)
         else:
             self.modeToggle.setText("Switch to Line Mode")
             self.modeToggle.setStyleSheet("background-color: #b350af; font-weight: bold;")
-            self.ImageViewer = BoxWidget(
-                self.ImageViewer.image_path,
-                self.ImageViewer.saveBounds,
-            )
+            self.ImageViewer = BoxWidget(polygons=polygons, document=previous.document)
+        # same size as the widget it replaces, so the shared pan is not recentred
+        self.ImageViewer.resize(previous.size())
         self.middle_layout.addWidget(self.ImageViewer)
         self.ImageViewer.update()
         self.update()
-        self.reset()
+        self.reset(preserveView=True, preservePolygons=True)
         self.DisplayPolygons()
 
     def DeleteLastPolygon(self) -> None:
@@ -328,16 +409,75 @@ class MainWindow(QWidget):
             self.ImageViewer.saveBounds = saveBounds if self.keepPolygonsCheck.isChecked() else []
 
         if im and im.exists():
-            send2trash(im)
+            TrashFile(im)
         self.update()
 
     def Trim(self) -> None:
         """Trim border from image."""
-        self.ImageViewer.Trim(self.trimPad.value())
+        self.RunTask("Trim", self.ImageViewer.TrimJob(self.trimPad.value()))
+
+    def RunTask(self, name: str, job: Job | None) -> None:
+        """Run `job` in the background, showing its progress until it is applied or cancelled."""
+        if job is not None:
+            image = self.ImageViewer.image_obj
+            memory = image.width * image.height * 4 if image is not None else 0
+            self.tasks.Run(name, *job, memory=memory)
+
+    def CancelWork(self) -> None:
+        """Cancel the running task, or stop the autopilot if nothing else runs."""
+        if self.tasks.busy:
+            self.tasks.Cancel()
+        else:
+            self.autopilot.Stop()
+
+    def Autopilot(self) -> None:
+        """Start the autopilot from the current page, or accept the page it paused on."""
+        viewer = self.ImageViewer
+        if (review := self.autopilot.review) is not None:
+            # the user's edits win when the page under review is still the one shown
+            edited = viewer.image_path == review.path and viewer.saveBounds != review.polygons
+            self.autopilot.Resume(list(viewer.saveBounds) if edited else None)
+            self.taskProgress.setFormat("Autopilot %p%")
+        elif not self.autopilot.running and viewer.image_path is not None:
+            self.autopilot.Start(
+                viewer,
+                viewer.image_path,
+                self.engineCombo.currentText(),
+                self.trimPad.value(),
+                self.subfolderCheck.isChecked(),
+                self.outputCombo.currentText(),
+            )
 
-    def reset(self) -> None:
+    def OnAutopilotPaused(self, path: Path, reasons: list[str]) -> None:
+        self.ImageViewer.LoadImage(path)
+        if (review := self.autopilot.review) is not None and review.polygons is not None:
+            self.ImageViewer.saveBounds = list(review.polygons)
+            self.ImageViewer.BoundsChanged()
+        self.taskProgress.setFormat(f"Review: {', '.join(reasons)} (N accepts)")
+        self.update()
+
+    def OnTaskStarted(self, name: str) -> None:
+        # busy indicator until the task reports a total
+        self.taskProgress.setRange(0, 0)
+        self.taskProgress.setFormat(f"{name} %p%")
+        self.taskProgress.setVisible(True)
+        self.cancelBtn.setVisible(True)
+
+    def OnTaskProgress(self, done: int, total: int) -> None:
+        self.taskProgress.setRange(0, total)
+        self.taskProgress.setValue(done)
+
+    def OnTaskFinished(self) -> None:
+        self.taskProgress.setVisible(False)
+        self.cancelBtn.setVisible(False)
+        self.update()
+
+    def reset(self, preserveView: bool = False, preservePolygons: bool = False) -> None:
         """Reset the entire widget."""
-        self.ImageViewer.reset(self.keepPolygonsCheck.isChecked())
+        self.ImageViewer.reset(
+            preservePolygons or self.keepPolygonsCheck.isChecked(),
+            preserveView,
+        )
         self.gridEntry.setText("1x1")
         self.trimPad.setValue(0)
         self.polygonViewCheck.setChecked(False)
@@ -358,8 +498,19 @@ class MainWindow(QWidget):
                 f" ({self.ImageViewer.image_obj.size[0]}x{self.ImageViewer.image_obj.size[1]})"
             )
         self.setWindowTitle(baseName)
+        self.filmstrip.ShowPath(self.ImageViewer.image_path)
+        self.tasks.Revalidate()
+        if PROFILING:
+            self.profileLabel.setText(f"{Breakdown()}  {GetScheduler().Summary()}".strip())
         super().update()
 
+    def ToggleStripMode(self, checked: bool) -> None:
+        """Toggle leaving tall strips undecoded, and reopen the current image accordingly."""
+        self.ImageViewer.stripMode = checked
+        if (path := self.ImageViewer.image_path) is not None:
+            self.ImageViewer.LoadImage(path)
+        self.update()
+
     def ToggleLinePreview(self, checked: bool) -> None:
         """Toggle the display of extended lines and boundaries."""
         self.ImageViewer.previewLines = checked
@@ -367,12 +518,145 @@ class MainWindow(QWidget):
 
     def Save(self) -> None:
         """Save the image as sections, defined by imageviewer boxes."""
+        if self.ImageViewer.image_obj is None:
+            # nothing decoded, or a strip left for J in strip mode
+            return
         newBounds = [] if not self.keepPolygonsCheck.isChecked() else self.ImageViewer.saveBounds
-        self.ImageViewer.SaveSections(self.subfolderCheck.isChecked())
-        if self.ImageViewer.isFullyCovered:
+        if (source := self.ImageViewer.image_path) is not None:
+            GetFolderIndex(source.parent).SetProcessed(source)
+        output = self.outputCombo.currentText()
+        self.ImageViewer.SaveSections(self.subfolderCheck.isChecked(), output)
+        # a manifest crops its panels from the source, which has to stay
+        if output != OUTPUT_MANIFEST and self.ImageViewer.isFullyCovered:
             self.DeleteIMG()
         self.ImageViewer.saveBounds = newBounds
 
+    def ExportStoredLayouts(self) -> None:
+        """Save sections for every image in the folder that has a stored layout."""
+        start = self.ImageViewer.image_path
+        if start is None or not start.parent.exists():
+            return
+        self.tasks.Step("Export", self.ExportStoredLayoutsSteps(start))
+
+    def ExportStoredLayoutsSteps(self, start: Path) -> Iterator[tuple[int, int]]:
+        mode = self.ImageViewer.MODE
+        # only pages with a row of their own are hashed to check the layout still fits
+        stored = StoredNames(start.parent, mode)
+        files = [
+            start.parent / name for name in GetFolderIndex(start.parent).names if name in stored
+        ]
+        try:
+            with HeldArchives():
+                for idx, file in enumerate(files, start=1):
+                    if self.ImageViewer.stripMode and IsStrip(file):
+                        logging.info("Skipping strip %s, J splits it", file.name)
+                    elif file.is_file() and LoadLayout(file, mode) is not None:
+                        # loading restores the stored layout, no AutoDraw or Trim needed
+                        self.ImageViewer.LoadImage(file)
+                        self.ImageViewer.SaveSections(
+                            self.subfolderCheck.isChecked(),
+                            self.outputCombo.currentText(),
+                        )
+                        GetFolderIndex(file.parent).SetProcessed(file)
+                    yield idx, len(files)
+        finally:
+            self.ImageViewer.LoadImage(start)
+            self.update()
+
+    def ExportFolder(self) -> None:
+        """Save the current bounds for every image in the folder and file them as processed."""
+        start = self.ImageViewer.image_path
+        if start is None or not start.parent.exists():
+            return
+        self.tasks.Step("Export", self.ExportFolderSteps(start, self.ImageViewer.saveBounds))
+
+    def ExportFolderSteps(self, start: Path, bounds: list[Polygon]) -> Iterator[tuple[int, int]]:
+        output = self.outputCombo.currentText()
+        processed = start.parent / "processed"
+        if output != OUTPUT_MANIFEST:
+            processed.mkdir(exist_ok=True)
+            RecordFileAdded(processed)
+        files = [
+            x
+            for x in start.parent.iterdir()
+            if x.suffix.lower() in [".png", ".jpg", ".jpeg", ".bmp", ".gif"]
+        ]
+        # digests of the pages split in this batch
+        exported: set[str] = set()
+        try:
+            with HeldArchives():
+                for idx, file in enumerate(files, start=1):
+                    if self.ImageViewer.stripMode and IsStrip(file):
+                        # undecoded strips are split from disk like J does, always to files
+                        list(SplitStrip(file))
+                    # an exact copy of a page already split in this batch is just filed away;
+                    # perceptual matches are not enough, pages of one grid look alike
+                    elif (digest := ContentHash(file)) not in exported:
+                        self.ImageViewer.LoadImage(file)
+                        self.ImageViewer.saveBounds = bounds
+                        self.ImageViewer.SaveSections(self.subfolderCheck.isChecked(), output)
+                        exported.add(digest)
+                    if output != OUTPUT_MANIFEST:
+                        file.rename(processed / file.name)
+                        RecordFileRemoved(file)
+                    else:
+                        # the manifest points at the source where it is
+                        GetFolderIndex(file.parent).SetProcessed(file)
+                    yield idx, len(files)
+        finally:
+            self.ImageViewer.LoadImage(start)
+            self.ImageViewer.saveBounds = bounds
+            self.update()
+
+    def CropFolder(self) -> None:
+        """Trim and crop every image in the folder to its content."""
+        start = self.ImageViewer.image_path
+        if start is None or not start.parent.exists():
+            return
+        self.tasks.Step("Crop", self.CropFolderSteps(start))
+
+    def CropFolderSteps(self, start: Path) -> Iterator[tuple[int, int]]:
+        files = [
+            x
+            for x in start.parent.iterdir()
+            if x.suffix.lower() in [".png", ".jpg", ".jpeg", ".bmp", ".gif"]
+        ]
+        try:
+            for idx, file in enumerate(files, start=1):
+                if self.ImageViewer.stripMode and IsStrip(file):
+                    logging.info("Skipping strip %s, J splits it", file.name)
+                    yield idx, len(files)
+                    continue
+                self.ImageViewer.LoadImage(file)
+                self.ImageViewer.AddGrid(1, 1)
+                # each page is trimmed before it is cropped, so trim in step
+                self.ImageViewer.Trim(self.trimPad.value())
+                self.ImageViewer.Crop()
+                yield idx, len(files)
+        finally:
+            self.ImageViewer.LoadImage(start)
+            self.update()
+
+    def OpenPage(self, path: Path) -> None:
+        """Load a page picked in the filmstrip."""
+        self.ImageViewer.LoadImage(path, keepPolygons=self.keepPolygonsCheck.isChecked())
+        self.update()
+
+    def SplitStrip(self) -> None:
+        """Split the current image as a webtoon strip, streaming it from disk."""
+        source = self.ImageViewer.image_path
+        if source is None or not source.is_file():
+            return
+
+        def Apply(written: list[Path]) -> None:
+            GetFolderIndex(source.parent).SetProcessed(source)
+            if written:
+                self.ImageViewer.LoadImage(written[0])
+            self.update()
+
+        # panels are on disk as soon as they are found, a cancel keeps the ones written
+        self.tasks.Run("Split strip", lambda: list(SplitStrip(source)), Apply, EXPORT)
+
     def AddGrid(self) -> None:
         """Add defined grid to image viewer."""
         numerics: list[int] = [
@@ -386,9 +670,41 @@ class MainWindow(QWidget):
     # endregion
 
 
+class FirstFrameProbe(QObject):
+    """Report the time from the end of imports to the first painted frame, then quit.
+
+    Enabled with ``--startup-probe`` (stdout) or ``--startup-probe=<file>``, which
+    also works for frozen GUI builds without a console.
+    """
+
+    def __init__(self, target: str) -> None:
+        super().__init__()
+        self.target = target
+        self.painted = False
+
+    def eventFilter(self, _watched: QObject | None, a1: QEvent | None) -> bool:
+        if a1 is not None and a1.type() == QEvent.Type.Paint and not self.painted:
+            self.painted = True
+            # report once the paint in progress has finished
+            QTimer.singleShot(0, self.Report)
+        return False
+
+    def Report(self) -> None:
+        result = json.dumps({"window": time.perf_counter() - IMPORTED})
+        if self.target:
+            Path(self.target).write_text(result)
+        else:
+            print(result, flush=True)
+        QApplication.quit()
+
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     app.setStyle("Material")
     window = MainWindow()
+    probe = next((x for x in sys.argv if x.split("=")[0] == STARTUP_PROBE), None)
+    if probe is not None:
+        firstFrame = FirstFrameProbe(probe.partition("=")[2])
+        window.installEventFilter(firstFrame)
     window.show()
     sys.exit(app.exec())
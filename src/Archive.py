@@ -0,0 +1,188 @@
+"""Panels streamed into one CBZ archive per chapter instead of loose files.
+
+A chapter is a folder of pages. Its panels go into `<folder name>.cbz` beside
+the pages, named as the file export would name them relative to that folder,
+so "Save to subfolder" becomes a folder inside the archive. Panels are PNG or
+JPEG already, so they are stored without recompression and appended one
+after another through a large write buffer. The index (the zip central
+directory) is written when the archive is closed.
+
+Panels are appended in place, over the old index, so the archive has no
+index while it is open: a crash then leaves the panels in the file but
+readable only after ``zip -FF``. Held archives are closed, which writes the
+index, every `CHECKPOINT_PAGES` pages to keep that window short. Reopening
+reads only the index, so a checkpoint costs no more than the index itself.
+
+A single save opens the archive, appends and closes it. Batches run inside
+`HeldArchives`, which keeps archives open until the batch ends, so the index
+is written once per `CHECKPOINT_PAGES` pages instead of once per page.
+"""
+
+import atexit
+import contextlib
+import io
+import logging
+import os
+import threading
+import time
+import zipfile
+from collections.abc import Iterator
+from pathlib import Path
+
+from PIL import Image
+
+from .Export import Box, StorableSections
+from .Profiling import Span
+from .Utility import RecordFileAdded
+
+ARCHIVE_SUFFIX = ".cbz"
+# bytes collected before each write to the archive file
+WRITE_BUFFER = 4 * 1024 * 1024
+# pages appended to a held archive before it is closed, bounding what a crash loses
+CHECKPOINT_PAGES = 50
+
+# guards `ARCHIVES` and `HOLDS`, and serializes writers
+LOCK = threading.RLock()
+ARCHIVES: dict[Path, "ChapterArchive"] = {}
+# open `HeldArchives` blocks; archives close after each save when there are none
+HOLDS = 0
+
+
+class ChapterArchive:
+    """A chapter archive open for appending, on its buffered file."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        created = not path.exists()
+        self.file = path.open("w+b" if created else "r+b", buffering=WRITE_BUFFER)
+        self.zip = zipfile.ZipFile(self.file, "w" if created else "a", zipfile.ZIP_STORED)
+        # names of the pages with panels in the archive
+        self.pages = {info.comment for info in self.zip.infolist()}
+        # pages appended since the archive was opened
+        self.written = 0
+        if created:
+            RecordFileAdded(path)
+
+    def Has(self, source: Path) -> bool:
+        """Return True if the archive holds panels of `source`."""
+        return source.name.encode() in self.pages
+
+    def Add(self, name: str, data: bytes, source: Path, mtime: float) -> None:
+        info = zipfile.ZipInfo(name, time.localtime(mtime)[:6])
+        # the page a panel came from, so saving that page again can replace it
+        info.comment = source.name.encode()
+        self.zip.writestr(info, data, zipfile.ZIP_STORED)
+        self.pages.add(info.comment)
+
+    def Close(self) -> None:
+        try:
+            self.zip.close()
+        finally:
+            self.file.close()
+
+
+def ArchivePath(source: Path) -> Path:
+    """Return the archive of the chapter `source` belongs to."""
+    return source.parent / f"{source.parent.name}{ARCHIVE_SUFFIX}"
+
+
+def OpenArchive(path: Path) -> ChapterArchive:
+    if path not in ARCHIVES:
+        ARCHIVES[path] = ChapterArchive(path)
+    return ARCHIVES[path]
+
+
+def CloseArchive(path: Path) -> None:
+    archive = ARCHIVES.pop(path, None)
+    if archive is not None:
+        archive.Close()
+
+
+def CloseArchives() -> None:
+    """Write the index of every open archive and close it."""
+    with LOCK:
+        for path in list(ARCHIVES):
+            CloseArchive(path)
+
+
+# an archive left open has no index, so close them even if a batch never ends
+atexit.register(CloseArchives)
+
+
+def RemovePanels(path: Path, source: Path) -> None:
+    """Rewrite the archive at `path` without the panels of `source`."""
+    partial = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    key = source.name.encode()
+    with zipfile.ZipFile(path) as old, zipfile.ZipFile(partial, "w", zipfile.ZIP_STORED) as new:
+        for info in old.infolist():
+            if info.comment != key:
+                kept = zipfile.ZipInfo(info.filename, info.date_time)
+                kept.comment = info.comment
+                new.writestr(kept, old.read(info), zipfile.ZIP_STORED)
+    partial.replace(path)
+
+
+def HoldArchives() -> None:
+    """Keep archives open after saves until the matching `ReleaseArchives`."""
+    global HOLDS
+    with LOCK:
+        HOLDS += 1
+
+
+def ReleaseArchives() -> None:
+    global HOLDS
+    with LOCK:
+        HOLDS -= 1
+        if not HOLDS:
+            CloseArchives()
+
+
+@contextlib.contextmanager
+def HeldArchives() -> Iterator[None]:
+    """Keep archives open while the block runs, so each index is written once."""
+    HoldArchives()
+    try:
+        yield
+    finally:
+        ReleaseArchives()
+
+
+def WriteArchive(
+    source: Path,
+    sections: list[tuple[Box, Path]],
+    skipUniform: bool = False,
+) -> Path:
+    """Encode the (box, output path) sections of `source` into its chapter archive.
+
+    Panels of `source` saved earlier are replaced. Returns the archive.
+    """
+    path = ArchivePath(source)
+    mtime = source.stat().st_mtime
+    with LOCK:
+        archive = OpenArchive(path)
+        if archive.Has(source):
+            # rare, so the whole archive is rewritten rather than indexed by page
+            CloseArchive(path)
+            RemovePanels(path, source)
+            archive = OpenArchive(path)
+        order = {output: idx for idx, (_, output) in enumerate(sections)}
+        encoded: list[tuple[int, str, bytes]] = []
+        try:
+            for image, output in StorableSections(source, sections, skipUniform):
+                buffer = io.BytesIO()
+                try:
+                    with Span("encode"):
+                        image.save(buffer, Image.registered_extensions().get(output.suffix.lower()))
+                except OSError:
+                    logging.exception("Failed to encode %s", output)
+                    continue
+                name = output.relative_to(source.parent).as_posix()
+                encoded.append((order[output], name, buffer.getvalue()))
+            # regions come out in decode order; readers that go by entry order want reading order
+            for _, name, data in sorted(encoded):
+                archive.Add(name, data, source, mtime)
+            archive.written += 1
+        finally:
+            if not HOLDS or archive.written >= CHECKPOINT_PAGES:
+                CloseArchive(path)
+    return path
@@ -1,7 +1,11 @@
 """Automatically slice image."""
 
+import math
+import os
 import sys
+from collections import deque
 from collections.abc import Iterable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from itertools import islice
 from pathlib import Path
 
@@ -10,11 +14,25 @@ from PIL import Image
 from PyQt6.QtCore import QPoint
 from PyQt6.QtGui import QColor
 
-from .Components import Polygon
+from .Components import AUTODRAW_ENGINES, Polygon
 from .LineCalcs import TOLERANCE
+from .Profiling import Timed
+from .Scheduler import Checkpoint, Helpers
 
 MIN_SECTION = 150
 PADDING = 0
+# coarse detection reduces pages to about this many pixels, by at most MAX_REDUCE
+COARSE_PIXELS = 1_500_000
+MAX_REDUCE = 8
+# cells smaller than this or nested this deep are sliced serially within one task
+SERIAL_PIXELS = 1_000_000
+SERIAL_DEPTH = 3
+# the most threads one page is sliced on, if the scheduler has the slots free
+SLICE_WORKERS = os.cpu_count() or 1
+
+Box = tuple[int, int, int, int]
+# created on the first page big enough to slice in parallel
+SLICE_POOL: ThreadPoolExecutor | None = None
 
 
 def RunMedian(numbers: list) -> list[int]:
@@ -36,36 +54,107 @@ def RunMedian(numbers: list) -> list[int]:
     return [int(np.median(run)) for run in runs]
 
 
+def ToArray(image: Image.Image) -> np.ndarray:
+    """Return `image` as a (height, width, 3) int8 array for `SolidLines`."""
+    return np.asarray(image.convert("RGB")).astype(np.int8)
+
+
+def SolidLines(arr: np.ndarray, axis: int, tolerance: int = TOLERANCE) -> np.ndarray:
+    """Return indices of rows (axis 0) or columns (axis 1) matching their first pixel.
+
+    Rows are compared to their left pixel and columns to their top pixel, with
+    the same tolerance as `MatchTuple`.
+    """
+    refs = arr[:, 0:1, :] if axis == 0 else arr[0:1, :, :]
+    within = (np.abs(arr - refs) <= tolerance).all(axis=2)  # shape (height, width)
+    return np.where(within.all(axis=1 - axis))[0]
+
+
+@Timed("GetSolidGrid")
 def GetSolidGrid(image: Image.Image) -> tuple[list, list]:
     """Return row and column indices where the entire line matches the edge pixel.
 
-    Comparisons use the same tolerance as `MatchTuple`. This implementation
-    vectorizes the per-pixel comparisons with NumPy which is substantially
-    faster than iterating in Python for large images.
+    This implementation vectorizes the per-pixel comparisons with NumPy which
+    is substantially faster than iterating in Python for large images.
     """
-    # Convert to a consistent 3-channel RGB array to simplify comparisons
-    img = image.convert("RGB")
-    arr = np.asarray(img).astype(np.int8)
+    arr = ToArray(image)
+    return (SolidLines(arr, 0).tolist(), SolidLines(arr, 1).tolist())
 
-    # Ensure we have a 3D array: (height, width, channels)
-    if arr.ndim == 2:
-        arr = arr[:, :, None]
 
-    # height, width are available as arr.shape[:2] when needed; no local variables
+def SolidBand(
+    image: Image.Image,
+    top: int,
+    bottom: int,
+    topRow: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Return the solid rows among rows [top, bottom) and which columns there match `topRow`."""
+    band = ToArray(image.crop((0, top, image.width, bottom)))
+    cols = (np.abs(band - topRow) <= TOLERANCE).all(axis=2).all(axis=0)
+    return SolidLines(band, 0) + top, cols
 
-    # Columns: compare every pixel in column x to the top pixel at (0, x)
-    # refs_col: shape (1, width, channels) -> broadcast against arr
-    refs_col = arr[0:1, :, :]
-    diff_col = np.abs(arr - refs_col)
-    within_col = (diff_col <= TOLERANCE).all(axis=2)  # shape (height, width)
-    cols = np.where(within_col.all(axis=0))[0].tolist()
 
-    # Rows: compare every pixel in row y to the left pixel at (y, 0)
-    refs_row = arr[:, 0:1, :]
-    diff_row = np.abs(arr - refs_row)
-    within_row = (diff_row <= TOLERANCE).all(axis=2)  # shape (height, width)
-    rows = np.where(within_row.all(axis=1))[0].tolist()  # pyright: ignore[reportArgumentType]
+@Timed("GetSolidGridParallel")
+def GetSolidGridParallel(image: Image.Image, workers: int) -> tuple[list, list]:
+    """Return the same lines as `GetSolidGrid`, scanning `workers` bands of rows on `SLICE_POOL`.
 
+    Only call this from outside the pool, it waits for the bands.
+    """
+    width, height = image.size
+    topRow = ToArray(image.crop((0, 0, width, 1)))
+    step = math.ceil(height / workers)
+    bands = [
+        SlicePool().submit(SolidBand, image, top, min(top + step, height), topRow)
+        for top in range(0, height, step)
+    ]
+    rows: list[int] = []
+    cols = np.ones(width, dtype=bool)
+    for band in bands:
+        bandRows, bandCols = band.result()
+        rows.extend(bandRows.tolist())
+        cols &= bandCols
+    return (rows, np.flatnonzero(cols).tolist())
+
+
+def ReduceFactor(image: Image.Image) -> int:
+    return min(int(math.sqrt(image.width * image.height / COARSE_PIXELS)), MAX_REDUCE)
+
+
+def Bands(indices: Iterable[int], factor: int, limit: int) -> list[tuple[int, int]]:
+    """Merge proxy indices into full-resolution [start, end) bands, one proxy step wider."""
+    bands: list[tuple[int, int]] = []
+    for idx in indices:
+        start, end = max((idx - 1) * factor, 0), min((idx + 2) * factor, limit)
+        if bands and start <= bands[-1][1]:
+            bands[-1] = (bands[-1][0], end)
+        else:
+            bands.append((start, end))
+    return bands
+
+
+@Timed("GetSolidGridCoarse")
+def GetSolidGridCoarse(image: Image.Image) -> tuple[list, list]:
+    """Return the same lines as `GetSolidGrid`, searching a downsampled proxy first.
+
+    Gutters are found on a box-filtered proxy with twice the tolerance (a
+    proxy pixel averages pixels that are each within tolerance of their own
+    edge pixel), then each candidate band is checked at full resolution.
+    Solid lines narrower than about two proxy pixels can be missed.
+    """
+    factor = ReduceFactor(image)
+    if factor < 2:
+        return GetSolidGrid(image)
+    source = image if image.mode in ("L", "RGB", "RGBA") else image.convert("RGB")
+    proxy = ToArray(source.reduce(factor))
+    width, height = image.size
+
+    rows: list[int] = []
+    for start, end in Bands(SolidLines(proxy, 0, TOLERANCE * 2), factor, height):
+        band = ToArray(image.crop((0, start, width, end)))
+        rows.extend((SolidLines(band, 0) + start).tolist())
+    cols: list[int] = []
+    for start, end in Bands(SolidLines(proxy, 1, TOLERANCE * 2), factor, width):
+        band = ToArray(image.crop((start, 0, end, height)))
+        cols.extend((SolidLines(band, 1) + start).tolist())
     return (rows, cols)
 
 
@@ -142,73 +231,181 @@ def SimplifyRuns(lines: list[int], maxVal: int) -> list[tuple]:
     return out
 
 
-def SliceImage(img: Image.Image, useLines: bool = False) -> list[Polygon]:
-    out = []
+@Timed("SliceImage")
+def SliceImage(img: Image.Image, useLines: bool = False, coarse: bool = False) -> list[Polygon]:
+    """Split `img` along its solid gutters, recursing into each cell for boxes.
+
+    `coarse` finds the gutters with `GetSolidGridCoarse`. Boxes of large pages
+    are sliced on `SLICE_POOL`, in the same order as a serial run.
+    """
     width, height = img.size
-    rows, cols = GetSolidGrid(img)
+    if not useLines:
+        if SLICE_WORKERS > 1 and width * height >= SERIAL_PIXELS:
+            return SliceParallel(img, coarse)
+        return SliceBoxes(img, coarse)
+
+    rows, cols = GetSolidGridCoarse(img) if coarse else GetSolidGrid(img)
     rows = SimplifyRuns(AddBounds(rows, height), height)
     cols = SimplifyRuns(AddBounds(cols, width), width)
-
-    if useLines:
-        if len(cols) < 2:
-            cols = []
-        if len(rows) < 2:
-            rows = []
-        rowBoxes = [
-            Polygon(
-                [
-                    QPoint(0, r[0]),
-                    QPoint(width, r[0]),
-                ],
-                QColor("purple"),
-            )
-            for r in rows
-        ] + [
-            Polygon(
-                [
-                    QPoint(0, r[1]),
-                    QPoint(width, r[1]),
-                ],
-                QColor("purple"),
-            )
-            for r in rows
-        ]
-        colboxes = [
-            Polygon(
-                [
-                    QPoint(c[0], 0),
-                    QPoint(c[0], height),
-                ],
-                QColor("purple"),
-            )
-            for c in cols
-        ] + [
-            Polygon(
-                [
-                    QPoint(c[1], 0),
-                    QPoint(c[1], height),
-                ],
-                QColor("purple"),
-            )
-            for c in cols
-        ]
-        out = rowBoxes + colboxes
+    if len(cols) < 2:
+        cols = []
+    if len(rows) < 2:
+        rows = []
+    rowBoxes = [
+        Polygon(
+            [
+                QPoint(0, r[0]),
+                QPoint(width, r[0]),
+            ],
+            QColor("purple"),
+        )
+        for r in rows
+    ] + [
+        Polygon(
+            [
+                QPoint(0, r[1]),
+                QPoint(width, r[1]),
+            ],
+            QColor("purple"),
+        )
+        for r in rows
+    ]
+    colboxes = [
+        Polygon(
+            [
+                QPoint(c[0], 0),
+                QPoint(c[0], height),
+            ],
+            QColor("purple"),
+        )
+        for c in cols
+    ] + [
+        Polygon(
+            [
+                QPoint(c[1], 0),
+                QPoint(c[1], height),
+            ],
+            QColor("purple"),
+        )
+        for c in cols
+    ]
+    return rowBoxes + colboxes
+
+
+def GridCells(img: Image.Image, coarse: bool, workers: int = 1) -> list[Box] | None:
+    """Return the (left, top, right, bottom) cells between the gutters of `img`, column by column.
+
+    None means `img` has no gutters and is a panel itself. More than one
+    `workers` scans for full-resolution gutters with `GetSolidGridParallel`.
+    """
+    width, height = img.size
+    if coarse:
+        rows, cols = GetSolidGridCoarse(img)
+    elif workers > 1:
+        rows, cols = GetSolidGridParallel(img, workers)
     else:
-        print(cols, rows)
-        if len(cols) > 1 or len(rows) > 1:
-            for c in cols:
-                for r in rows:
-                    subpolys = SliceImage(
-                        img.crop((c[0], r[0], c[1], r[1])),
-                        useLines=False,
-                    )
-                    normalized_polys = [p.Translate(c[0], r[0]) for p in subpolys]
-                    out.extend(normalized_polys)
-        else:
-            out.append(Polygon([QPoint(0, 0), QPoint(width, height)], QColor("blue")))
+        rows, cols = GetSolidGrid(img)
+    rows = SimplifyRuns(AddBounds(rows, height), height)
+    cols = SimplifyRuns(AddBounds(cols, width), width)
+    if len(cols) <= 1 and len(rows) <= 1:
+        return None
+    return [(c[0], r[0], c[1], r[1]) for c in cols for r in rows]
+
+
+def SliceBoxes(img: Image.Image, coarse: bool) -> list[Polygon]:
+    """Return the panels of `img` by recursing into each grid cell in turn."""
+    cells = GridCells(img, coarse)
+    if cells is None:
+        return [Polygon([QPoint(0, 0), QPoint(*img.size)], QColor("blue"))]
+    out = []
+    for box in cells:
+        Checkpoint()
+        out.extend(p.Translate(box[0], box[1]) for p in SliceBoxes(img.crop(box), coarse))
     return out
 
 
+def SlicePool() -> ThreadPoolExecutor:
+    global SLICE_POOL
+    if SLICE_POOL is None:
+        SLICE_POOL = ThreadPoolExecutor(max_workers=SLICE_WORKERS, thread_name_prefix="slice")
+    return SLICE_POOL
+
+
+def SliceCell(
+    img: Image.Image,
+    box: Box,
+    depth: int,
+    coarse: bool,
+) -> tuple[list[Polygon], list[Box]]:
+    """Slice the `box` cell of `img` for `SliceParallel`.
+
+    Return its panels in `img` coordinates, or no panels and the sub-cells
+    still to slice. Cells past the depth or size cutoff are finished here.
+    """
+    cell = img.crop(box)
+    width, height = cell.size
+    if depth >= SERIAL_DEPTH or width * height < SERIAL_PIXELS:
+        return [p.Translate(box[0], box[1]) for p in SliceBoxes(cell, coarse)], []
+    cells = GridCells(cell, coarse)
+    if cells is None:
+        return [Polygon([QPoint(box[0], box[1]), QPoint(box[2], box[3])], QColor("blue"))], []
+    return [], [(box[0] + c[0], box[1] + c[1], box[0] + c[2], box[1] + c[3]) for c in cells]
+
+
+def SliceParallel(img: Image.Image, coarse: bool) -> list[Polygon]:
+    """Return the same panels as `SliceBoxes`, slicing cells concurrently.
+
+    Every cell is a task on `SLICE_POOL` that either finishes its panels or
+    hands back sub-cells, which are queued as soon as they are known rather
+    than a level at a time. Panels are keyed by their cell's path through the
+    grid, so sorting the keys restores the serial order. The page itself is
+    scanned in bands, the largest single step. The calling thread only waits,
+    so it runs one task at a time plus one per slot the scheduler lends.
+    """
+    with Helpers(SLICE_WORKERS - 1) as extra:
+        if not extra:
+            return SliceBoxes(img, coarse)
+        workers = extra + 1
+        # crops from several threads must not race to load the image
+        img.load()
+        cells = GridCells(img, coarse, workers)
+        if cells is None:
+            return [Polygon([QPoint(0, 0), QPoint(*img.size)], QColor("blue"))]
+        Checkpoint()
+        pool = SlicePool()
+        done: dict[tuple[int, ...], list[Polygon]] = {}
+        pending = deque(((idx,), cell) for idx, cell in enumerate(cells))
+        tasks: dict[Future, tuple[int, ...]] = {}
+        try:
+            while tasks or pending:
+                while pending and len(tasks) < workers:
+                    key, cell = pending.popleft()
+                    tasks[pool.submit(SliceCell, img, cell, len(key), coarse)] = key
+                Checkpoint(len(done), len(done) + len(tasks) + len(pending))
+                finished, _ = wait(tasks, return_when=FIRST_COMPLETED)
+                for task in finished:
+                    key = tasks.pop(task)
+                    polys, cells = task.result()
+                    if not cells:
+                        done[key] = polys
+                    pending.extend(((*key, idx), cell) for idx, cell in enumerate(cells))
+        finally:
+            # after a cancel, drop the cells nobody will collect
+            for task in tasks:
+                task.cancel()
+    return [p for key in sorted(done) for p in done[key]]
+
+
+def Detect(img: Image.Image, useLines: bool, engine: str = AUTODRAW_ENGINES[0]) -> list[Polygon]:
+    """Run the auto-draw `engine` named in `AUTODRAW_ENGINES`."""
+    if engine == "OpenCV":
+        # cv2 is a slow import, only pay for it when the engine is used
+        from .CvDetect import DetectPanels
+
+        return DetectPanels(img, useLines)
+    return SliceImage(img, useLines, coarse=engine == "Grid (coarse)")
+
+
 if __name__ == "__main__":
     p = Path(sys.argv[1])
     SliceImage(Image.open(p), useLines=False)
@@ -0,0 +1,321 @@
+"""Hands-free splitting of the rest of a folder.
+
+Each page goes through decode, AutoDraw and Trim, then export, as EXPORT
+jobs on the scheduler. Up to `PIPELINE_DEPTH` pages are in flight, so
+decoding one page overlaps detecting the one before it and writing the
+one before that. Pages are exported strictly in folder order, one at a
+time. A page that `Confidence` flags stops the line for review: it is
+shown with its proposed panels, nothing after it is written, and the
+pages behind it keep decoding and detecting.
+"""
+
+import logging
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any
+
+from PIL import Image, ImageStat
+from PyQt6.QtCore import QObject, pyqtSignal
+
+from .Archive import HoldArchives, ReleaseArchives
+from .Components import Polygon
+from .Export import OUTPUT_CBZ, OUTPUT_FILES, Box, Uniform, WriteSections
+from .FolderIndex import GetFolderIndex
+from .ImageWidget import ImageWidget
+from .LayoutStore import ContentHash, Layout, SaveLayout
+from .Scheduler import EXPORT, ScheduledJob, Submit
+from .Strip import IsStrip
+from .Tasks import GuiCall
+from .Utility import RecordFileAdded
+
+# pages decoded, detected or being written at once
+PIPELINE_DEPTH = 3
+# review a page whose trimmed panels cover less than this fraction of it
+MIN_COVERAGE = 0.4
+# review a page split into more panels than this
+MAX_PANELS = 24
+# panels whose grey levels vary less than this are blank
+BLANK_STDDEV = 2.0
+# panels are shrunk to at most this size before the blank check
+BLANK_SAMPLE = 64
+
+
+def Confidence(image: Image.Image, sections: list[Box], skipUniform: bool) -> list[str]:
+    """Return why the split of `image` into `sections` needs review, if anything does.
+
+    `skipUniform` sections of a single color are empty grid cells the
+    export skips, not blank panels.
+    """
+    if not sections:
+        return ["no panels"]
+    width, height = image.size
+    reasons = []
+    if len(sections) == 1 and sections[0] == (0, 0, width, height):
+        reasons.append("no split found")
+    if len(sections) > MAX_PANELS:
+        reasons.append(f"{len(sections)} panels")
+    # panels may overlap in box mode, which only inflates coverage
+    covered = sum((r - x) * (b - y) for x, y, r, b in sections) / (width * height)
+    if covered < MIN_COVERAGE:
+        reasons.append(f"panels cover {covered:.0%}")
+    blank = 0
+    for box in sections:
+        region = image.crop(box)
+        if skipUniform and Uniform(region):
+            continue
+        region.thumbnail((BLANK_SAMPLE, BLANK_SAMPLE))
+        if ImageStat.Stat(region.convert("L")).stddev[0] < BLANK_STDDEV:
+            blank += 1
+    if blank:
+        reasons.append(f"{blank} blank panel{'s' if blank > 1 else ''}")
+    return reasons
+
+
+def DecodedBytes(path: Path) -> int:
+    """Return roughly how much memory decoding `path` takes, from its header."""
+    try:
+        with Image.open(path) as im:
+            return im.width * im.height * len(im.getbands())
+    except (OSError, ValueError):
+        return 0
+
+
+def Decode(path: Path) -> Image.Image:
+    with Image.open(path) as im:
+        im.load()
+        return im.copy()
+
+
+class AutopilotPage:
+    """One page on its way through the pipeline."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.image: Image.Image | None = None
+        self.polygons: list[Polygon] | None = None
+        self.sections: list[tuple[Box, Path]] = []
+        self.digest = ""
+        self.reasons: list[str] = []
+        self.reviewed = False
+        self.exporting = False
+        self.jobs: list[ScheduledJob] = []
+
+
+class Autopilot(QObject):
+    """Runs load, detect, trim, export and advance over a folder without keypresses."""
+
+    started = pyqtSignal(str)
+    progress = pyqtSignal(int, int)
+    paused = pyqtSignal(Path, list)
+    finished = pyqtSignal()
+
+    def __init__(self, parent: QObject | None = None) -> None:
+        super().__init__(parent)
+        self.generation = 0
+        self.running = False
+        self.review: AutopilotPage | None = None
+        self.pages: deque[AutopilotPage] = deque()
+        self.files: deque[Path] = deque()
+        self.total = 0
+        self.done = 0
+        self.viewer: ImageWidget | None = None
+        self.engine = ""
+        self.padding = 0
+        self.createSubdir = False
+        self.output = OUTPUT_FILES
+
+    def Start(
+        self,
+        viewer: ImageWidget,
+        start: Path,
+        engine: str,
+        padding: int,
+        createSubdir: bool,
+        output: str = OUTPUT_FILES,
+    ) -> None:
+        """Split `start` and every later page of its folder not yet processed, saved as `output`."""
+        self.Stop()
+        index = GetFolderIndex(start.parent)
+        names = list(index.names)
+        first = index.Position(start) or 0
+        self.files = deque(
+            start.parent / name
+            for name in names[first:]
+            if not index.IsProcessed(start.parent / name) and not IsStrip(start.parent / name)
+        )
+        if not self.files:
+            return
+        self.viewer = viewer
+        self.engine = engine
+        self.padding = padding
+        self.createSubdir = createSubdir
+        self.output = output
+        self.total = len(self.files)
+        self.done = 0
+        self.running = True
+        # one index write per archive for the whole run
+        HoldArchives()
+        self.started.emit("Autopilot")
+        self.Fill()
+
+    def Stop(self) -> None:
+        """Stop after the page being written; later pages are left as they are.
+
+        The page being written is still saved and marked processed when it finishes.
+        """
+        if not self.running:
+            return
+        self.generation += 1
+        self.running = False
+        self.review = None
+        for page in self.pages:
+            # a page being written finishes, so its panels and bookkeeping agree
+            if not page.exporting:
+                for job in page.jobs:
+                    job.Cancel()
+        self.pages.clear()
+        self.files.clear()
+        self.Finish()
+
+    def Resume(self, polygons: list[Polygon] | None = None) -> None:
+        """Accept the page under review, with `polygons` if the user edited them."""
+        page = self.review
+        if page is None or self.viewer is None or page.image is None:
+            return
+        if polygons is not None:
+            page.polygons = polygons
+            page.sections = self.viewer.Sections(
+                page.path,
+                polygons,
+                page.image.size,
+                self.viewer.SectionDir(page.path, self.createSubdir),
+            )
+            # a corrected split is as good as a manual one for matching later pages
+            from .Templates import RememberTemplate
+
+            RememberTemplate(page.image, self.viewer.MODE, polygons)
+        page.reviewed = True
+        self.review = None
+        self.Advance()
+
+    def Then(
+        self,
+        page: AutopilotPage,
+        fn: Callable[[], Any],
+        done: Callable[[Any], None],
+        memory: int = 0,
+    ) -> None:
+        """Run `fn` for `page` on the scheduler and `done` with its result on the GUI thread."""
+        generation = self.generation
+        job = Submit(EXPORT, fn, "autopilot", memory)
+        page.jobs.append(job)
+
+        def Finished(future: Future) -> None:
+            if future.cancelled() or (generation != self.generation and not page.exporting):
+                return
+            if future.exception() is not None:
+                logging.warning("Autopilot skipped %s: %s", page.path, future.exception())
+                self.Drop(page)
+                return
+            done(future.result())
+
+        job.future.add_done_callback(lambda f: GuiCall(lambda: Finished(f)))
+
+    def Fill(self) -> None:
+        while self.running and self.files and len(self.pages) < PIPELINE_DEPTH:
+            page = AutopilotPage(self.files.popleft())
+            self.pages.append(page)
+            self.Then(
+                page,
+                lambda p=page.path: Decode(p),
+                lambda im, p=page: self.Decoded(p, im),
+                DecodedBytes(page.path),
+            )
+
+    def Decoded(self, page: AutopilotPage, image: Image.Image) -> None:
+        page.image = image
+        viewer = self.viewer
+        if viewer is None:
+            return
+        engine, padding = self.engine, self.padding
+        dst = viewer.SectionDir(page.path, self.createSubdir)
+
+        def Split() -> tuple[list[Polygon], list[tuple[Box, Path]], list[str], str]:
+            polygons = viewer.AutoSplit(image, engine, padding)
+            sections = viewer.Sections(page.path, polygons, image.size, dst)
+            reasons = Confidence(image, [box for box, _ in sections], viewer.SKIP_UNIFORM)
+            return polygons, sections, reasons, ContentHash(page.path)
+
+        size = image.width * image.height * len(image.getbands())
+        self.Then(page, Split, lambda result: self.Detected(page, *result), size)
+
+    def Detected(
+        self,
+        page: AutopilotPage,
+        polygons: list[Polygon],
+        sections: list[tuple[Box, Path]],
+        reasons: list[str],
+        digest: str,
+    ) -> None:
+        page.polygons = polygons
+        page.sections = sections
+        page.reasons = reasons
+        page.digest = digest
+        self.Advance()
+
+    def Advance(self) -> None:
+        """Write the first page in folder order once it is detected and, if flagged, reviewed."""
+        if not self.running or not self.pages or self.review is not None:
+            return
+        page = self.pages[0]
+        if page.polygons is None or page.exporting:
+            return
+        if page.reasons and not page.reviewed:
+            self.review = page
+            self.paused.emit(page.path, page.reasons)
+            return
+        page.exporting = True
+        skipUniform = self.viewer.SKIP_UNIFORM if self.viewer is not None else False
+        dst = page.sections[0][1].parent if page.sections else page.path.parent
+        output = self.output
+
+        def Export() -> list[Path]:
+            if output != OUTPUT_CBZ and not dst.exists():
+                dst.mkdir()
+                RecordFileAdded(dst)
+            return WriteSections(page.path, page.sections, skipUniform, output)
+
+        layout = None
+        if self.viewer is not None and page.polygons:
+            layout = Layout(self.viewer.MODE, page.polygons, self.padding)
+
+        self.Then(page, Export, lambda _written: self.Exported(page, layout))
+
+    def Exported(self, page: AutopilotPage, layout: Layout | None) -> None:
+        if layout is not None:
+            # stored like a manual save, so reopening the page or X shows the same split
+            SaveLayout(page.path, page.digest, layout)
+        GetFolderIndex(page.path.parent).SetProcessed(page.path)
+        self.Drop(page)
+
+    def Drop(self, page: AutopilotPage) -> None:
+        """Take a finished or unreadable page out of the pipeline and move on."""
+        if page not in self.pages:
+            # written after Stop, the run it belonged to is over
+            return
+        self.pages.remove(page)
+        self.done += 1
+        self.progress.emit(self.done, self.total)
+        if not self.pages and not self.files:
+            self.running = False
+            self.Finish()
+            return
+        self.Fill()
+        self.Advance()
+
+    def Finish(self) -> None:
+        # behind a page still being written, which takes the archive lock
+        Submit(EXPORT, ReleaseArchives, "close archives")
+        self.finished.emit()
@@ -0,0 +1,281 @@
+"""Benchmarks for the split and trim hot paths.
+
+Run with ``uv run python -m src.Benchmark``. Every case is timed on synthetic
+pages and its peak traced allocation recorded; ``--save`` writes the results
+as a baseline and ``--baseline`` fails the run when a case regresses past the
+threshold.
+
+``--startup`` instead launches the app on one page and times it to the first
+painted frame, failing when the best launch exceeds ``--startup-budget``. Pass
+``--exe dist/image-splitter`` to time a frozen build the same way.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+
+from PIL import Image
+from PyQt6.QtCore import QPoint
+
+from .AutoDraw import (
+    AddBounds,
+    Detect,
+    GetSolidGrid,
+    GetSolidGridCoarse,
+    SimplifyRuns,
+    SliceImage,
+)
+from .LineCalcs import DetermineBoundary, TrimOrthoLines
+from .Synthetic import GeneratePage
+
+DEFAULT_SIZES = [1.0, 4.0]
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_REPEATS = 3
+# seconds from launch to the first painted frame
+STARTUP_BUDGET = 1.5
+MAIN_SCRIPT = Path(__file__).resolve().parent.parent / "main.py"
+# memory regressions below this many bytes are noise
+MEMORY_SLACK = 1024 * 1024
+APPS: list = []
+# folders created for the run, removed with the pages and panels in them when it ends
+TEMP_DIRS: list[Path] = []
+
+
+def TempDir(prefix: str) -> Path:
+    folder = Path(tempfile.mkdtemp(prefix=prefix))
+    TEMP_DIRS.append(folder)
+    return folder
+
+
+def RemoveTempDirs() -> None:
+    while TEMP_DIRS:
+        # the widgets' folder indexes may still hold their database open on Windows
+        shutil.rmtree(TEMP_DIRS.pop(), ignore_errors=True)
+
+
+# region Pages
+
+
+def MakePage(kind: str, megapixels: float, seed: int = 0) -> Image.Image:
+    """Return a synthetic page: `strip`, `grid` or `noisy` (JPEG-compressed grid)."""
+    pixels = megapixels * 1_000_000
+    if kind == "strip":
+        width = 800
+        height = round(pixels / width)
+        return GeneratePage(width, height, 1, max(height // 1200, 1), 60, seed=seed)[0]
+
+    width = round((pixels / 1.4) ** 0.5)
+    height = round(width * 1.4)
+    return GeneratePage(
+        width,
+        height,
+        4,
+        5,
+        max(width // 60, 8),
+        jpegQuality=70 if kind == "noisy" else None,
+        seed=seed,
+    )[0]
+
+
+# endregion
+# region Cases
+
+
+def SimplifyRunsCase(im: Image.Image) -> Callable[[], object]:
+    rows = GetSolidGrid(im)[0]
+    return lambda: SimplifyRuns(AddBounds(rows, im.height), im.height)
+
+
+def SaveSectionsCase(im: Image.Image, lines: bool) -> Callable[[], object]:
+    """Export the page through the widget's own SaveSections into a temp folder."""
+    folder = TempDir("splitter-bench-")
+    # keep layouts and templates from the benchmark out of the user's library
+    os.environ["IMAGE_SPLITTER_HOME"] = str(folder)
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt6.QtWidgets import QApplication
+
+    from .BoxesWidget import BoxWidget
+    from .LinesWidget import LineWidget
+
+    # widgets (and the directory watcher) die with the app, so keep it for the whole run
+    APPS.append(QApplication.instance() or QApplication([]))
+    source = folder / "page.png"
+    im.save(source)
+    widget = LineWidget(source) if lines else BoxWidget(source)
+    bounds = SliceImage(im, useLines=lines)
+    # time the crop and encode loop only, not the reload SaveSections ends with
+    widget.LoadImage = lambda *_args, **_kwargs: None
+
+    def Run() -> None:
+        widget.saveBounds = list(bounds)
+        widget.SaveSections(False)
+
+    return Run
+
+
+CASES: dict[str, Callable[[Image.Image], Callable[[], object]]] = {
+    "GetSolidGrid": lambda im: lambda: GetSolidGrid(im),
+    "SimplifyRuns": lambda im: SimplifyRunsCase(im),
+    "SliceImage": lambda im: lambda: SliceImage(im),
+    "SliceImage(lines)": lambda im: lambda: SliceImage(im, useLines=True),
+    "SliceImage(coarse)": lambda im: lambda: SliceImage(im, coarse=True),
+    "GetSolidGridCoarse": lambda im: lambda: GetSolidGridCoarse(im),
+    "Detect(OpenCV)": lambda im: lambda: Detect(im, False, "OpenCV"),
+    "DetermineBoundary": lambda im: lambda: DetermineBoundary(im, (0, 0, *im.size), 0),
+    "FindHorizontals": lambda im: (
+        lambda: TrimOrthoLines(
+            [QPoint(0, 5), QPoint(im.width, 5)],
+            im,
+            0,
+            list(im.size),
+        )
+    ),
+    "FindVerticals": lambda im: (
+        lambda: TrimOrthoLines(
+            [QPoint(5, 0), QPoint(5, im.height)],
+            im,
+            0,
+            list(im.size),
+        )
+    ),
+    "SaveSections(box)": lambda im: SaveSectionsCase(im, lines=False),
+    "SaveSections(lines)": lambda im: SaveSectionsCase(im, lines=True),
+}
+
+# endregion
+
+
+def Measure(run: Callable[[], object], repeats: int) -> tuple[float, int]:
+    """Return the best wall time over `repeats` runs and the peak traced allocation."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def RunSuite(
+    sizes: list[float],
+    kinds: list[str],
+    cases: list[str],
+    repeats: int,
+) -> dict[str, dict[str, float]]:
+    results: dict[str, dict[str, float]] = {}
+    for kind in kinds:
+        for size in sizes:
+            im = MakePage(kind, size)
+            for name in cases:
+                key = f"{name}[{kind}-{size:g}MP]"
+                seconds, peak = Measure(CASES[name](im), repeats)
+                results[key] = {"seconds": seconds, "peak": peak}
+                print(f"{key:<45} {seconds * 1000:10.1f} ms {peak / 2**20:10.1f} MiB", flush=True)
+    return results
+
+
+def MeasureStartup(exe: str | None, repeats: int) -> dict[str, dict[str, float]]:
+    """Return the best launch-to-first-frame time and the part spent after imports.
+
+    The app must not already be running, since it refuses a second instance.
+    """
+    folder = TempDir("splitter-startup-")
+    page = folder / "page.png"
+    MakePage("grid", 1.0).save(page)
+    report = folder / "probe.json"
+    env = {**os.environ, "IMAGE_SPLITTER_HOME": str(folder)}
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    command = [exe] if exe else [sys.executable, str(MAIN_SCRIPT)]
+
+    total = window = float("inf")
+    for _ in range(repeats):
+        report.unlink(missing_ok=True)
+        start = time.perf_counter()
+        # runs our own entry point, from this interpreter or the --exe build being measured
+        subprocess.run(  # noqa: S603
+            [*command, str(page), f"--startup-probe={report}"],
+            env=env,
+            check=True,
+        )
+        elapsed = time.perf_counter() - start
+        if elapsed < total:
+            total = elapsed
+            window = json.loads(report.read_text())["window"]
+
+    results = {
+        "startup": {"seconds": total, "peak": 0},
+        "startup(window)": {"seconds": window, "peak": 0},
+    }
+    for key, result in results.items():
+        print(f"{key:<45} {result['seconds'] * 1000:10.1f} ms", flush=True)
+    return results
+
+
+def Regressions(
+    results: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]],
+    threshold: float,
+) -> list[str]:
+    out = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        base = baseline[key]
+        if result["seconds"] > base["seconds"] * (1 + threshold):
+            out.append(f"{key}: {base['seconds']:.4f}s -> {result['seconds']:.4f}s")
+        if result["peak"] > base["peak"] * (1 + threshold) + MEMORY_SLACK:
+            out.append(f"{key}: {base['peak']} B -> {result['peak']} B peak")
+    return out
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=float, nargs="+", default=DEFAULT_SIZES, help="MP")
+    parser.add_argument("--kinds", nargs="+", default=["strip", "grid", "noisy"])
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES))
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--baseline", type=Path, help="fail on regressions against this file")
+    parser.add_argument("--save", type=Path, help="write results as a new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--startup", action="store_true", help="time app startup instead")
+    parser.add_argument("--exe", help="frozen executable to time with --startup")
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET, help="seconds")
+    args = parser.parse_args()
+    if args.baseline and not args.baseline.is_file():
+        parser.error(f"baseline {args.baseline} does not exist")
+
+    regressions: list[str] = []
+    try:
+        if args.startup:
+            results = MeasureStartup(args.exe, args.repeats)
+            if results["startup"]["seconds"] > args.startup_budget:
+                regressions.append(
+                    f"startup: {results['startup']['seconds']:.3f}s over the "
+                    f"{args.startup_budget:.3f}s budget",
+                )
+        else:
+            results = RunSuite(args.sizes, args.kinds, args.cases, args.repeats)
+    finally:
+        RemoveTempDirs()
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2))
+    if args.baseline:
+        regressions += Regressions(results, json.loads(args.baseline.read_text()), args.threshold)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
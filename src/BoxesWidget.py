@@ -4,26 +4,32 @@ import contextlib
 import random
 from pathlib import Path
 
-import pyperclip as clipboard
+from PIL import Image
 from PyQt6.QtCore import QPoint, QRect, QSize, Qt
-from PyQt6.QtGui import QColor, QImage, QMouseEvent, QPainter, QPaintEvent, QPen, QRegion
+from PyQt6.QtGui import QColor, QMouseEvent, QPainter, QPaintEvent, QPen, QRegion
 
-from src.AutoDraw import SliceImage
-from src.Components import Polygon
+from src.Components import AUTODRAW_ENGINES, Polygon
+from src.Document import ImageDocument
+from src.Export import OUTPUT_CBZ, OUTPUT_FILES, Box
 from src.ImageWidget import AVAILABLE_COLORS, ImageWidget
-from src.LineCalcs import DetermineBoundary
-from src.TranslateArea import ExtractText, PutTextOnPolygon, TranslateText
+from src.Profiling import Timed
+from src.Scheduler import Checkpoint
+from src.Tasks import Job
+from src.Utility import RecordFileAdded
 
 
 class BoxWidget(ImageWidget):
     """Box drawing image widget."""
 
+    MODE = "box"
+
     def __init__(
         self,
         image_path: Path | None = None,
         polygons: list[Polygon] | None = None,
+        document: ImageDocument | None = None,
     ) -> None:
-        super().__init__(image_path, polygons)
+        super().__init__(image_path, polygons, document)
 
         # Box drawing state
         self.drawing_box = False
@@ -45,6 +51,7 @@ class BoxWidget(ImageWidget):
             poly = Polygon.FromRect(rect, self.currentColor)
             poly.BindTo(width=self.pixmap.width(), height=self.pixmap.height())
             self.saveBounds.append(poly)
+            self.BoundsChanged()
 
         self.update()
 
@@ -97,6 +104,7 @@ class BoxWidget(ImageWidget):
     # endregion
     # region Overloads
     def AddGrid(self, vert: int, horz: int) -> None:
+        self.gridSpec = f"{vert}x{horz}"
         vertSpacing = round(self.pixmap.width() / vert)
         horzSpacing = round(self.pixmap.height() / horz)
         for horzIdx in range(horz):
@@ -111,6 +119,7 @@ class BoxWidget(ImageWidget):
                 )
 
             self.update()
+        self.BoundsChanged()
 
     @property
     def isFullyCovered(self) -> bool:
@@ -131,57 +140,121 @@ class BoxWidget(ImageWidget):
                 region = region.united(QRegion(rect))
         return region.boundingRect() == img_rect
 
-    def Trim(self, padding: int) -> None:
-        if self.image_path is not None:
-            for poly in self.saveBounds:
-                with contextlib.suppress(IndexError):
-                    if poly.isRectangle:
-                        corners = poly.bounding_points
-                        if corners is None or None in corners:
-                            print("Invalid bounding points for trimming.")
-                            continue
-                        poly.Points = DetermineBoundary(
-                            self.image_obj,
-                            corners,
-                            padding,
-                        )
-        self.update()
+    def TrimBounds(
+        self,
+        image: Image.Image,
+        boxes: list[Polygon],
+        padding: int,
+    ) -> list[tuple[Polygon, list[QPoint]]]:
+        """Return each box of `boxes` that can be trimmed with its trimmed points."""
+        from src.LineCalcs import DetermineBoundary
+
+        trimmed = []
+        for idx, poly in enumerate(boxes):
+            Checkpoint(idx, len(boxes))
+            with contextlib.suppress(IndexError):
+                if poly.isRectangle:
+                    corners = poly.bounding_points
+                    if corners is None or None in corners:
+                        print("Invalid bounding points for trimming.")
+                        continue
+                    trimmed.append((poly, DetermineBoundary(image, corners, padding)))
+        return trimmed
+
+    def AutoSplit(self, image: Image.Image, engine: str, padding: int) -> list[Polygon]:
+        from src.AutoDraw import Detect
+        from src.Templates import MatchTemplate
+
+        found = MatchTemplate(image, self.MODE) or Detect(image, False, engine)
+        for poly, points in self.TrimBounds(image, found, padding):
+            poly.Points = points
+        return found
+
+    def TrimJob(self, padding: int) -> Job | None:
+        image = self.image_obj
+        boxes = list(self.saveBounds) if self.image_path is not None else []
+
+        def Work() -> list[tuple[Polygon, list[QPoint]]]:
+            return self.TrimBounds(image, boxes, padding)
+
+        def Apply(trimmed: list[tuple[Polygon, list[QPoint]]]) -> None:
+            self.trimPadding = padding
+            # boxes deleted while trimming stay deleted
+            current = {id(x) for x in self.saveBounds}
+            for poly, points in trimmed:
+                if id(poly) in current:
+                    poly.Points = points
+            if self.image_path is not None:
+                self.BoundsChanged()
+            self.update()
+
+        return Work, Apply
 
-    def AutoDraw(self) -> None:
-        if self.image_path:
-            self.saveBounds.extend(SliceImage(self.image_obj))
+    def AutoDrawJob(self, engine: str = AUTODRAW_ENGINES[0]) -> Job | None:
+        from src.AutoDraw import Detect
+        from src.Templates import MatchTemplate
+
+        if not self.image_path:
+            return None
+        image = self.image_obj
+
+        def Work() -> list[Polygon]:
+            # a known page layout is cheaper and usually better than slicing again
+            return MatchTemplate(image, self.MODE) or Detect(image, False, engine)
+
+        def Apply(found: list[Polygon]) -> None:
+            self.saveBounds.extend(found)
+            self.BoundsChanged()
             print(self.saveBounds)
 
-    def Translate(self, Autotranslate: bool = True) -> None:
-        if self.image_path is None or not self.image_path.exists():
-            return
+        return Work, Apply
+
+    def TranslateJob(self, Autotranslate: bool = True) -> Job | None:
+        if self.image_path is None or not self.image_path.exists() or self.image_obj is None:
+            return None
         if self.saveBounds == []:
-            return
+            return None
+
+        # OCR and translation pull in pytesseract and requests, so load them on first use
+        import pyperclip as clipboard
+
+        from src.TranslateArea import ExtractText, PutTextOnPolygon, TranslateText
+
+        image = self.image_obj
+        boxes = list(self.saveBounds)
+
+        def Work() -> Image.Image:
+            texts = ExtractText(image, boxes)
+            Checkpoint()
+            if Autotranslate:
+                translated_texts = TranslateText(texts, target_language="en")
+            else:
+                translated_texts = []
+                for t in texts:
+                    clipboard.copy(t)
+                    translated_texts.append(input(t + ": "))
+            # keep image_obj as the original so the history can diff against it
+            edited = image
+            for idx, p in enumerate(zip(boxes, translated_texts, strict=True)):
+                Checkpoint(idx, len(boxes))
+                if p[0] and p[1]:
+                    edited = PutTextOnPolygon(edited, p[0], p[1])
+            return edited
+
+        def Apply(edited: Image.Image) -> None:
+            if edited is not image:
+                self.SafeOverwrite(edited)
+            self.update()
 
-        texts = ExtractText(self.image_obj, self.saveBounds)
-        if Autotranslate:
-            translated_texts = TranslateText(texts, target_language="en")
-        else:
-            translated_texts = []
-            for t in texts:
-                clipboard.copy(t)
-                translated_texts.append(input(t + ": "))
-        changed = False
-        for p in zip(self.saveBounds, translated_texts, strict=True):
-            if p[0] and p[1]:
-                self.image_obj = PutTextOnPolygon(self.image_obj, p[0], p[1])
-                changed = True
-        if changed:
-            self.SafeOverwrite(self.image_obj)
-        self.update()
+        return Work, Apply
 
     def Crop(self, keepBounds: bool = False) -> None:
         if self.image_path and len(self.saveBounds) == 1:
             bounds = self.saveBounds if keepBounds else []
             poly = self.saveBounds[0].bounding_points
-            im = self.image_obj.crop(poly)
-            self.SafeOverwrite(im)
-            self.saveBounds = bounds
+            with self.document.history.Group():
+                self.SafeOverwrite(self.image_obj.crop(poly), poly)
+                self.saveBounds = bounds
 
         self.update()
 
@@ -189,29 +262,43 @@ class BoxWidget(ImageWidget):
     def ReadyToCrop(self) -> bool:
         return len(self.saveBounds) == 1
 
-    def SaveSections(self, createSubdir: bool) -> None:
-        if self.image_path is None or not self.image_path.exists():
-            return
-        qImage = QImage(str(self.image_path))
-        if qImage.isNull():
-            return
-        if self.saveBounds == []:
-            return
-
-        dst: Path = (
-            (self.image_path.parent / self.image_path.stem)
-            if createSubdir
-            else self.image_path.parent
-        )
-        dst.mkdir(exist_ok=True)
+    def Sections(
+        self,
+        path: Path,
+        bounds: list[Polygon],
+        _size: tuple[int, int],
+        dst: Path,
+    ) -> list[tuple[Box, Path]]:
         # Save each rectangle as a separate image
-        for idx, poly in enumerate(self.saveBounds, start=1):
+        sections = []
+        for idx, poly in enumerate(bounds, start=1):
             rect = poly.bounding_rect
             if rect.width() > 0 and rect.height() > 0:
-                cropped = qImage.copy(rect)
-                output_path = dst / f"{self.image_path.stem} {idx:03d}.png"
-                cropped.save(str(output_path))
-        if self.saveBounds:
+                box = (rect.x(), rect.y(), rect.x() + rect.width(), rect.y() + rect.height())
+                sections.append((box, dst / f"{path.stem} {idx:03d}.png"))
+        return sections
+
+    @Timed("SaveSections")
+    def SaveSections(self, createSubdir: bool, output: str = OUTPUT_FILES) -> None:
+        if self.image_path is None or not self.image_path.exists() or self.image_obj is None:
+            return
+        if self.saveBounds == []:
+            return
+        from src.Export import WriteSections
+        from src.Templates import RememberTemplate
+
+        self.StoreLayout()
+        RememberTemplate(self.image_obj, self.MODE, self.saveBounds)
+
+        dst = self.SectionDir(self.image_path, createSubdir)
+        # an archive holds its subfolder itself
+        if output != OUTPUT_CBZ:
+            dst.mkdir(exist_ok=True)
+            if createSubdir:
+                RecordFileAdded(dst)
+        sections = self.Sections(self.image_path, self.saveBounds, self.image_obj.size, dst)
+        WriteSections(self.image_path, sections, output=output)
+        if self.saveBounds and output == OUTPUT_FILES:
             self.LoadImage(dst / f"{self.image_path.stem} 001.png")
 
     # endregion
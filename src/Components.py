@@ -3,6 +3,9 @@
 from PyQt6.QtCore import QPoint, QRect
 from PyQt6.QtGui import QColor
 
+# auto-draw detectors offered in the UI, the first is the default
+AUTODRAW_ENGINES = ["Grid", "Grid (coarse)", "OpenCV"]
+
 
 class Polygon:
     """."""
@@ -96,6 +99,14 @@ class Polygon:
             return NotImplemented
         return sorted(self.RawPoints) == sorted(other.RawPoints) and self.Color == other.Color
 
+    def ToDict(self) -> dict:
+        """Serialize points and color to plain JSON types."""
+        return {"points": self.RawPoints, "color": self.Color.name(QColor.NameFormat.HexArgb)}
+
+    @classmethod
+    def FromDict(cls, data: dict) -> "Polygon":
+        return cls([QPoint(x, y) for x, y in data["points"]], QColor(data["color"]))
+
     def Translate(self, dx: int, dy: int) -> "Polygon":
         """Return a new polygon translated by dx, dy."""
         new_points = [QPoint(p.x() + dx, p.y() + dy) for p in self.Points]
@@ -0,0 +1,106 @@
+"""Panel detection with OpenCV for noisy scans.
+
+Unlike `GetSolidGrid`, gutters do not have to be perfectly uniform or span
+the whole page: the page is binarized against its border color, cleaned up
+with morphology and every large connected component becomes a panel.
+"""
+
+import cv2
+import numpy as np
+from PIL import Image
+from PyQt6.QtCore import QPoint
+from PyQt6.QtGui import QColor
+
+from .AutoDraw import MIN_SECTION
+from .Components import Polygon
+from .LineCalcs import TOLERANCE
+from .Scheduler import Checkpoint
+
+# detection runs on a copy downscaled to about this many pixels
+WORK_PIXELS = 4_000_000
+# components smaller than this fraction of the page are dust or stray marks
+MIN_PANEL_AREA = 0.01
+# closing kernel at detection scale; bridges hairline gaps in a panel's outline
+# while leaving any real gutter open
+CLOSE_SIZE = 5
+
+
+def BackgroundLevel(gray: np.ndarray) -> int:
+    """Return the median gray level of the page border."""
+    border = np.concatenate([gray[0], gray[-1], gray[:, 0], gray[:, -1]])
+    return int(np.median(border))
+
+
+def Foreground(gray: np.ndarray) -> np.ndarray:
+    """Return a 0/255 mask of everything that is not gutter."""
+    diff = cv2.absdiff(gray, np.full_like(gray, BackgroundLevel(gray)))
+    _, mask = cv2.threshold(diff, TOLERANCE, 255, cv2.THRESH_BINARY)
+    # opening removes dust and JPEG ringing in the gutters
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+    return cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((CLOSE_SIZE, CLOSE_SIZE), np.uint8))
+
+
+def PanelBoxes(img: Image.Image) -> list[tuple[int, int, int, int]]:
+    """Return panel rectangles (left, top, right, bottom) in reading order."""
+    width, height = img.size
+    scale = min(1.0, (WORK_PIXELS / (width * height)) ** 0.5)
+    gray = cv2.cvtColor(np.asarray(img.convert("RGB")), cv2.COLOR_RGB2GRAY)
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    Checkpoint()
+
+    count, _, stats, _ = cv2.connectedComponentsWithStats(Foreground(gray), connectivity=8)
+    minArea = MIN_PANEL_AREA * gray.shape[0] * gray.shape[1]
+    minSide = MIN_SECTION * scale / 2
+    boxes = []
+    for x, y, w, h, area in stats[1:count]:
+        if area < minArea or min(w, h) < minSide:
+            continue
+        boxes.append(
+            (
+                max(round(x / scale), 0),
+                max(round(y / scale), 0),
+                min(round((x + w) / scale), width),
+                min(round((y + h) / scale), height),
+            ),
+        )
+    # components nested in another panel (art inside a borderless panel) are not panels
+    boxes = [
+        b
+        for b in boxes
+        if not any(
+            o != b and o[0] <= b[0] and o[1] <= b[1] and o[2] >= b[2] and o[3] >= b[3]
+            for o in boxes
+        )
+    ]
+    return sorted(boxes, key=lambda b: (b[1] // max(MIN_SECTION, 1), b[0]))
+
+
+def EdgeLines(edges: list[int]) -> list[int]:
+    """Merge edges closer than `TOLERANCE` into their mean."""
+    out: list[list[int]] = []
+    for edge in sorted(edges):
+        if out and edge - out[-1][-1] <= TOLERANCE:
+            out[-1].append(edge)
+        else:
+            out.append([edge])
+    return [round(sum(group) / len(group)) for group in out]
+
+
+def DetectPanels(img: Image.Image, useLines: bool = False) -> list[Polygon]:
+    """Return panels as boxes, or their edges as lines, in the format of `SliceImage`."""
+    width, height = img.size
+    boxes = PanelBoxes(img)
+    Checkpoint()
+    if not useLines:
+        if not boxes:
+            return [Polygon([QPoint(0, 0), QPoint(width, height)], QColor("blue"))]
+        return [Polygon([QPoint(b[0], b[1]), QPoint(b[2], b[3])], QColor("blue")) for b in boxes]
+
+    if len(boxes) < 2:
+        return []
+    cols = EdgeLines([x for b in boxes for x in (b[0], b[2])])
+    rows = EdgeLines([y for b in boxes for y in (b[1], b[3])])
+    return [Polygon([QPoint(0, y), QPoint(width, y)], QColor("purple")) for y in rows] + [
+        Polygon([QPoint(x, 0), QPoint(x, height)], QColor("purple")) for x in cols
+    ]
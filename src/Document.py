@@ -0,0 +1,66 @@
+"""Image state shared by the line and box widgets."""
+
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any
+
+from PIL import Image
+from PyQt6.QtCore import QPoint
+from PyQt6.QtGui import QPixmap
+
+from .History import History
+from .LayoutStore import Layout
+
+
+class ImageDocument:
+    """One open image: its decoded forms, per-mode layouts and view transform.
+
+    Widgets attach to a document instead of owning this state, so switching
+    between line and box mode hands the new widget the already decoded image,
+    its polygons and the current zoom and pan without touching the disk.
+    """
+
+    def __init__(self) -> None:
+        self.image_path: Path | None = None
+        self.last_path: Path | None = None
+        self.image_loaded: bool = False
+        self.image_digest: str | None = None
+        # hash of the open file in flight, keyed like DIGEST_CACHE, for whichever widget is shown
+        self.digestJob: tuple[tuple[str, int, int], Future] | None = None
+        self.pixmap: QPixmap = QPixmap()
+        self.image_obj: Image.Image | None = None
+        # tall strips are left undecoded for J to split from disk
+        self.stripMode: bool = False
+        # polygons and their settings, one layout per widget MODE
+        self.layouts: dict[str, Layout] = {}
+        self.zoom: float = 1.0
+        self.offset: QPoint = QPoint()
+        # widget size `offset` was laid out for; None recentres on the next scaling
+        self.viewSize: tuple[int, int] | None = None
+        self.history = History()
+
+    def LayoutFor(self, mode: str) -> Layout:
+        if mode not in self.layouts:
+            self.layouts[mode] = Layout(mode, [])
+        return self.layouts[mode]
+
+    def ResetView(self) -> None:
+        self.zoom = 1.0
+        self.offset = QPoint()
+        self.viewSize = None
+
+
+class Shared[T]:
+    """Widget attribute stored on the widget's `document`."""
+
+    def __set_name__(self, _owner: type, name: str) -> None:
+        """Store the attribute under the same name on the document."""
+        self.name = name
+
+    def __get__(self, obj: Any, _objtype: type | None = None) -> T:
+        """Read the attribute from ``obj.document``."""
+        return getattr(obj.document, self.name)
+
+    def __set__(self, obj: Any, value: T) -> None:
+        """Write the attribute to ``obj.document``."""
+        setattr(obj.document, self.name, value)
@@ -0,0 +1,215 @@
+"""Perceptual-hash duplicate detection for a folder of pages."""
+
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+from PIL import Image
+
+from .FolderIndex import FolderIndex, GetFolderIndex
+from .Scheduler import INDEX, Cancelled, Checkpoint, Submit
+from .Utility import AddDirListener
+
+HASH_SIZE = 8
+# dHash bits that may differ for two files to count as the same page
+DUPLICATE_DISTANCE = 6
+# new hashes written to the folder index together, in one short transaction
+COMMIT_EVERY = 64
+
+# running indexers keyed by folder
+DUPLICATE_INDEXES: dict[str, "DuplicateIndex"] = {}
+
+
+def DHash(path: Path) -> int:
+    """Return the 64-bit difference hash of the image at `path`.
+
+    JPEGs are decoded in draft mode at a fraction of their size, which is all
+    a 9x8 gradient needs.
+    """
+    with Image.open(path) as im:
+        im.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+        small = im.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            bits = (bits << 1) | (left < right)
+    return bits
+
+
+def HammingDistance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance, for near-neighbour queries."""
+
+    def __init__(self) -> None:
+        # node: (hash, names with that hash, children keyed by distance)
+        self.root: tuple[int, list[str], dict[int, tuple]] | None = None
+
+    def Add(self, value: int, name: str) -> None:
+        if self.root is None:
+            self.root = (value, [name], {})
+            return
+        node = self.root
+        while True:
+            dist = HammingDistance(value, node[0])
+            if dist == 0:
+                if name not in node[1]:
+                    node[1].append(name)
+                return
+            if dist not in node[2]:
+                node[2][dist] = (value, [name], {})
+                return
+            node = node[2][dist]
+
+    def Search(self, value: int, maxDist: int) -> list[tuple[int, str]]:
+        """Return (distance, name) for every entry within `maxDist` of `value`."""
+        out: list[tuple[int, str]] = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            dist = HammingDistance(value, node[0])
+            if dist <= maxDist:
+                out.extend((dist, name) for name in node[1])
+            # triangle inequality bounds which children can hold matches
+            stack.extend(
+                child
+                for childDist, child in node[2].items()
+                if dist - maxDist <= childDist <= dist + maxDist
+            )
+        return sorted(out)
+
+
+class DuplicateIndex:
+    """Hashes a folder's images as INDEX jobs on the scheduler and answers duplicate queries."""
+
+    def __init__(self, folder: Path) -> None:
+        self.folder = folder
+        self.tree = BKTree()
+        self.hashes: dict[str, int] = {}
+        self.lock = threading.Lock()
+        index = GetFolderIndex(folder)
+        self.dbPath = index.dbPath
+        self.Queue(list(index.names))
+        AddDirListener(folder, self.OnChanged)
+
+    def OnChanged(self, added: list[Path], _removed: list[Path]) -> None:
+        if added:
+            self.Queue([x.name for x in added])
+
+    def Queue(self, names: list[str]) -> None:
+        Submit(INDEX, lambda: self.HashFiles(names), "dhash")
+
+    def HashFiles(self, names: list[str]) -> None:
+        conn = sqlite3.connect(self.dbPath, timeout=30) if self.dbPath else None
+        try:
+            stored = {}
+            if conn is not None:
+                FolderIndex.CreateTables(conn)
+                stored = {
+                    name: (mtime_ns, int(dhash, 16))
+                    for name, mtime_ns, dhash in conn.execute(
+                        "SELECT name, mtime_ns, dhash FROM hashes",
+                    )
+                }
+            # rows hashed but not yet written; no transaction is open while decoding,
+            # so the GUI thread's writes to the same index never wait on a hash
+            pending: list[tuple[str, int, str]] = []
+            try:
+                for name in names:
+                    # yields to user work here; hashes written so far are not redone
+                    Checkpoint()
+                    if (row := self.HashFile(stored, name)) is not None:
+                        pending.append(row)
+                    if conn is not None and len(pending) >= COMMIT_EVERY:
+                        self.WriteHashes(conn, pending)
+            finally:
+                if conn is not None:
+                    self.WriteHashes(conn, pending)
+        except Cancelled:
+            raise
+        except Exception:
+            logging.exception("Duplicate indexing failed for %s", self.folder)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    @staticmethod
+    def WriteHashes(conn: sqlite3.Connection, pending: list[tuple[str, int, str]]) -> None:
+        if not pending:
+            return
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO hashes (name, mtime_ns, dhash) VALUES (?, ?, ?)",
+                pending,
+            )
+        pending.clear()
+
+    def HashFile(
+        self,
+        stored: dict[str, tuple[int, int]],
+        name: str,
+    ) -> tuple[str, int, str] | None:
+        """Hash `name` into the tree and return its row to store, if it was not stored."""
+        path = self.folder / name
+        row = None
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+            if name in stored and stored[name][0] == mtime_ns:
+                value = stored[name][1]
+            else:
+                value = DHash(path)
+                row = (name, mtime_ns, f"{value:016x}")
+        except (OSError, ValueError):
+            logging.debug("Could not hash %s", path)
+            return None
+        with self.lock:
+            self.hashes[name] = value
+            self.tree.Add(value, name)
+        return row
+
+    def Find(
+        self,
+        path: Path,
+        maxDist: int = DUPLICATE_DISTANCE,
+        existing: bool = True,
+    ) -> list[Path]:
+        """Return other files in the folder within `maxDist` bits of `path`.
+
+        With `existing` False, files moved away since they were hashed are included.
+        """
+        with self.lock:
+            value = self.hashes.get(path.name)
+            matches = [] if value is None else self.tree.Search(value, maxDist)
+            # overwritten files leave their old hash in the tree, so recheck the current one
+            names = [
+                name
+                for _, name in matches
+                if name != path.name
+                and HammingDistance(value, self.hashes[name]) <= maxDist  # pyright: ignore[reportArgumentType]
+            ]
+        return [
+            self.folder / name for name in names if not existing or (self.folder / name).exists()
+        ]
+
+
+def GetDuplicateIndex(folder: Path) -> DuplicateIndex:
+    """Return the indexer for `folder`, starting it on first use."""
+    key = str(folder)
+    if key not in DUPLICATE_INDEXES:
+        DUPLICATE_INDEXES[key] = DuplicateIndex(folder)
+    return DUPLICATE_INDEXES[key]
+
+
+def NearDuplicates(
+    path: Path,
+    maxDist: int = DUPLICATE_DISTANCE,
+    existing: bool = True,
+) -> list[Path]:
+    """Return already-indexed pages that look like `path`, closest first."""
+    return GetDuplicateIndex(path.parent).Find(path, maxDist, existing)
@@ -0,0 +1,461 @@
+"""Panel export that decodes only the parts of the source it needs.
+
+`RegionReader` picks the cheapest way a file can be read partially:
+
+- uncompressed rasters (plain TIFF, BMP, PPM) by seeking straight to the rows,
+- tiled or multi-strip TIFFs one tile at a time,
+- non-interlaced 8-bit PNGs as a stream of row bands, so memory stays bounded
+  by the band and the regions being assembled,
+- baseline JPEGs through Qt's reader, which decodes only a clip rectangle,
+
+and falls back to a full decode for everything else.
+"""
+
+import logging
+import struct
+import zlib
+from collections import OrderedDict
+from collections.abc import Iterator
+from io import BytesIO
+from pathlib import Path
+from types import TracebackType
+
+from PIL import Image
+from PyQt6.QtCore import QRect
+from PyQt6.QtGui import QImage, QImageReader
+
+from .Profiling import Span, Timed
+from .Utility import RecordFileAdded
+
+Box = tuple[int, int, int, int]
+
+# rows per band when streaming PNGs
+BAND_ROWS = 1024
+# rows per clipped JPEG read when streaming bands
+JPEG_CHUNK_ROWS = 8192
+# decoded TIFF tiles kept while assembling regions
+TILE_CACHE = 16
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# samples per pixel for each PNG color type
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+# modes PNG can store as they are
+PNG_MODES = {"1", "L", "LA", "I", "I;16", "P", "RGB", "RGBA"}
+# where saved sections go, the first is the default
+OUTPUT_FILES = "Files"
+OUTPUT_MANIFEST = "Manifest"
+OUTPUT_CBZ = "CBZ"
+OUTPUT_MODES = [OUTPUT_FILES, OUTPUT_MANIFEST, OUTPUT_CBZ]
+
+
+def WriteChunk(out: BytesIO, kind: bytes, *parts: bytes) -> None:
+    """Write a PNG chunk whose data is the concatenation of `parts`."""
+    crc = zlib.crc32(kind)
+    for part in parts:
+        crc = zlib.crc32(part, crc)
+    out.write(struct.pack(">I", sum(len(part) for part in parts)) + kind)
+    out.writelines(parts)
+    out.write(struct.pack(">I", crc))
+
+
+class RegionReader:
+    """Read rectangular regions of an image file without decoding all of it.
+
+    Use as a context manager; `Crops` yields regions as soon as each is
+    complete and `Bands` streams the whole image top to bottom.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.image = Image.open(path)
+        self.size = self.image.size
+        self.mode = self.image.mode
+        self.tiles: OrderedDict[int, Image.Image] = OrderedDict()
+        self.tileBytes: tuple[int, ...] = ()
+        # chunk index of a streamable PNG, filled in by PngHeader
+        self.png: dict = {}
+        # raw mode, stride and orientation of an uncompressed image
+        self.layout: tuple[str, int, int] | None = None
+        self.strategy = self.Strategy()
+
+    def __enter__(self) -> "RegionReader":
+        """Return the reader."""
+        return self
+
+    def __exit__(
+        self,
+        _excType: type[BaseException] | None,
+        _exc: BaseException | None,
+        _tb: TracebackType | None,
+    ) -> None:
+        """Close the source file."""
+        self.image.close()
+
+    # region Strategy
+    def Strategy(self) -> str:
+        image = self.image
+        if getattr(image, "n_frames", 1) > 1 or not image.tile:
+            return "full"
+        if len(image.tile) > 1 and image.format == "TIFF":
+            tags = image.tag_v2
+            # byte counts of tiles, or of strips for striped files
+            self.tileBytes = tags.get(325) or tags.get(279) or ()
+            if tags.get(284, 1) == 1 and len(self.tileBytes) == len(image.tile):
+                return "tiles"
+            return "full"
+        tile = image.tile[0]
+        if tile.codec_name == "raw" and tile.extents == (0, 0, *self.size):
+            self.layout = self.RawLayout()
+            if self.layout:
+                return "raw"
+        if image.format == "PNG" and self.PngHeader():
+            return "png"
+        if image.format == "JPEG" and not image.info.get("progressive"):
+            return "jpeg"
+        return "full"
+
+    def RawLayout(self) -> tuple[str, int, int] | None:
+        """Return the raw mode, row stride and orientation of an uncompressed image."""
+        args = self.image.tile[0].args
+        rawmode, stride, orientation = (args, 0, 1) if isinstance(args, str) else (*args, 0, 1)[:3]
+        if not stride:
+            try:
+                stride = len(Image.new(self.mode, (self.size[0], 1)).tobytes("raw", rawmode))
+            except ValueError:
+                return None
+        return rawmode, stride, orientation
+
+    def PngHeader(self) -> bool:
+        """Index the chunks of a PNG that can be streamed: 8-bit and not interlaced."""
+        with self.path.open("rb") as fp:
+            if fp.read(8) != PNG_SIGNATURE:
+                return False
+            header, extra, idat = b"", [], []
+            while chunk := fp.read(8):
+                length, kind = struct.unpack(">I4s", chunk)
+                if kind == b"IDAT":
+                    idat.append((fp.tell(), length))
+                    fp.seek(length + 4, 1)
+                    continue
+                data = fp.read(length)
+                fp.seek(4, 1)
+                if kind == b"IHDR":
+                    header = data
+                elif kind in (b"PLTE", b"tRNS"):
+                    extra.append((kind, data))
+                elif kind == b"IEND":
+                    break
+        if len(header) != 13:
+            return False
+        width, _, depth, color, _, _, interlace = struct.unpack(">IIBBBBB", header)
+        if depth != 8 or interlace or color not in PNG_CHANNELS:
+            return False
+        self.png = {
+            "header": header,
+            "extra": extra,
+            "idat": idat,
+            "rowBytes": width * PNG_CHANNELS[color],
+        }
+        return True
+
+    # endregion
+
+    # region Reading
+    def Bands(self, rows: int = BAND_ROWS) -> Iterator[tuple[int, Image.Image]]:
+        """Yield (top, band) for consecutive full-width bands covering the image."""
+        width, height = self.size
+        if self.strategy == "png":
+            yield from self.PngBands(rows)
+            return
+        if self.strategy in ("raw", "tiles"):
+            for top in range(0, height, rows):
+                yield top, self.Crop((0, top, width, min(top + rows, height)))
+            return
+        if self.strategy == "jpeg":
+            # every clipped read starts decoding at the top, so read large chunks
+            step = max(rows, JPEG_CHUNK_ROWS)
+            for start in range(0, height, step):
+                chunk = self.JpegCrop((0, start, width, min(start + step, height)))
+                for top in range(0, chunk.height, rows):
+                    yield start + top, chunk.crop((0, top, width, min(top + rows, chunk.height)))
+            return
+        # formats that cannot be read in pieces are decoded once
+        image = self.Decoded()
+        for top in range(0, height, rows):
+            yield top, image.crop((0, top, width, min(top + rows, height)))
+
+    def PngBands(self, rows: int) -> Iterator[tuple[int, Image.Image]]:
+        """Inflate the IDAT stream and decode it band by band.
+
+        Each band is wrapped into a small PNG whose first row is the previous
+        band's last row stored unfiltered, since PNG filters refer to the row
+        above.
+        """
+        rowBytes = self.png["rowBytes"]
+        line = rowBytes + 1
+        inflater = zlib.decompressobj()
+        pending = b""
+        previous: bytes | None = None
+        top = 0
+        height = self.size[1]
+        with self.path.open("rb") as fp:
+            for offset, length in self.png["idat"]:
+                fp.seek(offset)
+                compressed = fp.read(length)
+                while top < height:
+                    # inflate at most one band at a time, highly compressible pages
+                    # expand a single chunk to many megabytes
+                    inflated = inflater.decompress(compressed, rows * line)
+                    compressed = inflater.unconsumed_tail
+                    pending += inflated
+                    count = min(rows, height - top)
+                    if len(pending) < count * line:
+                        if not inflated and not compressed:
+                            break
+                        continue
+                    band = self.DecodePngRows(memoryview(pending)[: count * line], count, previous)
+                    pending = pending[count * line :]
+                    previous = band.crop((0, count - 1, band.width, count)).tobytes()
+                    yield top, band
+                    top += count
+
+    def DecodePngRows(
+        self,
+        data: memoryview,
+        count: int,
+        previous: bytes | None,
+    ) -> Image.Image:
+        packer = zlib.compressobj(0)
+        idat = [packer.compress(b"\x00" + previous)] if previous is not None else []
+        idat += [packer.compress(data), packer.flush()]
+        header = struct.pack(">I", count + (previous is not None))
+        png = BytesIO()
+        png.write(PNG_SIGNATURE)
+        WriteChunk(png, b"IHDR", self.png["header"][:4], header, self.png["header"][8:])
+        for kind, chunk in self.png["extra"]:
+            WriteChunk(png, kind, chunk)
+        WriteChunk(png, b"IDAT", *idat)
+        WriteChunk(png, b"IEND")
+        png.seek(0)
+        band = Image.open(png)
+        band.load()
+        if previous is not None:
+            band = band.crop((0, 1, band.width, band.height))
+        return band
+
+    def Decoded(self) -> Image.Image:
+        image = Image.open(self.path)
+        image.load()
+        return image
+
+    def JpegCrop(self, box: Box) -> Image.Image:
+        """Decode `box` with Qt, whose JPEG reader decodes only the clipped rectangle."""
+        inside = QRect(box[0], box[1], box[2] - box[0], box[3] - box[1]).intersected(
+            QRect(0, 0, *self.size),
+        )
+        if inside.isEmpty():
+            return Image.new(self.mode, (box[2] - box[0], box[3] - box[1]))
+        reader = QImageReader(str(self.path))
+        reader.setClipRect(inside)
+        qImage = reader.read()
+        if qImage.isNull():
+            return self.Decoded().crop(box)
+        gray = qImage.format() == QImage.Format.Format_Grayscale8
+        qImage = qImage.convertToFormat(
+            QImage.Format.Format_Grayscale8 if gray else QImage.Format.Format_RGB888,
+        )
+        region = Image.frombuffer(
+            "L" if gray else "RGB",
+            (qImage.width(), qImage.height()),
+            qImage.constBits().asstring(qImage.sizeInBytes()),
+            "raw",
+            "L" if gray else "RGB",
+            qImage.bytesPerLine(),
+            1,
+        )
+        if region.size == (box[2] - box[0], box[3] - box[1]):
+            return region
+        out = Image.new(region.mode, (box[2] - box[0], box[3] - box[1]))
+        out.paste(region, (inside.x() - box[0], inside.y() - box[1]))
+        return out
+
+    def Crop(self, box: Box) -> Image.Image:
+        """Return the pixels of `box`; areas outside the image are zero, as with `crop`."""
+        if self.strategy == "raw":
+            return self.RawCrop(box)
+        if self.strategy == "tiles":
+            return self.TileCrop(box)
+        if self.strategy == "jpeg":
+            return self.JpegCrop(box)
+        return next(im for _, im in self.Crops([box]))
+
+    def Crops(self, boxes: list[Box]) -> Iterator[tuple[int, Image.Image]]:
+        """Yield (index, region) for every box, each as soon as it is complete."""
+        if self.strategy in ("raw", "tiles", "jpeg"):
+            for idx, box in enumerate(boxes):
+                yield idx, self.Crop(box)
+            return
+        if self.strategy != "png":
+            image = self.Decoded()
+            for idx, box in enumerate(boxes):
+                yield idx, image.crop(box)
+            return
+        yield from self.PngCrops(boxes)
+
+    def PngCrops(self, boxes: list[Box]) -> Iterator[tuple[int, Image.Image]]:
+        """Cut the boxes out of the streamed bands, keeping only their pieces in memory."""
+        parts: dict[int, list[tuple[int, Image.Image]]] = {idx: [] for idx in range(len(boxes))}
+        for top, band in self.Bands():
+            bottom = top + band.height
+            for idx in list(parts):
+                left, boxTop, right, boxBottom = boxes[idx]
+                if boxTop < bottom and boxBottom > top:
+                    start = max(boxTop, top)
+                    piece = band.crop((left, start - top, right, min(boxBottom, bottom) - top))
+                    parts[idx].append((start - boxTop, piece))
+                if boxBottom <= bottom:
+                    yield idx, self.Assemble(boxes[idx], parts.pop(idx))
+            if not parts:
+                return
+        # boxes reaching below the image
+        for idx, pieces in parts.items():
+            yield idx, self.Assemble(boxes[idx], pieces)
+
+    def Assemble(self, box: Box, pieces: list[tuple[int, Image.Image]]) -> Image.Image:
+        if len(pieces) == 1 and pieces[0][0] == 0 and pieces[0][1].height == box[3] - box[1]:
+            return pieces[0][1]
+        mode = pieces[0][1].mode if pieces else self.mode
+        out = Image.new(mode, (box[2] - box[0], box[3] - box[1]))
+        if mode == "P" and pieces:
+            out.putpalette(pieces[0][1].getpalette() or [])
+        for offset, piece in pieces:
+            out.paste(piece, (0, offset))
+        return out
+
+    def RawCrop(self, box: Box) -> Image.Image:
+        rawmode, stride, orientation = self.layout or ("", 0, 1)
+        width, height = self.size
+        top, bottom = max(box[1], 0), min(box[3], height)
+        if bottom <= top:
+            return Image.new(self.mode, (box[2] - box[0], box[3] - box[1]))
+        # bottom-up files store the last row first
+        first = top if orientation >= 0 else height - bottom
+        with self.path.open("rb") as fp:
+            fp.seek(self.image.tile[0].offset + first * stride)
+            data = fp.read((bottom - top) * stride)
+        rows = Image.frombytes(
+            self.mode,
+            (width, bottom - top),
+            data,
+            "raw",
+            rawmode,
+            stride,
+            orientation,
+        )
+        if self.mode == "P" and self.image.palette:
+            # the palette is read from the header, getpalette would decode the image
+            rows.putpalette(self.image.palette)
+        return rows.crop((box[0], box[1] - top, box[2], box[3] - top))
+
+    def TileCrop(self, box: Box) -> Image.Image:
+        out = Image.new(self.mode, (box[2] - box[0], box[3] - box[1]))
+        for idx, tile in enumerate(self.image.tile):
+            x0, y0, x1, y1 = tile.extents
+            if x0 < box[2] and x1 > box[0] and y0 < box[3] and y1 > box[1]:
+                out.paste(self.Tile(idx), (x0 - box[0], y0 - box[1]))
+        return out
+
+    def Tile(self, idx: int) -> Image.Image:
+        if idx in self.tiles:
+            self.tiles.move_to_end(idx)
+            return self.tiles[idx]
+        tile = self.image.tile[idx]
+        x0, y0, x1, y1 = tile.extents
+        with self.path.open("rb") as fp:
+            fp.seek(tile.offset)
+            data = fp.read(self.tileBytes[idx])
+        args = tile.args if isinstance(tile.args, tuple) else (tile.args,)
+        image = Image.frombytes(self.mode, (x1 - x0, y1 - y0), data, tile.codec_name, *args)
+        self.tiles[idx] = image
+        if len(self.tiles) > TILE_CACHE:
+            self.tiles.popitem(last=False)
+        return image
+
+    # endregion
+
+
+def Uniform(image: Image.Image) -> bool:
+    """Return True if every pixel of `image` has the same value."""
+    extrema = image.getextrema()
+    if not isinstance(extrema[0], tuple):
+        extrema = (extrema,)
+    return all(low == high for low, high in extrema)  # pyright: ignore[reportGeneralTypeIssues]
+
+
+def Storable(image: Image.Image, suffix: str) -> Image.Image:
+    """Return `image` in a mode the format named by `suffix` can store."""
+    if suffix.lower() == ".png" and image.mode not in PNG_MODES:
+        return image.convert("RGBA" if "A" in image.mode else "RGB")
+    if suffix.lower() in (".jpg", ".jpeg") and image.mode not in ("L", "RGB"):
+        return image.convert("RGB")
+    return image
+
+
+@Timed("ExportSections")
+def ExportSections(
+    source: Path,
+    sections: list[tuple[Box, Path]],
+    skipUniform: bool = False,
+) -> list[Path]:
+    """Write each (box, output path) region of `source` and return the files written.
+
+    Regions are read through `RegionReader`. With `skipUniform`, regions of a
+    single color (empty grid cells) are not written.
+    """
+    written: list[Path] = []
+    for image, output in StorableSections(source, sections, skipUniform):
+        try:
+            with Span("encode"):
+                image.save(output)
+        except OSError:
+            logging.exception("Failed to write %s", output)
+            continue
+        RecordFileAdded(output)
+        written.append(output)
+    return written
+
+
+def StorableSections(
+    source: Path,
+    sections: list[tuple[Box, Path]],
+    skipUniform: bool = False,
+) -> Iterator[tuple[Image.Image, Path]]:
+    """Yield each region of `source` to be written, ready for its output path's format."""
+    with RegionReader(source) as reader:
+        for idx, region in reader.Crops([box for box, _ in sections]):
+            if skipUniform and Uniform(region):
+                continue
+            output = sections[idx][1]
+            yield Storable(region, output.suffix), output
+
+
+def WriteSections(
+    source: Path,
+    sections: list[tuple[Box, Path]],
+    skipUniform: bool = False,
+    output: str = OUTPUT_FILES,
+) -> list[Path]:
+    """Save the (box, output path) regions of `source` as `output` and return the files written.
+
+    `OUTPUT_FILES` writes each region through `ExportSections`; `OUTPUT_MANIFEST`
+    only records them in the manifest of their folder, see `Manifest`, and
+    `OUTPUT_CBZ` streams them into the archive of the source's folder, see `Archive`.
+    """
+    if output == OUTPUT_MANIFEST:
+        from .Manifest import WriteManifest
+
+        return [WriteManifest(source, sections, skipUniform)]
+    if output == OUTPUT_CBZ:
+        from .Archive import WriteArchive
+
+        return [WriteArchive(source, sections, skipUniform)]
+    return ExportSections(source, sections, skipUniform)
@@ -0,0 +1,296 @@
+"""Virtualized thumbnail strip of the current folder.
+
+Thumbnails are built as PREFETCH jobs on the scheduler from a draft decode and
+stored in a content-addressed cache under `AppDataDir()`, so a folder is only
+ever thumbnailed once. The view asks for the rows it shows, which keeps
+scrolling through thousands of pages cheap.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+from PIL import Image
+from PyQt6.QtCore import (
+    QAbstractListModel,
+    QModelIndex,
+    QObject,
+    QPoint,
+    QSize,
+    Qt,
+    QTimer,
+    pyqtSignal,
+)
+from PyQt6.QtGui import QColor, QImage, QPixmap, QShowEvent
+from PyQt6.QtWidgets import QListView, QWidget
+
+from .FolderIndex import GetFolderIndex
+from .Profiling import Timed
+from .Scheduler import PREFETCH, Submit
+from .Utility import AddDirListener, AppDataDir
+
+THUMB_SIZE = 128
+THUMB_DIR = "thumbs"
+# bytes read from each end of a file for its cache key
+KEY_SAMPLE = 64 * 1024
+# decoded thumbnails kept in memory
+THUMB_MEMORY = 1024
+
+
+def ThumbKey(path: Path) -> str:
+    """Return a cache key for the contents of `path` from its size, head and tail.
+
+    Copies and renames of a page share one thumbnail; files of the same size
+    that differ only in the middle would too, which pages do not in practice.
+    """
+    size = path.stat().st_size
+    digest = hashlib.blake2b(f"{size}:{THUMB_SIZE}".encode(), digest_size=16)
+    with path.open("rb") as f:
+        digest.update(f.read(KEY_SAMPLE))
+        if size > KEY_SAMPLE:
+            f.seek(max(size - KEY_SAMPLE, KEY_SAMPLE))
+            digest.update(f.read(KEY_SAMPLE))
+    return digest.hexdigest()
+
+
+def ThumbPath(key: str) -> Path:
+    return AppDataDir() / THUMB_DIR / key[:2] / f"{key}.jpg"
+
+
+@Timed("MakeThumbnail")
+def MakeThumbnail(path: Path) -> Image.Image:
+    """Decode `path` just large enough for a thumbnail and shrink it to THUMB_SIZE."""
+    with Image.open(path) as im:
+        # JPEGs decode at 1/2 to 1/8 scale directly
+        im.draft("RGB", (THUMB_SIZE, THUMB_SIZE))
+        factor = max(1, min(im.width, im.height) // (THUMB_SIZE * 2))
+        small = im.convert("RGB") if im.mode not in ("RGB", "L") else im
+        small = small.reduce(factor) if factor > 1 else small.copy()
+    small.thumbnail((THUMB_SIZE, THUMB_SIZE), Image.Resampling.BILINEAR)
+    return small
+
+
+def CachedThumbnail(path: Path) -> QImage:
+    """Return the thumbnail of `path`, building and storing it on a cache miss."""
+    cached = ThumbPath(ThumbKey(path))
+    if not cached.exists():
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        partial = cached.with_suffix(f".{os.getpid()}.tmp")
+        MakeThumbnail(path).save(partial, "JPEG", quality=85)
+        # another worker or instance may write the same key; either copy is fine
+        partial.replace(cached)
+    return QImage(str(cached))
+
+
+class ThumbnailSignals(QObject):
+    """Carries finished thumbnails from the scheduler back to the GUI thread."""
+
+    done = pyqtSignal(str, str, QImage)
+    skipped = pyqtSignal(str, str)
+
+
+class ThumbnailJob:
+    """Thumbnail one page on the scheduler, unless the view no longer shows it."""
+
+    def __init__(self, folder: Path, name: str, model: "FilmstripModel") -> None:
+        self.folder = folder
+        self.name = name
+        self.model = model
+        self.signals = model.signals
+
+    def __call__(self) -> None:
+        if not self.model.Wanted(self.folder, self.name):
+            # scrolled past while queued
+            self.signals.skipped.emit(str(self.folder), self.name)
+            return
+        try:
+            image = CachedThumbnail(self.folder / self.name)
+        except (OSError, ValueError):
+            logging.debug("Could not thumbnail %s", self.folder / self.name)
+            image = QImage()
+        self.signals.done.emit(str(self.folder), self.name, image)
+
+
+class FilmstripModel(QAbstractListModel):
+    """Names of the folder's images with their thumbnails, built when first shown."""
+
+    def __init__(self, parent: QObject | None = None) -> None:
+        super().__init__(parent)
+        self.folder: Path | None = None
+        self.names: list[str] = []
+        self.thumbs: OrderedDict[str, QPixmap] = OrderedDict()
+        # names with a job queued or running
+        self.pending: set[str] = set()
+        # names the view still shows; queued jobs for anything else are skipped
+        self.wanted: set[str] = set()
+        self.lock = threading.Lock()
+        self.listened: set[str] = set()
+        self.signals = ThumbnailSignals(self)
+        self.signals.done.connect(self.OnThumbnail)
+        self.signals.skipped.connect(self.OnSkipped)
+        self.placeholder = QPixmap(THUMB_SIZE, THUMB_SIZE)
+        self.placeholder.fill(QColor(60, 63, 65))
+
+    def SetFolder(self, folder: Path) -> None:
+        if folder == self.folder:
+            return
+        self.beginResetModel()
+        with self.lock:
+            self.folder = folder
+            self.wanted = set()
+        self.names = list(GetFolderIndex(folder).names)
+        self.thumbs.clear()
+        # jobs still running for the old folder report back to an ignored folder
+        self.pending = set()
+        self.endResetModel()
+        if str(folder) not in self.listened:
+            self.listened.add(str(folder))
+            AddDirListener(
+                folder,
+                lambda added, removed, f=folder: self.OnChanged(f, added, removed),
+            )
+
+    def OnChanged(self, folder: Path, added: list[Path], removed: list[Path]) -> None:
+        if folder != self.folder:
+            return
+        for path in removed:
+            self.thumbs.pop(path.name, None)
+        if added or removed:
+            self.beginResetModel()
+            self.names = list(GetFolderIndex(folder).names)
+            self.endResetModel()
+
+    def Row(self, path: Path) -> int | None:
+        if path.parent != self.folder:
+            return None
+        return GetFolderIndex(path.parent).positions.get(path.name)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:  # noqa: B008
+        """Return the number of images, the model is a flat list."""
+        return 0 if parent.isValid() else len(self.names)
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole) -> Any:
+        """Return the name, or the thumbnail once it is ready."""
+        if not index.isValid() or index.row() >= len(self.names):
+            return None
+        name = self.names[index.row()]
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.ToolTipRole):
+            return name
+        if role == Qt.ItemDataRole.DecorationRole:
+            if name in self.thumbs:
+                self.thumbs.move_to_end(name)
+                return self.thumbs[name]
+            self.Request(name)
+            return self.placeholder
+        return None
+
+    def Request(self, name: str) -> None:
+        if self.folder is None:
+            return
+        with self.lock:
+            self.wanted.add(name)
+        if name in self.pending:
+            return
+        self.pending.add(name)
+        # prefetch runs newest first, so the rows last scrolled to fill in first
+        Submit(PREFETCH, ThumbnailJob(self.folder, name, self), "thumbnail")
+
+    def Wanted(self, folder: Path, name: str) -> bool:
+        with self.lock:
+            return folder == self.folder and name in self.wanted
+
+    def KeepOnly(self, names: set[str]) -> None:
+        """Let queued jobs for rows outside `names` finish without decoding."""
+        with self.lock:
+            self.wanted &= names
+
+    def OnSkipped(self, folder: str, name: str) -> None:
+        if self.folder is None or folder != str(self.folder):
+            return
+        self.pending.discard(name)
+        # scrolled back to before the skip arrived
+        if self.Wanted(self.folder, name):
+            self.Request(name)
+
+    def OnThumbnail(self, folder: str, name: str, image: QImage) -> None:
+        if self.folder is None or folder != str(self.folder):
+            return
+        self.pending.discard(name)
+        self.thumbs[name] = QPixmap.fromImage(image) if not image.isNull() else self.placeholder
+        if len(self.thumbs) > THUMB_MEMORY:
+            self.thumbs.popitem(last=False)
+        row = GetFolderIndex(self.folder).positions.get(name)
+        if row is not None and row < len(self.names):
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+
+class Filmstrip(QListView):
+    """Horizontal strip of thumbnails; clicking one emits `pageChosen`."""
+
+    pageChosen = pyqtSignal(Path)
+
+    def __init__(self, parent: QWidget | None = None) -> None:
+        super().__init__(parent)
+        self.strip = FilmstripModel(self)
+        self.setModel(self.strip)
+        self.setFlow(QListView.Flow.LeftToRight)
+        self.setWrapping(False)
+        self.setViewMode(QListView.ViewMode.IconMode)
+        self.setMovement(QListView.Movement.Static)
+        # every item has the same size, so the view lays out 10k rows without asking for them
+        self.setUniformItemSizes(True)
+        self.setIconSize(QSize(THUMB_SIZE, THUMB_SIZE))
+        self.setGridSize(QSize(THUMB_SIZE + 16, THUMB_SIZE + 28))
+        self.setFixedHeight(THUMB_SIZE + 48)
+        self.setTextElideMode(Qt.TextElideMode.ElideMiddle)
+        self.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.clicked.connect(self.OnClicked)
+        self.horizontalScrollBar().valueChanged.connect(self.PruneRequests)  # pyright: ignore[reportOptionalMemberAccess]
+        self.current: Path | None = None
+
+    def ShowPath(self, path: Path | None) -> None:
+        """Switch to the folder of `path` and select it."""
+        if path is None or path == self.current:
+            return
+        self.current = path
+        self.strip.SetFolder(path.parent)
+        row = self.strip.Row(path)
+        if row is not None:
+            index = self.strip.index(row)
+            self.setCurrentIndex(index)
+            self.CenterCurrent()
+
+    def showEvent(self, e: QShowEvent | None) -> None:
+        """Center the current page, scrolling while hidden does not stick."""
+        super().showEvent(e)
+        QTimer.singleShot(0, self.CenterCurrent)
+
+    def CenterCurrent(self) -> None:
+        if self.currentIndex().isValid():
+            self.scrollTo(self.currentIndex(), QListView.ScrollHint.PositionAtCenter)
+
+    def OnClicked(self, index: QModelIndex) -> None:
+        if self.strip.folder is not None and index.isValid():
+            self.pageChosen.emit(self.strip.folder / self.strip.names[index.row()])
+
+    def VisibleRows(self) -> range:
+        viewport = self.viewport()
+        if viewport is None or not self.strip.names:
+            return range(0)
+        # probe along the middle row, below the items is empty space
+        rect = viewport.rect()
+        first = self.indexAt(QPoint(rect.left(), rect.center().y()))
+        last = self.indexAt(QPoint(rect.right(), rect.center().y()))
+        start = first.row() if first.isValid() else 0
+        end = last.row() if last.isValid() else len(self.strip.names) - 1
+        return range(start, end + 1)
+
+    def PruneRequests(self) -> None:
+        visible = self.VisibleRows()
+        names = self.strip.names
+        self.strip.KeepOnly({names[row] for row in visible if row < len(names)})
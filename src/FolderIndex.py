@@ -0,0 +1,230 @@
+"""Persistent per-folder image index."""
+
+import bisect
+import contextlib
+import logging
+import os
+import sqlite3
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+from .Utility import WATCHED_DIRS, AddDirListener, DirMTime, GetImageFiles, SeedDirCache
+
+INDEX_NAME = ".image-splitter.db"
+
+# open indexes keyed by folder, so every widget shares one connection per folder
+FOLDER_INDEXES: dict[str, "FolderIndex"] = {}
+
+
+def SortKey(name: str) -> str:
+    """Order names the same way sorted Path objects in one folder are ordered."""
+    return os.path.normcase(name)
+
+
+class FolderIndex:
+    """Sorted listing of a folder's images, backed by a SQLite file in that folder.
+
+    Keeps the sorted names and a name -> position map in memory so position and
+    next/previous lookups are O(1) (O(log n) for files that no longer exist).
+    The database additionally stores image dimensions, processed state, the
+    per-image layouts of `LayoutStore` and the perceptual hashes of `Duplicates`.
+    After the initial sync the listing is updated incrementally from the
+    directory cache's change notifications rather than rescanned.
+
+    The one connection serves the GUI thread and scheduler jobs alike, so it
+    is only used through `Query` and `Transaction`, which hold `lock`.
+    """
+
+    def __init__(self, folder: Path) -> None:
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.names: list[str] = []
+        self.positions: dict[str, int] = {}
+        # None once the index had to fall back to memory
+        self.dbPath: Path | None = self.folder / INDEX_NAME
+        self.db = self.Connect()
+        self.Load()
+        self.Sync()
+        AddDirListener(folder, self.ApplyChanges)
+
+    # region Storage
+    def Connect(self) -> sqlite3.Connection:
+        try:
+            conn = sqlite3.connect(self.folder / INDEX_NAME, check_same_thread=False)
+            self.CreateTables(conn)
+        except sqlite3.Error:
+            # read-only or otherwise unwritable folders still get an index, just not on disk
+            logging.exception("Falling back to in-memory index for %s", self.folder)
+            self.dbPath = None
+            conn = sqlite3.connect(":memory:", check_same_thread=False)
+            self.CreateTables(conn)
+        return conn
+
+    @staticmethod
+    def CreateTables(conn: sqlite3.Connection) -> None:
+        # a persistent journal keeps commits from creating and deleting files in the
+        # folder, which would change its mtime and force a rescan on every write
+        conn.execute("PRAGMA journal_mode=PERSIST")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "name TEXT PRIMARY KEY, width INTEGER, height INTEGER, "
+            "processed INTEGER NOT NULL DEFAULT 0)",
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS layouts ("
+            "name TEXT NOT NULL, mode TEXT NOT NULL, digest TEXT NOT NULL, data TEXT NOT NULL, "
+            "PRIMARY KEY (name, mode))",
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS layouts_digest ON layouts (digest, mode)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "name TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, dhash TEXT NOT NULL)",
+        )
+        # the folder mtime the stored names were synced at
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        conn.commit()
+
+    def Query(self, sql: str, params: tuple[Any, ...] = ()) -> list[Any]:
+        """Run a read on the shared connection and return all of its rows."""
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    @contextlib.contextmanager
+    def Transaction(self) -> Iterator[sqlite3.Connection]:
+        """Hold the shared connection for writes, committed together or rolled back."""
+        with self.lock, self.db:
+            yield self.db
+
+    def Load(self) -> None:
+        rows = self.Query("SELECT name FROM files")
+        self.SetNames([row[0] for row in rows])
+
+    def SetNames(self, names: list[str]) -> None:
+        self.names = sorted(names, key=SortKey)
+        self.positions = {name: idx for idx, name in enumerate(self.names)}
+
+    # endregion
+
+    def Sync(self) -> None:
+        """Reconcile the stored names with the folder's current listing.
+
+        A folder still at the mtime of the last sync holds the same names, so
+        its listing is taken from the index instead of scanned.
+        """
+        mtime = DirMTime(self.folder)
+        stored = self.Query("SELECT value FROM meta WHERE key = 'mtime'")
+        if mtime is not None and stored == [(mtime,)]:
+            SeedDirCache(self.folder, [self.folder / name for name in self.names], mtime)
+            return
+        current = {x.name for x in GetImageFiles(self.folder)}
+        known = set(self.positions)
+        self.ApplyNames(sorted(current - known), sorted(known - current))
+        if mtime is not None:
+            try:
+                with self.Transaction() as db:
+                    db.execute("INSERT OR REPLACE INTO meta VALUES ('mtime', ?)", (mtime,))
+            except sqlite3.Error:
+                logging.exception("Failed to store the listing time of %s", self.folder)
+
+    def Refresh(self) -> None:
+        """Catch up on changes to a folder the watcher cannot report on.
+
+        Unwatched folders fall back to mtime revalidation inside `GetImageFiles`,
+        whose rescans are forwarded to `ApplyChanges`.
+        """
+        if str(self.folder) not in WATCHED_DIRS:
+            GetImageFiles(self.folder)
+
+    def ApplyChanges(self, added: list[Path], removed: list[Path]) -> None:
+        self.ApplyNames([x.name for x in added], [x.name for x in removed])
+
+    def ApplyNames(self, added: list[str], removed: list[str]) -> None:
+        added = [x for x in added if x not in self.positions]
+        removed = [x for x in removed if x in self.positions]
+        if not added and not removed:
+            return
+        with self.Transaction() as db:
+            db.executemany("DELETE FROM files WHERE name = ?", [(x,) for x in removed])
+            db.executemany("INSERT OR IGNORE INTO files (name) VALUES (?)", [(x,) for x in added])
+
+        # only names from the first changed position on move
+        first = len(self.names)
+        if removed:
+            gone = set(removed)
+            first = min(self.positions.pop(name) for name in removed)
+            self.names[first:] = [x for x in self.names[first:] if x not in gone]
+        if added:
+            added.sort(key=SortKey)
+            start = bisect.bisect_left(self.names, SortKey(added[0]), key=SortKey)
+            first = min(first, start)
+            # two sorted runs, which sorted merges in linear time
+            self.names[start:] = sorted(self.names[start:] + added, key=SortKey)
+        for idx in range(first, len(self.names)):
+            self.positions[self.names[idx]] = idx
+
+    def __len__(self) -> int:
+        """Return the number of indexed images."""
+        return len(self.names)
+
+    def Position(self, path: Path) -> int | None:
+        """Return the zero-based position of `path`, or None if it is not indexed."""
+        self.Refresh()
+        return self.positions.get(path.name)
+
+    def Neighbour(self, path: Path, reverse: bool = False) -> Path | None:
+        """Return the next (or previous) image after `path`, wrapping around the folder.
+
+        `path` may already be deleted; its neighbours are then found by where it
+        would sort among the remaining names.
+        """
+        self.Refresh()
+        if not self.names:
+            return None
+        idx = self.positions.get(path.name)
+        if idx is None:
+            # insertion point is the first name after the missing file
+            idx = bisect.bisect_left(self.names, SortKey(path.name), key=SortKey)
+            idx = idx - 1 if reverse else idx
+        else:
+            idx = idx - 1 if reverse else idx + 1
+        return self.folder / self.names[idx % len(self.names)]
+
+    def SetDimensions(self, path: Path, width: int, height: int) -> None:
+        try:
+            with self.Transaction() as db:
+                db.execute(
+                    "UPDATE files SET width = ?, height = ? WHERE name = ?",
+                    (width, height, path.name),
+                )
+        except sqlite3.Error:
+            # only a cache; loading the image must not fail over it
+            logging.exception("Failed to store dimensions of %s", path)
+
+    def Dimensions(self, path: Path) -> tuple[int, int] | None:
+        rows = self.Query("SELECT width, height FROM files WHERE name = ?", (path.name,))
+        return None if not rows or rows[0][0] is None else (rows[0][0], rows[0][1])
+
+    def SetProcessed(self, path: Path, processed: bool = True) -> None:
+        try:
+            with self.Transaction() as db:
+                db.execute(
+                    "UPDATE files SET processed = ? WHERE name = ?",
+                    (int(processed), path.name),
+                )
+        except sqlite3.Error:
+            logging.exception("Failed to mark %s processed", path)
+
+    def IsProcessed(self, path: Path) -> bool:
+        rows = self.Query("SELECT processed FROM files WHERE name = ?", (path.name,))
+        return bool(rows and rows[0][0])
+
+
+def GetFolderIndex(folder: Path) -> FolderIndex:
+    """Return the shared index for `folder`, opening it on first use."""
+    key = str(folder)
+    if key not in FOLDER_INDEXES:
+        FOLDER_INDEXES[key] = FolderIndex(folder)
+    return FOLDER_INDEXES[key]
@@ -0,0 +1,245 @@
+"""Undo/redo log for polygon and image edits of the open image."""
+
+import contextlib
+import zlib
+from collections.abc import Iterator
+
+from PIL import Image, ImageChops
+from PyQt6.QtCore import QPoint
+from PyQt6.QtGui import QColor
+
+from .Components import Polygon
+
+# points and ARGB color of one polygon
+FrozenPolygon = tuple[tuple[tuple[int, int], ...], int]
+PolygonState = tuple[FrozenPolygon, ...]
+
+HISTORY_LIMIT = 500
+# compressed image bytes kept before the oldest edits are forgotten
+HISTORY_BYTES = 256 * 1024 * 1024
+
+
+def Thaw(state: PolygonState) -> list[Polygon]:
+    return [
+        Polygon([QPoint(x, y) for x, y in points], QColor.fromRgba(rgba)) for points, rgba in state
+    ]
+
+
+class PackedImage:
+    """Image pixels compressed with zlib."""
+
+    def __init__(self, im: Image.Image) -> None:
+        self.mode = im.mode
+        self.size = im.size
+        self.palette = im.getpalette() if im.mode == "P" else None
+        self.data = zlib.compress(im.tobytes(), 1)
+
+    def Unpack(self) -> Image.Image:
+        im = Image.frombytes(self.mode, self.size, zlib.decompress(self.data))
+        if self.palette is not None:
+            im.putpalette(self.palette)
+        return im
+
+
+class BoundsChange:
+    """Polygons of one mode before and after an edit."""
+
+    def __init__(self, mode: str, before: PolygonState, after: PolygonState) -> None:
+        self.mode = mode
+        self.before = before
+        self.after = after
+        self.nbytes = 0
+
+
+class ImageChange:
+    """An image edit stored as the region it changed, not as full copies.
+
+    Same-size edits keep both versions of the differing bounding box. Crops
+    keep the original with the kept `box` blanked out (which compresses to
+    almost nothing), since the cropped image itself fills that hole again.
+    """
+
+    def __init__(
+        self,
+        before: Image.Image,
+        after: Image.Image,
+        box: tuple[int, int, int, int] | None = None,
+    ) -> None:
+        self.box = box
+        self.cropped = box is not None and after.size == (box[2] - box[0], box[3] - box[1])
+        self.old: PackedImage
+        self.new: PackedImage | None = None
+        if self.cropped and box is not None:
+            masked = before.copy()
+            masked.paste(0, box)
+            self.old = PackedImage(masked)
+        elif before.size == after.size and before.mode == after.mode:
+            try:
+                self.box = ImageChops.difference(before, after).getbbox()
+            except ValueError:
+                # modes ImageChops cannot subtract are diffed as the whole image
+                self.box = (0, 0, *before.size)
+            self.box = self.box or (0, 0, 0, 0)
+            self.old = PackedImage(before.crop(self.box))
+            self.new = PackedImage(after.crop(self.box))
+        else:
+            self.box = None
+            self.old = PackedImage(before)
+            self.new = PackedImage(after)
+        self.nbytes = len(self.old.data) + (len(self.new.data) if self.new else 0)
+
+    def Revert(self, current: Image.Image) -> Image.Image:
+        """Return the image as it was before the edit, given the edited image."""
+        if self.cropped and self.box is not None:
+            im = self.old.Unpack()
+            im.paste(current, self.box[:2])
+            return im
+        if self.box is None:
+            return self.old.Unpack()
+        im = current.copy()
+        im.paste(self.old.Unpack(), self.box[:2])
+        return im
+
+    def Apply(self, current: Image.Image) -> Image.Image:
+        """Return the image after the edit, given the image before it."""
+        if self.cropped and self.box is not None:
+            return current.crop(self.box)
+        if self.new is None:
+            return current
+        if self.box is None:
+            return self.new.Unpack()
+        im = current.copy()
+        im.paste(self.new.Unpack(), self.box[:2])
+        return im
+
+
+Change = BoundsChange | ImageChange
+
+
+class History:
+    """Linear command log of the open image's edits.
+
+    Polygon states are tuples of interned frozen polygons, so consecutive
+    states share every polygon that did not change and a deep history of
+    small edits costs little more than the polygons themselves.
+    """
+
+    def __init__(self) -> None:
+        self.entries: list[list[Change]] = []
+        # entries before this index can be undone, the rest redone
+        self.index = 0
+        self.nbytes = 0
+        # last recorded polygons per widget MODE
+        self.states: dict[str, PolygonState] = {}
+        self.interned: dict[FrozenPolygon, FrozenPolygon] = {}
+        # changes collected by an open Group
+        self.pending: list[Change] | None = None
+        self.paused = 0
+
+    def Clear(self) -> None:
+        self.entries = []
+        self.index = 0
+        self.nbytes = 0
+        self.states = {}
+        self.interned = {}
+
+    def Freeze(self, polygons: list[Polygon]) -> PolygonState:
+        out = []
+        for poly in polygons:
+            frozen = (tuple(poly.RawPoints), poly.Color.rgba())
+            out.append(self.interned.setdefault(frozen, frozen))
+        return tuple(out)
+
+    def Baseline(self, mode: str, polygons: list[Polygon]) -> None:
+        """Set the state `mode` is compared against without recording an edit."""
+        self.states[mode] = self.Freeze(polygons)
+
+    def RecordBounds(self, mode: str, polygons: list[Polygon]) -> None:
+        if self.paused:
+            return
+        after = self.Freeze(polygons)
+        before = self.states.get(mode, ())
+        if after == before:
+            return
+        self.states[mode] = after
+        if self.pending is None:
+            self.Push([BoundsChange(mode, before, after)])
+
+    def RecordImage(
+        self,
+        before: Image.Image,
+        after: Image.Image,
+        box: tuple[int, int, int, int] | None = None,
+    ) -> None:
+        if self.paused:
+            return
+        change = ImageChange(before, after, box)
+        if self.pending is None:
+            self.Push([change])
+        else:
+            self.pending.append(change)
+
+    @contextlib.contextmanager
+    def Group(self) -> Iterator[None]:
+        """Record everything inside the block as one undo step.
+
+        Polygon changes are diffed once at the end, so reloads inside the block
+        that reset the polygons do not lose the state from before it.
+        """
+        if self.pending is not None:
+            yield
+            return
+        start = dict(self.states)
+        self.pending = []
+        try:
+            yield
+        finally:
+            changes, self.pending = self.pending, None
+            for mode in self.states.keys() | start.keys():
+                before, after = start.get(mode, ()), self.states.get(mode, ())
+                if before != after:
+                    changes.append(BoundsChange(mode, before, after))
+            if changes:
+                self.Push(changes)
+
+    @contextlib.contextmanager
+    def Paused(self) -> Iterator[None]:
+        self.paused += 1
+        try:
+            yield
+        finally:
+            self.paused -= 1
+
+    def Push(self, changes: list[Change]) -> None:
+        for dropped in self.entries[self.index :]:
+            self.nbytes -= sum(c.nbytes for c in dropped)
+        del self.entries[self.index :]
+        self.entries.append(changes)
+        self.nbytes += sum(c.nbytes for c in changes)
+        while len(self.entries) > HISTORY_LIMIT or (
+            self.nbytes > HISTORY_BYTES and len(self.entries) > 1
+        ):
+            self.nbytes -= sum(c.nbytes for c in self.entries.pop(0))
+        self.index = len(self.entries)
+
+    def Undo(self) -> list[Change] | None:
+        """Step back and return the changes to revert, last change first."""
+        if self.index == 0:
+            return None
+        self.index -= 1
+        changes = self.entries[self.index]
+        for change in changes:
+            if isinstance(change, BoundsChange):
+                self.states[change.mode] = change.before
+        return changes[::-1]
+
+    def Redo(self) -> list[Change] | None:
+        """Step forward and return the changes to reapply, in order."""
+        if self.index == len(self.entries):
+            return None
+        changes = self.entries[self.index]
+        self.index += 1
+        for change in changes:
+            if isinstance(change, BoundsChange):
+                self.states[change.mode] = change.after
+        return changes
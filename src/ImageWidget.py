@@ -1,14 +1,16 @@
 """Base module for image widget."""
 
+from concurrent.futures import Future
 from pathlib import Path
 
-import send2trash
 from PIL import Image
+from PyQt6 import sip
 from PyQt6.QtCore import QPoint, QRect, QSize, Qt
 from PyQt6.QtGui import (
     QColor,
     QDragEnterEvent,
     QDropEvent,
+    QImage,
     QMouseEvent,
     QPainter,
     QPaintEvent,
@@ -19,7 +21,27 @@ from PyQt6.QtGui import (
 from PyQt6.QtWidgets import QInputDialog, QWidget
 
 from .Components import Polygon
-from .Utility import GetImageFiles, ThrowNotImplemented
+from .Document import ImageDocument, Shared
+from .Duplicates import NearDuplicates
+from .Export import OUTPUT_FILES, Box
+from .FolderIndex import GetFolderIndex
+from .History import Change, ImageChange, Thaw
+from .Journal import ReplaceFile
+from .LayoutStore import (
+    CachedHash,
+    ContentHash,
+    DeleteLayout,
+    DigestKey,
+    Layout,
+    LoadDuplicateLayout,
+    LoadLayout,
+    SaveLayout,
+)
+from .Profiling import Span, Timed
+from .Scheduler import INTERACTIVE, Submit
+from .Strip import IsStrip
+from .Tasks import GuiCall, Job, RunNow
+from .Utility import RecordFileAdded, RecordFileRemoved, ThrowNotImplemented
 
 AVAILABLE_COLORS = [
     # reserve for bounds QColor("red"),
@@ -35,36 +57,101 @@ AVAILABLE_COLORS = [
         Qt.GlobalColor.darkMagenta,
     ),
 ]
+# QImage formats sharing the memory layout of a PIL mode; others go through RGBA
+QT_FORMATS = {
+    "L": QImage.Format.Format_Grayscale8,
+    "RGB": QImage.Format.Format_RGB888,
+    "RGBA": QImage.Format.Format_RGBA8888,
+}
+
+
+def ToPixmap(im: Image.Image) -> QPixmap:
+    """Return `im` as a QPixmap with a single copy of its pixels."""
+    if im.mode not in QT_FORMATS:
+        im = im.convert("RGBA")
+    data = im.tobytes()
+    # QPixmap.fromImage copies, so `data` only has to outlive this call
+    image = QImage(data, im.width, im.height, len(data) // im.height, QT_FORMATS[im.mode])
+    return QPixmap.fromImage(image)
 
 
 class ImageWidget(QWidget):
     """Base image widget."""
 
+    # layout store key, so line and box splits of one image are kept apart
+    MODE = "image"
+    # whether exporting skips sections of a single color
+    SKIP_UNIFORM = False
+
+    image_path = Shared[Path | None]()
+    last_path = Shared[Path | None]()
+    image_loaded = Shared[bool]()
+    image_digest = Shared[str | None]()
+    pixmap = Shared[QPixmap]()
+    image_obj = Shared[Image.Image]()
+    stripMode = Shared[bool]()
+    zoom = Shared[float]()
+    offset = Shared[QPoint]()
+
     def __init__(
         self,
         image_path: Path | None = None,
         polygons: list[Polygon] | None = None,
+        document: ImageDocument | None = None,
     ) -> None:
+        """Open `image_path`, or attach to an already loaded `document`."""
         super().__init__()
         self.setAcceptDrops(True)
-        self.pixmap: QPixmap = QPixmap()
+        self.document = ImageDocument() if document is None else document
         self.scaled_pixmap: QPixmap = QPixmap()
-        self.image_path: Path | None = image_path
-        self.last_path: Path | None = None
-        self.image_loaded: bool = False
         self.available_colors: list[QColor] = list(AVAILABLE_COLORS)
-        self.offset: QPoint = QPoint()
         self.baseScale: float = 1.0
-        self.zoom: float = 1.0
         self.panning: bool = False
         self.panPoint: QPoint = QPoint()
         self.previewLines: bool = True
 
-        self.saveBounds: list[Polygon] = [] if polygons is None else polygons
+        if polygons is not None:
+            self.saveBounds = polygons
+        elif self.image_path is not None and self.MODE not in self.document.layouts:
+            # first time this mode sees the document, pick up what was saved for it
+            self.RestoreLayout()
         if isinstance(image_path, Path):
-            self.LoadImage(str(self.image_path))
+            self.LoadImage(str(image_path))
+
+    @property
+    def saveBounds(self) -> list[Polygon]:
+        return self.document.LayoutFor(self.MODE).polygons
+
+    @saveBounds.setter
+    def saveBounds(self, polygons: list[Polygon]) -> None:
+        self.document.LayoutFor(self.MODE).polygons = polygons
+        self.BoundsChanged()
+
+    @property
+    def trimPadding(self) -> int:
+        return self.document.LayoutFor(self.MODE).trimPadding
+
+    @trimPadding.setter
+    def trimPadding(self, padding: int) -> None:
+        self.document.LayoutFor(self.MODE).trimPadding = padding
+
+    @property
+    def gridSpec(self) -> str:
+        return self.document.LayoutFor(self.MODE).gridSpec
+
+    @gridSpec.setter
+    def gridSpec(self, spec: str) -> None:
+        self.document.LayoutFor(self.MODE).gridSpec = spec
+
+    def BoundsChanged(self) -> None:
+        """Record the edit in the history, call after editing saveBounds in place.
+
+        Subclasses also drop anything derived from saveBounds here.
+        """
+        self.document.history.RecordBounds(self.MODE, self.saveBounds)
 
     # region ScalingControls
+    @Timed("UpdateScaling")
     def UpdateScaling(self) -> None:
         if self.pixmap.width() == 0 or self.pixmap.height() == 0:
             return
@@ -76,8 +163,10 @@ class ImageWidget(QWidget):
 
         sw, sh = int(self.pixmap.width() * scale), int(self.pixmap.height() * scale)
         self.scaled_pixmap = self.pixmap.scaled(sw, sh, Qt.AspectRatioMode.KeepAspectRatio)
-        if not self.panning:
+        # a widget taking over the document at the same size keeps its pan
+        if not self.panning and self.document.viewSize != (w, h):
             self.offset = QPoint((w - sw) // 2, (h - sh) // 2)
+        self.document.viewSize = (w, h)
 
     def ScaleToImage(self, display_point: QPoint) -> QPoint:
         inv = 1 / (self.baseScale * self.zoom)
@@ -178,6 +267,8 @@ class ImageWidget(QWidget):
                 dst = self.image_path.parent / f"{text}{self.image_path.suffix}"
                 if ok and text and not dst.exists():
                     self.image_path.rename(dst)
+                    RecordFileRemoved(self.image_path)
+                    RecordFileAdded(dst)
                     self.LoadNext(self.image_path)
                     break
 
@@ -186,10 +277,10 @@ class ImageWidget(QWidget):
             return self.scaled_pixmap.size()
         return super().sizeHint()
 
-    def reset(self, preservePolygons: bool = False) -> None:
-        self.zoom = 1.0
-        self.baseScale = 1.0
-        self.offset = QPoint()
+    def reset(self, preservePolygons: bool = False, preserveView: bool = False) -> None:
+        if not preserveView:
+            self.document.ResetView()
+            self.baseScale = 1.0
         if not preservePolygons:
             self.saveBounds = []
         self.UpdateScaling()
@@ -215,90 +306,297 @@ class ImageWidget(QWidget):
 
     # endregion
 
+    @Timed("LoadImage")
     def LoadImage(self, path: str | Path, keepPolygons: bool = False) -> None:
         file = Path(path)
         if not file.is_file():
             return
         if self.image_path != path and self.image_path is not None:
             self.last_path = self.image_path
+        history = self.document.history
+        if file != self.image_path:
+            history.Clear()
+        self.StoreLayout()
         self.image_path = file
-        self.pixmap = QPixmap(str(file))
+        if self.stripMode and IsStrip(file):
+            self.OpenStrip(file)
+            return
+        with Span("QPixmap decode"):
+            self.pixmap = QPixmap(str(file))
         if self.pixmap.width() * self.pixmap.height() == 0:
             return
 
         self.available_colors = list(AVAILABLE_COLORS)
-        self.zoom = 1.0
-        self.offset = QPoint()
+        self.document.ResetView()
         self.image_loaded = True
         if (
             self.parent() is not None
             and hasattr(self.parent(), "imageLabel")
             and self.image_path is not None
         ):
-            files = GetImageFiles(self.image_path.parent)
-            idx = files.index(self.image_path) + 1
-
-            self.parent().imageLabel.setText(f"{self.image_path.name} ({idx}/{len(files)})")  # pyright: ignore[reportOptionalMemberAccess, reportAttributeAccessIssue]
-        if not keepPolygons:
-            self.saveBounds = []
+            with Span("FolderIndex"):
+                index = GetFolderIndex(self.image_path.parent)
+                idx = (index.Position(self.image_path) or 0) + 1
+                index.SetDimensions(self.image_path, self.pixmap.width(), self.pixmap.height())
+
+            label = f"{self.image_path.name} ({idx}/{len(index)})"
+            if duplicates := NearDuplicates(self.image_path):
+                label += f" \u2248 {duplicates[0].name}"
+            self.parent().imageLabel.setText(label)  # pyright: ignore[reportOptionalMemberAccess, reportAttributeAccessIssue]
+        self.image_digest = None
+        if keepPolygons:
+            self.document.layouts = {self.MODE: self.document.LayoutFor(self.MODE)}
+            self.HashImage()
+        else:
+            # layouts of the other modes belong to the previous image too
+            self.document.layouts = {}
+            with history.Paused():
+                self.BoundsChanged()
+            self.RestoreLayout()
+        history.Baseline(self.MODE, self.saveBounds)
         self.UpdateScaling()
         self.update()
-        self.image_obj = Image.open(self.image_path).copy()
+        with Span("Image.open copy"):
+            self.image_obj = Image.open(self.image_path).copy()
+
+    def OpenStrip(self, file: Path) -> None:
+        """Select a tall strip without decoding it; strips are split from disk in strip mode."""
+        self.pixmap = QPixmap()
+        self.scaled_pixmap = QPixmap()
+        self.image_obj = None
+        self.image_loaded = False
+        self.image_digest = None
+        self.document.layouts = {}
+        if self.parent() is not None and hasattr(self.parent(), "imageLabel"):
+            self.parent().imageLabel.setText(f"{file.name} (strip, J to split)")  # pyright: ignore[reportOptionalMemberAccess, reportAttributeAccessIssue]
+        self.update()
+
+    def StoreLayout(self) -> None:
+        """Persist the current polygons for the loaded image, keyed by its content.
+
+        A layout cleared of every polygon is deleted, so it is not restored again.
+        """
+        if self.image_path is None or not self.image_loaded:
+            return
+        if not self.saveBounds:
+            # without a digest the stored layout was never restored, so it was not cleared
+            if self.image_digest is not None:
+                DeleteLayout(self.image_path, self.MODE)
+            return
+        SaveLayout(
+            self.image_path,
+            # left before its hash job finished
+            self.image_digest or ContentHash(self.image_path),
+            Layout(self.MODE, list(self.saveBounds), self.trimPadding, self.gridSpec),
+        )
 
-    def SaveSections(self, _createSubdir: bool) -> None:
+    def ApplyDuplicateLayout(self) -> None:
+        """Replace the polygons with the split of the near-duplicate named in the label."""
+        if self.image_path is None:
+            return
+        layout = LoadDuplicateLayout(self.image_path, self.MODE)
+        if layout is None:
+            return
+        self.saveBounds = layout.polygons
+        self.trimPadding = layout.trimPadding
+        self.update()
+
+    def HashImage(self) -> None:
+        """Set `image_digest` from the digest cache, or hash the open file on the scheduler.
+
+        Hashing reads the whole file, which can be slow on a network share, so
+        it is kept off the GUI thread; `DigestReady` restores the layout then.
+        """
+        if self.image_path is None or not self.image_loaded:
+            return
+        self.image_digest = CachedHash(self.image_path)
+        if self.image_digest is not None:
+            return
+        file = self.image_path
+        try:
+            key = DigestKey(file)
+        except OSError:
+            return
+        if self.document.digestJob is None or self.document.digestJob[0] != key:
+            job = Submit(INTERACTIVE, lambda: ContentHash(file), "ContentHash")
+            self.document.digestJob = (key, job.future)
+        future = self.document.digestJob[1]
+        future.add_done_callback(lambda f: GuiCall(lambda: self.DigestReady(f)))
+
+    def DigestReady(self, future: Future) -> None:
+        # replaced by the other mode's widget, which waits on the same job
+        if sip.isdeleted(self) or future.cancelled() or future.exception() is not None:
+            return
+        # the digest no longer applies once another page is open or this one was rewritten
+        if self.image_path is None or CachedHash(self.image_path) != future.result():
+            return
+        self.document.digestJob = None
+        if self.image_digest is None:
+            self.image_digest = future.result()
+            # a page the user started on in the meantime keeps their polygons
+            if not self.saveBounds:
+                self.RestoreLayout()
+                self.update()
+
+    def RestoreLayout(self) -> None:
+        if self.image_path is None:
+            return
+        if self.image_digest is None:
+            self.HashImage()
+            if self.image_digest is None:
+                return
+        layout = LoadLayout(self.image_path, self.MODE, self.image_digest)
+        if layout is None:
+            return
+        with self.document.history.Paused():
+            self.saveBounds = layout.polygons
+        self.document.history.Baseline(self.MODE, self.saveBounds)
+        self.trimPadding = layout.trimPadding
+        self.gridSpec = layout.gridSpec
+        parent = self.parent()
+        if parent is not None and hasattr(parent, "trimPad") and hasattr(parent, "gridEntry"):
+            parent.trimPad.setValue(layout.trimPadding)  # pyright: ignore[reportAttributeAccessIssue]
+            if layout.gridSpec:
+                parent.gridEntry.setText(layout.gridSpec)  # pyright: ignore[reportAttributeAccessIssue]
+
+    def SaveSections(self, _createSubdir: bool, _output: str = OUTPUT_FILES) -> None:
         ThrowNotImplemented(self)
 
     def AddGrid(self, _vert: int, _horz: int) -> None:
         ThrowNotImplemented(self)
 
-    def Trim(self, _padding: int) -> None:
+    def Trim(self, padding: int) -> None:
+        RunNow(self.TrimJob(padding))
+
+    def TrimJob(self, _padding: int) -> Job | None:
+        """Return `Trim` as a (work, apply) pair, so the work can run off the GUI thread."""
         ThrowNotImplemented(self)
+        return None
 
-    def AutoDraw(self) -> None:
+    def AutoDraw(self, engine: str = "") -> None:
+        RunNow(self.AutoDrawJob(engine))
+
+    def AutoDrawJob(self, _engine: str = "") -> Job | None:
+        """Return `AutoDraw` as a (work, apply) pair, so the work can run off the GUI thread."""
         ThrowNotImplemented(self)
+        return None
 
     def Crop(self, _keepBounds: bool = False) -> None:
         ThrowNotImplemented(self)
 
-    def Translate(self, _auto: bool = False) -> None:
+    def AutoSplit(self, _image: Image.Image, _engine: str, _padding: int) -> list[Polygon]:
+        """Return the panels AutoDraw and Trim would give `image`, without changing the widget."""
+        ThrowNotImplemented(self)
+        return []
+
+    def Sections(
+        self,
+        _path: Path,
+        _bounds: list[Polygon],
+        _size: tuple[int, int],
+        _dst: Path,
+    ) -> list[tuple[Box, Path]]:
+        """Return the (box, output file) of each section `bounds` cut from the image at `path`."""
+        ThrowNotImplemented(self)
+        return []
+
+    @staticmethod
+    def SectionDir(path: Path, createSubdir: bool) -> Path:
+        return path.parent / path.stem if createSubdir else path.parent
+
+    def Translate(self, auto: bool = False) -> None:
+        RunNow(self.TranslateJob(auto))
+
+    def TranslateJob(self, _auto: bool = False) -> Job | None:
+        """Return `Translate` as a (work, apply) pair, so the work can run off the GUI thread."""
         ThrowNotImplemented(self)
+        return None
+
+    def SafeOverwrite(self, im: Image.Image, box: tuple[int, int, int, int] | None = None) -> None:
+        """Replace the file with `im`, keeping the old one in the trash and history.
+
+        `box` is the crop box when `im` is a crop of the current image. The
+        widget shows `im` directly rather than decoding the written file.
+        """
+        if self.image_path is None:
+            return
+        history = self.document.history
+        with history.Group():
+            if self.image_obj is not None:
+                history.RecordImage(self.image_obj, im, box)
+            self.StoreLayout()
+            with Span("encode"):
+                ReplaceFile(self.image_path, im)
+            self.ShowImage(im)
+            # the same steps as LoadImage for a new image at this path
+            self.available_colors = list(AVAILABLE_COLORS)
+            self.document.ResetView()
+            self.document.layouts = {}
+            with history.Paused():
+                self.BoundsChanged()
+            self.RestoreLayout()
+            history.Baseline(self.MODE, self.saveBounds)
+            self.UpdateScaling()
+            self.update()
 
-    def SafeOverwrite(self, im: Image.Image) -> None:
+    def ReplaceImage(self, im: Image.Image) -> None:
+        """Write `im` over the open file and show it, keeping polygons and history."""
         if self.image_path is None:
             return
-        if self.image_path.exists():
-            send2trash.send2trash(self.image_path)
-        im.save(self.image_path)
-        self.LoadImage(self.image_path)
+        ReplaceFile(self.image_path, im, keepOld=False)
+        self.ShowImage(im)
+        self.UpdateScaling()
+        self.BoundsChanged()
+
+    @Timed("ShowImage")
+    def ShowImage(self, im: Image.Image) -> None:
+        """Make `im`, just written to `image_path`, the open image without decoding the file."""
+        self.image_obj = im
+        self.pixmap = ToPixmap(im)
+        self.image_digest = None
+        GetFolderIndex(self.image_path.parent).SetDimensions(self.image_path, *im.size)
+
+    def Undo(self) -> None:
+        self.ApplyChanges(self.document.history.Undo(), undo=True)
+
+    def Redo(self) -> None:
+        self.ApplyChanges(self.document.history.Redo(), undo=False)
+
+    def ApplyChanges(self, changes: list[Change] | None, undo: bool) -> None:
+        if not changes:
+            return
+        with self.document.history.Paused():
+            for change in changes:
+                if isinstance(change, ImageChange):
+                    revert = change.Revert if undo else change.Apply
+                    self.ReplaceImage(revert(self.image_obj))
+                    continue
+                polygons = Thaw(change.before if undo else change.after)
+                if change.mode == self.MODE:
+                    self.saveBounds = polygons
+                else:
+                    self.document.LayoutFor(change.mode).polygons = polygons
+        self.update()
 
     def RemoveLast(self) -> None:
         if self.saveBounds:
             self.saveBounds.pop()
+            self.BoundsChanged()
 
     def RemovePolygon(self, poly: Polygon) -> None:
         if poly in self.saveBounds:
             self.saveBounds.remove(poly)
+            self.BoundsChanged()
         self.update()
 
     def LoadNext(self, p: Path | None, reverse: bool = False, keepPolygons: bool = False) -> None:
         if p is None:
             return
-        files = GetImageFiles(p.parent)
-        idx = -10
-        if p.exists():
-            idx = files.index(p)
-        elif p.parent.exists():
-            position = [x for x in files if x > p]
-            idx = files.index(position[0]) - 1 if position else -1
-        if idx >= -1:
-            if idx + 1 < len(files) and reverse is False:
-                self.LoadImage(str(files[idx + 1]), keepPolygons=keepPolygons)
-            elif idx - 1 >= 0 and reverse is True:
-                self.LoadImage(str(files[idx - 1]), keepPolygons=keepPolygons)
-            elif idx + 1 >= len(files):
-                self.LoadImage(str(files[0]), keepPolygons=keepPolygons)
-            elif idx - 1 < 0:
-                self.LoadImage(str(files[len(files) - 1]), keepPolygons=keepPolygons)
+        if not p.parent.exists():
+            return
+        nextPath = GetFolderIndex(p.parent).Neighbour(p, reverse=reverse)
+        if nextPath is not None:
+            self.LoadImage(str(nextPath), keepPolygons=keepPolygons)
 
     @property
     def isFullyCovered(self) -> bool:
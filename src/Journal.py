@@ -0,0 +1,298 @@
+"""Journal of the files we delete or overwrite, for exact restores.
+
+Trashing a page first renames it into a hidden `STAGING_DIR` beside it, which
+is instant and takes it out of the folder listing, and records the move in a
+journal under `AppDataDir()`. A single background thread then hands staged
+files to `send2trash` and records where each one landed, so `RestoreLast`
+moves the newest file back from staging or the trash without listing either.
+Overwrites hard-link the old file into staging and rename the new one over it,
+so the path never goes missing.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+from PIL import Image
+from PyQt6.QtWidgets import QMessageBox
+from send2trash import send2trash
+
+from .Utility import AppDataDir, RecordFileAdded, RecordFileRemoved, RestoreFromRecycle
+
+if os.name == "nt":
+    import winshell
+
+STAGING_DIR = ".trash-staging"
+JOURNAL_NAME = "journal.jsonl"
+# bytes read back from the end of the journal; older operations are not restorable
+JOURNAL_TAIL = 256 * 1024
+# the journal is rewritten down to its newest live entries once it grows past this
+JOURNAL_MAX = 4 * 1024 * 1024
+JOURNAL_KEEP = 1000
+
+JOURNAL: "Journal | None" = None
+
+
+class JournalEntry:
+    """One deleted or overwritten file and where it is now."""
+
+    def __init__(self, key: str, op: str, path: Path, staged: Path) -> None:
+        self.key = key
+        self.op = op
+        self.path = path
+        self.staged = staged
+        # location in the trash once the background move is done
+        self.trashed: Path | None = None
+        self.restored = False
+
+    def ToDict(self) -> dict[str, Any]:
+        return {"id": self.key, "op": self.op, "path": str(self.path), "staged": str(self.staged)}
+
+
+def TrashCandidates(staged: Path) -> list[Path]:
+    """Return where `send2trash` may have put `staged`, without listing any trash folder."""
+    if os.name == "nt":
+        return []
+    home = Path.home()
+    candidates = [home / ".Trash" / staged.name]
+    dataHome = Path(os.environ.get("XDG_DATA_HOME", home / ".local/share"))
+    candidates.append(dataHome / "Trash" / "files" / staged.name)
+    # files on other volumes go to that volume's trash
+    mount = staged.parent
+    try:
+        dev = mount.stat().st_dev
+        while mount.parent != mount and mount.parent.stat().st_dev == dev:
+            mount = mount.parent
+    except OSError:
+        return candidates
+    uid = os.getuid()
+    candidates.append(mount / ".Trash" / str(uid) / "files" / staged.name)
+    candidates.append(mount / f".Trash-{uid}" / "files" / staged.name)
+    return candidates
+
+
+class Journal:
+    """Append-only log of our trash operations with a background trash queue.
+
+    Only the tail of the log is read back, so opening it and finding the
+    newest restorable file costs the same however long it and the trash grow.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.entries: OrderedDict[str, JournalEntry] = OrderedDict()
+        # guards `entries` and writes to the log
+        self.lock = threading.Lock()
+        # held while a file is moved, so a restore never races its own trashing
+        self.moving = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trash")
+        self.Load()
+
+    def Load(self) -> None:
+        if not self.path.exists():
+            return
+        with self.path.open("rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(size - JOURNAL_TAIL, 0))
+            lines = f.read().splitlines()
+        if size > JOURNAL_TAIL:
+            # the first line is cut off
+            lines = lines[1:]
+        for line in lines:
+            try:
+                self.Apply(json.loads(line))
+            except (ValueError, KeyError, TypeError):
+                logging.debug("Skipping journal line %r", line)
+        # files staged by a session that quit before trashing them
+        for entry in self.entries.values():
+            if entry.trashed is None and not entry.restored and entry.staged.exists():
+                self.executor.submit(self.Trash, entry)
+
+    def Apply(self, record: dict[str, Any]) -> None:
+        key = record["id"]
+        if "op" in record:
+            self.entries[key] = JournalEntry(
+                key,
+                record["op"],
+                Path(record["path"]),
+                Path(record["staged"]),
+            )
+        elif key in self.entries:
+            entry = self.entries[key]
+            if "trashed" in record:
+                entry.trashed = Path(record["trashed"]) if record["trashed"] else None
+            if record.get("restored"):
+                entry.restored = True
+
+    def Append(self, record: dict[str, Any]) -> None:
+        with self.lock:
+            self.Apply(record)
+            try:
+                with self.path.open("a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+                    size = f.tell()
+                if size > JOURNAL_MAX:
+                    self.Compact()
+            except OSError:
+                logging.exception("Failed to write journal %s", self.path)
+
+    def Compact(self) -> None:
+        """Rewrite the log with only the newest entries that can still be restored."""
+        live = [x for x in self.entries.values() if not x.restored][-JOURNAL_KEEP:]
+        self.entries = OrderedDict((x.key, x) for x in live)
+        partial = self.path.with_suffix(".tmp")
+        with partial.open("w", encoding="utf-8") as f:
+            for entry in live:
+                f.write(json.dumps(entry.ToDict()) + "\n")
+                if entry.trashed is not None:
+                    f.write(json.dumps({"id": entry.key, "trashed": str(entry.trashed)}) + "\n")
+        partial.replace(self.path)
+
+    def Stage(self, path: Path, op: str, link: bool = False) -> JournalEntry:
+        """Move `path` into staging, journal it and queue it for the trash.
+
+        With `link` the file is hard-linked into staging instead and stays in
+        place, for a caller about to replace it.
+        """
+        staging = path.parent / STAGING_DIR
+        staging.mkdir(exist_ok=True)
+        key = uuid.uuid4().hex
+        # a unique name keeps send2trash from renaming it, so its trash location is known
+        staged = staging / f"{path.stem}.{key[:12]}{path.suffix}"
+        if not link:
+            path.rename(staged)
+        else:
+            try:
+                os.link(path, staged)
+            except OSError:
+                # filesystems without hard links
+                shutil.copy2(path, staged)
+        entry = JournalEntry(key, op, path, staged)
+        self.Append({**entry.ToDict(), "time": time.time()})
+        self.executor.submit(self.Trash, entry)
+        return entry
+
+    def Trash(self, entry: JournalEntry) -> None:
+        with self.moving:
+            if entry.restored or not entry.staged.exists():
+                return
+            try:
+                send2trash(entry.staged)
+            except OSError:
+                logging.exception("Failed to trash %s", entry.staged)
+                return
+            entry.trashed = next((x for x in TrashCandidates(entry.staged) if x.exists()), None)
+        self.Append({"id": entry.key, "trashed": str(entry.trashed or "")})
+
+    def Last(self) -> JournalEntry | None:
+        """Return the newest entry not yet restored."""
+        with self.lock:
+            return next((x for x in reversed(self.entries.values()) if not x.restored), None)
+
+    def Restore(self, entry: JournalEntry) -> Path | None:
+        """Move `entry` back to its original path and return it, or None if it is gone.
+
+        A file now at that path (the replacement of an overwrite) is kept as
+        "<name> (edited)", like `RestoreFromRecycle` does.
+        """
+        with self.moving:
+            source = self.Locate(entry)
+            if source is None:
+                return None
+            path = entry.path
+            if path.exists():
+                edited = path.parent / f"{path.stem} (edited){path.suffix}"
+                path.rename(edited)
+                RecordFileAdded(edited)
+            try:
+                shutil.move(source, path)
+            except OSError:
+                logging.exception("Failed to restore %s", path)
+                return None
+            if source.parent.name == "files":
+                (source.parent.parent / "info" / f"{source.name}.trashinfo").unlink(
+                    missing_ok=True,
+                )
+            entry.restored = True
+        self.Append({"id": entry.key, "restored": True})
+        RecordFileAdded(path)
+        return path
+
+    def Locate(self, entry: JournalEntry) -> Path | None:
+        if entry.staged.exists():
+            return entry.staged
+        if entry.trashed is not None and entry.trashed.exists():
+            return entry.trashed
+        if os.name == "nt":
+            try:
+                # the recycle bin restores to the staged path
+                winshell.undelete(str(entry.staged))  # pyright: ignore[reportPossiblyUnboundVariable]
+            except Exception:
+                logging.debug("%s is not in the recycle bin", entry.staged)
+            return entry.staged if entry.staged.exists() else None
+        return None
+
+
+def GetJournal() -> Journal:
+    """Return the shared journal, opening it on first use."""
+    global JOURNAL
+    if JOURNAL is None:
+        JOURNAL = Journal(AppDataDir() / JOURNAL_NAME)
+    return JOURNAL
+
+
+def TrashFile(path: Path) -> None:
+    """Send `path` to the trash in the background, journaled for `RestoreLast`."""
+    GetJournal().Stage(path, "delete")
+    RecordFileRemoved(path)
+
+
+def ReplaceFile(path: Path, im: Image.Image, keepOld: bool = True) -> None:
+    """Write `im` over `path` atomically, in the format its suffix names.
+
+    `im` is written to a temporary file beside `path` and renamed over it, so
+    `path` always holds a whole image. With `keepOld` the old file goes to the
+    trash like `TrashFile` and `RestoreLast` can bring it back.
+    """
+    partial = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    im.save(partial, Image.registered_extensions().get(path.suffix.lower()))
+    try:
+        if keepOld and path.exists():
+            GetJournal().Stage(path, "overwrite", link=True)
+        partial.replace(path)
+    except OSError:
+        partial.unlink(missing_ok=True)
+        raise
+    RecordFileAdded(path)
+
+
+def RestoreLast(parent: Any) -> None:
+    """Offer to restore the last file we trashed, falling back to scanning the trash."""
+    journal = GetJournal()
+    entry = journal.Last()
+    if entry is None:
+        RestoreFromRecycle(parent)
+        return
+    dlg = QMessageBox(parent)
+    dlg.setWindowTitle("File Restored")
+    dlg.setText(f"Restore {entry.path.name}?")
+    dlg.setStandardButtons(
+        QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+    )
+    if dlg.exec() != QMessageBox.StandardButton.Yes:
+        return
+    restored = journal.Restore(entry)
+    if restored is None:
+        logging.warning("%s is no longer in the trash", entry.path)
+        # skip it next time
+        journal.Append({"id": entry.key, "restored": True})
+        return
+    parent.ImageViewer.LoadImage(restored)
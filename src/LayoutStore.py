@@ -0,0 +1,169 @@
+"""Per-image layout persistence."""
+
+import hashlib
+import json
+import logging
+import sqlite3
+from pathlib import Path
+
+from PyQt6.QtCore import QPoint
+
+from .Components import Polygon
+from .Duplicates import NearDuplicates
+from .FolderIndex import GetFolderIndex
+
+# files larger than this are identified by their size, head and tail instead of
+# every byte, so revisiting a multi-gigabyte scan does not mean rereading it
+FULL_HASH_LIMIT = 64 * 1024 * 1024
+SAMPLE_SIZE = 8 * 1024 * 1024
+
+# digests keyed by (path, size, mtime_ns) so revisits do not rehash
+DIGEST_CACHE: dict[tuple[str, int, int], str] = {}
+
+
+class Layout:
+    """Polygons and the settings that produced them for one image."""
+
+    def __init__(
+        self,
+        mode: str,
+        polygons: list[Polygon],
+        trimPadding: int = 0,
+        gridSpec: str = "",
+    ) -> None:
+        self.mode = mode
+        self.polygons = polygons
+        self.trimPadding = trimPadding
+        self.gridSpec = gridSpec
+
+    def ToJson(self) -> str:
+        return json.dumps(
+            {
+                "polygons": [p.ToDict() for p in self.polygons],
+                "trimPadding": self.trimPadding,
+                "gridSpec": self.gridSpec,
+            },
+        )
+
+    @classmethod
+    def FromJson(cls, mode: str, text: str) -> "Layout":
+        data = json.loads(text)
+        return cls(
+            mode,
+            [Polygon.FromDict(p) for p in data["polygons"]],
+            data.get("trimPadding", 0),
+            data.get("gridSpec", ""),
+        )
+
+
+def DigestKey(path: Path) -> tuple[str, int, int]:
+    stat = path.stat()
+    return (str(path), stat.st_size, stat.st_mtime_ns)
+
+
+def CachedHash(path: Path) -> str | None:
+    """Return the digest of `path` if it was hashed since it last changed, without reading it."""
+    try:
+        return DIGEST_CACHE.get(DigestKey(path))
+    except OSError:
+        return None
+
+
+def ContentHash(path: Path) -> str:
+    """Return a content digest for `path`, cached against its size and mtime."""
+    key = DigestKey(path)
+    size = key[1]
+    if key in DIGEST_CACHE:
+        return DIGEST_CACHE[key]
+
+    with path.open("rb") as f:
+        if size <= FULL_HASH_LIMIT:
+            digest = hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16))
+        else:
+            digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+            digest.update(f.read(SAMPLE_SIZE))
+            f.seek(-SAMPLE_SIZE, 2)
+            digest.update(f.read(SAMPLE_SIZE))
+    DIGEST_CACHE[key] = digest.hexdigest()
+    return DIGEST_CACHE[key]
+
+
+def SaveLayout(path: Path, digest: str, layout: Layout) -> None:
+    """Store `layout` for the image at `path` whose content hashed to `digest`."""
+    try:
+        with GetFolderIndex(path.parent).Transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO layouts (name, mode, digest, data) VALUES (?, ?, ?, ?)",
+                (path.name, layout.mode, digest, layout.ToJson()),
+            )
+    except sqlite3.Error:
+        logging.exception("Failed to store layout for %s", path)
+
+
+def DeleteLayout(path: Path, mode: str) -> None:
+    """Forget the layout stored for the image at `path` in `mode`."""
+    try:
+        with GetFolderIndex(path.parent).Transaction() as db:
+            db.execute("DELETE FROM layouts WHERE name = ? AND mode = ?", (path.name, mode))
+    except sqlite3.Error:
+        logging.exception("Failed to delete layout for %s", path)
+
+
+def StoredNames(folder: Path, mode: str) -> set[str]:
+    """Return the names of the images in `folder` with a layout stored in `mode`."""
+    try:
+        rows = GetFolderIndex(folder).Query("SELECT name FROM layouts WHERE mode = ?", (mode,))
+    except sqlite3.Error:
+        logging.exception("Failed to list layouts in %s", folder)
+        return set()
+    return {name for (name,) in rows}
+
+
+def LoadLayout(path: Path, mode: str, digest: str | None = None) -> Layout | None:
+    """Return the stored layout for `path` in `mode` if its content is unchanged.
+
+    Falls back to a layout stored under another name with the same content, so
+    renamed pages keep their splits. A near-duplicate's layout is never
+    restored on its own; see `LoadDuplicateLayout`.
+    """
+    try:
+        digest = digest or ContentHash(path)
+        index = GetFolderIndex(path.parent)
+        rows = index.Query(
+            "SELECT data FROM layouts WHERE name = ? AND mode = ? AND digest = ?",
+            (path.name, mode, digest),
+        ) or index.Query("SELECT data FROM layouts WHERE mode = ? AND digest = ?", (mode, digest))
+    except (OSError, sqlite3.Error):
+        logging.exception("Failed to read layout for %s", path)
+        return None
+    return Layout.FromJson(mode, rows[0][0]) if rows else None
+
+
+def LoadDuplicateLayout(path: Path, mode: str) -> Layout | None:
+    """Return the layout of the closest near-duplicate of `path`, scaled to its size.
+
+    Different pages of the same grid are perceptual matches too, so this is
+    only applied when the user asks for it.
+    """
+    index = GetFolderIndex(path.parent)
+    size = index.Dimensions(path)
+    for duplicate in NearDuplicates(path):
+        rows = index.Query(
+            "SELECT data FROM layouts WHERE name = ? AND mode = ?",
+            (duplicate.name, mode),
+        )
+        if not rows:
+            continue
+        layout = Layout.FromJson(mode, rows[0][0])
+        other = index.Dimensions(duplicate)
+        if size and other and size != other:
+            sx, sy = size[0] / other[0], size[1] / other[1]
+            layout.polygons = [
+                Polygon(
+                    [QPoint(round(p.x() * sx), round(p.y() * sy)) for p in poly.Points],
+                    poly.Color,
+                )
+                for poly in layout.polygons
+            ]
+        return layout
+    return None
@@ -2,27 +2,43 @@
 
 import random
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import send2trash
-from numpy import median
-from PyQt6.QtCore import QPoint, QRect, QSize, Qt
-from PyQt6.QtGui import QColor, QImage, QMouseEvent, QPainter, QPaintEvent, QPen
+from PIL import Image
+from PyQt6.QtCore import QLine, QPoint, QSize, Qt
+from PyQt6.QtGui import QColor, QMouseEvent, QPainter, QPaintEvent, QPen
 
-from src.AutoDraw import SliceImage
-from src.Components import Polygon
+from src.Components import AUTODRAW_ENGINES, Polygon
+from src.Document import ImageDocument
+from src.Export import OUTPUT_CBZ, OUTPUT_FILES, Box
 from src.ImageWidget import AVAILABLE_COLORS, ImageWidget
-from src.LineCalcs import ExtendLines, TrimOrthoLines
+from src.Profiling import Timed
+from src.Scheduler import Checkpoint
+from src.Tasks import Job
+from src.Utility import RecordFileAdded
+
+if TYPE_CHECKING:
+    import numpy as np
 
 
 class LineWidget(ImageWidget):
     """Line drawing image widget."""
 
+    MODE = "line"
+    # sections of a single color are empty grid cells and not saved
+    SKIP_UNIFORM = True
+
     def __init__(
         self,
         image_path: Path | None = None,
         polygons: list[Polygon] | None = None,
+        document: ImageDocument | None = None,
     ) -> None:
-        super().__init__(image_path, polygons)
+        # extended preview lines in image coordinates, rebuilt only when bounds change
+        self.extendedLines: "np.ndarray | None" = None
+        self.extendedColors: list[tuple[QColor, int, int]] = []
+        self.extendedSize: tuple[int, int] = (0, 0)
+        super().__init__(image_path, polygons, document)
 
         # line drawing state
         self.drawing_line = False
@@ -97,11 +113,11 @@ class LineWidget(ImageWidget):
             # FOR NOW snap to straight lines
             isVertical = abs(start.x() - end.x()) < abs(start.y() - end.y())
             if isVertical:
-                medianX = round(median([start.x(), end.x()]))
+                medianX = round((start.x() + end.x()) / 2)
                 start.setX(medianX)
                 end.setX(medianX)
             else:
-                medianY = round(median([start.y(), end.y()]))
+                medianY = round((start.y() + end.y()) / 2)
                 start.setY(medianY)
                 end.setY(medianY)
 
@@ -109,6 +125,7 @@ class LineWidget(ImageWidget):
             line = Polygon([start, end], self.currentColor)
             line.BindTo(width=self.pixmap.width(), height=self.pixmap.height())
             self.saveBounds.append(line)
+            self.BoundsChanged()
 
         self.update()
 
@@ -120,23 +137,56 @@ class LineWidget(ImageWidget):
             return
         self.update()
 
+    def BoundsChanged(self) -> None:
+        super().BoundsChanged()
+        self.extendedLines = None
+
+    def BuildExtendedLines(self) -> "np.ndarray":
+        """Extend every line to the image edges, grouped by color for batched drawing."""
+        import numpy as np
+
+        from src.LineCalcs import ExtendLines
+
+        image_size = QSize(*self.extendedSize)
+        grouped: dict[int, tuple[QColor, list[tuple[int, int, int, int]]]] = {}
+        for line in self.saveBounds:
+            extended_line = ExtendLines(line, image_size)
+            if extended_line:
+                start, end = extended_line.Points[0], extended_line.Points[1]
+                _, coords = grouped.setdefault(line.Color.rgba(), (line.Color, []))
+                coords.append((start.x(), start.y(), end.x(), end.y()))
+
+        self.extendedColors = []
+        rows: list[tuple[int, int, int, int]] = []
+        for color, coords in grouped.values():
+            self.extendedColors.append((color, len(rows), len(rows) + len(coords)))
+            rows.extend(coords)
+        return np.array(rows, dtype=np.int64).reshape(-1, 4)
+
     def PreviewLines(self, painter: QPainter) -> None:
         """Draw extended lines and boundary lines for visualization."""
         if not self.pixmap:
             return
 
-        image_size = QSize(self.pixmap.width(), self.pixmap.height())
+        size = (self.pixmap.width(), self.pixmap.height())
+        if self.extendedLines is None or self.extendedSize != size:
+            self.extendedSize = size
+            self.extendedLines = self.BuildExtendedLines()
+        if not len(self.extendedLines):
+            return
+        import numpy as np
+
+        # same truncation as ScaleToDisplay, applied to the whole scene at once
+        scale = self.baseScale * self.zoom
+        offset = np.array([self.offset.x(), self.offset.y()] * 2, dtype=np.int64)
+        display = (self.extendedLines * scale).astype(np.int64) + offset
 
-        for line in self.saveBounds:
-            pen = QPen(line.Color, 3)
-            painter.setPen(pen)
-            extended_line = ExtendLines(line, image_size)
-            if extended_line:
-                display_start = self.ScaleToDisplay(extended_line.Points[0])
-                display_end = self.ScaleToDisplay(extended_line.Points[1])
-                painter.drawLine(display_start, display_end)
+        for color, start, end in self.extendedColors:
+            painter.setPen(QPen(color, 3))
+            painter.drawLines([QLine(*row) for row in display[start:end].tolist()])
 
     def AddGrid(self, vert: int, horz: int) -> None:
+        self.gridSpec = f"{vert}x{horz}"
         vertSpacing = round(self.pixmap.width() / vert)
         horzSpacing = round(self.pixmap.height() / horz)
         offset = 0
@@ -163,29 +213,73 @@ class LineWidget(ImageWidget):
                 ),
             )
             offset += vertSpacing
+        self.BoundsChanged()
         self.update()
 
-    def AutoDraw(self) -> None:
-        if self.image_path:
-            self.saveBounds.extend(SliceImage(self.image_obj, True))
-        self.saveBounds = list(set(self.saveBounds))
-        self.update()
+    def AutoDrawJob(self, engine: str = AUTODRAW_ENGINES[0]) -> Job | None:
+        from src.AutoDraw import Detect
+        from src.Templates import MatchTemplate
 
-    def Trim(self, padding: int) -> None:
-        newBounds = self.saveBounds.copy()
-        if self.image_path is not None:
-            newBounds = [
-                Polygon(line, poly.Color)
-                for poly in self.saveBounds
-                for line in TrimOrthoLines(
-                    poly.Points,
-                    self.image_obj,
-                    padding,
-                    [self.pixmap.width(), self.pixmap.height()],
-                )
-            ]
-        self.saveBounds = newBounds
-        self.update()
+        image = self.image_obj if self.image_path else None
+
+        def Work() -> list[Polygon]:
+            if image is None:
+                return []
+            # a known page layout is cheaper and usually better than slicing again
+            return MatchTemplate(image, self.MODE) or Detect(image, True, engine)
+
+        def Apply(found: list[Polygon]) -> None:
+            self.saveBounds.extend(found)
+            self.saveBounds = list(set(self.saveBounds))
+            self.update()
+
+        return Work, Apply
+
+    def TrimBounds(
+        self,
+        image: Image.Image,
+        lines: list[Polygon],
+        padding: int,
+    ) -> list[tuple[Polygon, list[Polygon]]]:
+        """Return each line of `lines` with the pieces trimming it leaves."""
+        from src.LineCalcs import TrimOrthoLines
+
+        size = list(image.size)
+        trimmed = []
+        for idx, poly in enumerate(lines):
+            Checkpoint(idx, len(lines))
+            pieces = TrimOrthoLines(poly.Points, image, padding, size)
+            trimmed.append((poly, [Polygon(line, poly.Color) for line in pieces]))
+        return trimmed
+
+    def AutoSplit(self, image: Image.Image, engine: str, padding: int) -> list[Polygon]:
+        from src.AutoDraw import Detect
+        from src.Templates import MatchTemplate
+
+        found = list(set(MatchTemplate(image, self.MODE) or Detect(image, True, engine)))
+        return [piece for _, pieces in self.TrimBounds(image, found, padding) for piece in pieces]
+
+    def TrimJob(self, padding: int) -> Job | None:
+        image = self.image_obj
+        lines = list(self.saveBounds)
+        hasImage = self.image_path is not None
+
+        def Work() -> list[tuple[Polygon, list[Polygon]]]:
+            if not hasImage:
+                return [(poly, [poly]) for poly in lines]
+            return self.TrimBounds(image, lines, padding)
+
+        def Apply(trimmed: list[tuple[Polygon, list[Polygon]]]) -> None:
+            self.trimPadding = padding
+            # lines deleted while trimming stay deleted, lines drawn meanwhile are kept
+            current = {id(x) for x in self.saveBounds}
+            before = {id(x) for x in lines}
+            self.saveBounds = [
+                piece for poly, pieces in trimmed if id(poly) in current for piece in pieces
+            ] + [x for x in self.saveBounds if id(x) not in before]
+            self.update()
+
+        return Work, Apply
 
     @property
     def ReadyToCrop(self) -> bool:
@@ -207,18 +301,16 @@ class LineWidget(ImageWidget):
         min_x, max_x = max(0, min(xs)), min(width, max(xs))
         min_y, max_y = max(0, min(ys)), min(height, max(ys))
 
-        cropped = self.image_obj.crop((min_x, min_y, max_x, max_y))
-        send2trash.send2trash(self.image_path)
-        cropped.save(self.image_path)
-
-        self.LoadImage(self.image_path)
-        self.saveBounds = bounds
+        box = (min_x, min_y, max_x, max_y)
+        with self.document.history.Group():
+            self.SafeOverwrite(self.image_obj.crop(box), box)
+            self.saveBounds = bounds
         self.update()
 
-    def SaveSections(self, createSubdir: bool = False) -> None:
-        if not self.image_path or not self.saveBounds:
-            return
-        width, height = self.image_obj.size
+    @staticmethod
+    def WithEdges(lines: list[Polygon], size: tuple[int, int]) -> list[Polygon]:
+        """Return `lines` plus the image border, which closes the outer sections."""
+        width, height = size
         edges = [
             Polygon([QPoint(0, 0), QPoint(0, height - 1)], QColor(Qt.GlobalColor.red)),
             Polygon([QPoint(0, 0), QPoint(width - 1, 0)], QColor(Qt.GlobalColor.red)),
@@ -231,53 +323,54 @@ class LineWidget(ImageWidget):
                 QColor(Qt.GlobalColor.red),
             ),
         ]
+        present = [p.RawPoints for p in lines]
+        return lines + [e for e in edges if e.RawPoints not in present]
+
+    def Sections(
+        self,
+        path: Path,
+        bounds: list[Polygon],
+        size: tuple[int, int],
+        dst: Path,
+    ) -> list[tuple[Box, Path]]:
+        bounds = self.WithEdges(bounds, size)
+        verts = [poly.Points[0].x() for poly in bounds if poly.isVerticalLine]
+        horz = [poly.Points[0].y() for poly in bounds if poly.isHorizontalLine]
+        sections = []
+        for vertIdx in range(len(verts) - 1):
+            for horIdx in range(len(horz) - 1):
+                startX, startY = verts[vertIdx], horz[horIdx]
+                endX, endY = verts[vertIdx + 1], horz[horIdx + 1]
+                if endX <= startX or endY <= startY:
+                    continue
+                output_path = dst / f"{path.stem} {vertIdx + 1:02d}_y{horIdx + 1:02d}{path.suffix}"
+                sections.append(((startX, startY, endX, endY), output_path))
+        return sections
 
-        for e in edges:
-            if e.RawPoints not in [p.RawPoints for p in self.saveBounds]:
-                self.saveBounds.append(e)
+    @Timed("SaveSections")
+    def SaveSections(self, createSubdir: bool = False, output: str = OUTPUT_FILES) -> None:
+        if not self.image_path or not self.saveBounds or self.image_obj is None:
+            return
+        from src.Export import WriteSections
+        from src.Templates import RememberTemplate
+
+        self.StoreLayout()
+        RememberTemplate(self.image_obj, self.MODE, self.saveBounds)
+        self.saveBounds = self.WithEdges(self.saveBounds, self.image_obj.size)
+        self.BoundsChanged()
 
         verts = [poly.Points[0].x() for poly in self.saveBounds if poly.isVerticalLine]
         horz = [poly.Points[0].y() for poly in self.saveBounds if poly.isHorizontalLine]
         if len(verts) < 2 and len(horz) < 2:
             return
 
-        dst: Path = (
-            (self.image_path.parent / self.image_path.stem)
-            if createSubdir
-            else self.image_path.parent
-        )
-        dst.mkdir(exist_ok=True)
-        qImage = QImage(str(self.image_path))
-        for vertIdx in range(len(verts) - 1):
-            for horIdx in range(len(horz) - 1):
-                startX, startY = verts[vertIdx], horz[horIdx]
-                endX, endY = verts[vertIdx + 1], horz[horIdx + 1]
-                if startX == endX or startY == endY:
-                    continue
-                rect = QRect(startX, startY, endX - startX, endY - startY)
-                if rect.width() > 0 and rect.height() > 0:
-                    cropped = qImage.copy(rect)
-
-                    # check if entire section is equal to first pixel
-                    first_pixel = cropped.pixel(0, 0)
-                    all_same = True
-                    for y in range(cropped.height()):
-                        for x in range(cropped.width()):
-                            if cropped.pixel(x, y) != first_pixel:
-                                all_same = False
-                                break
-                        if not all_same:
-                            break
-                    if all_same:
-                        continue  # all pixels are the same, skip saving
-
-                    cropped = qImage.copy(rect)
-                    cropped.save(
-                        str(
-                            dst / f"{self.image_path.stem} "
-                            f"{vertIdx + 1:02d}_y{horIdx + 1:02d}"
-                            f"{self.image_path.suffix}",
-                        ),
-                    )
-        if self.saveBounds:
+        dst = self.SectionDir(self.image_path, createSubdir)
+        # an archive holds its subfolder itself
+        if output != OUTPUT_CBZ:
+            dst.mkdir(exist_ok=True)
+            if createSubdir:
+                RecordFileAdded(dst)
+        sections = self.Sections(self.image_path, self.saveBounds, self.image_obj.size, dst)
+        WriteSections(self.image_path, sections, self.SKIP_UNIFORM, output)
+        if self.saveBounds and output == OUTPUT_FILES:
             self.LoadImage(dst / f"{self.image_path.stem} 001.png")
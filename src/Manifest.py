@@ -0,0 +1,161 @@
+"""Virtual splits: panel rectangles recorded instead of written out.
+
+`WriteManifest` appends one line per source page to `MANIFEST_NAME` in the
+folder its panels would have gone to: the source path relative to that
+folder, its content digest and size, and each panel's would-be file name and
+box in reading order. Nothing is decoded or encoded, so a page is "split" in
+the time it takes to append a line. A later line for the same source
+replaces the earlier one, so saving a page again just appends.
+
+`MaterializePanel` crops one panel from its source when a reader asks for
+it, and `MaterializePanels` all panels of a page in one pass, both through
+`RegionReader`, which decodes only what the panels need.
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+from PIL import Image
+
+from .Export import Box, RegionReader, Storable, Uniform
+from .LayoutStore import ContentHash
+from .Utility import RecordFileAdded
+
+MANIFEST_NAME = "panels.jsonl"
+MANIFEST_VERSION = 1
+
+# serializes appends from the GUI thread and scheduler jobs
+LOCK = threading.Lock()
+# parsed manifests, keyed like `DIGEST_CACHE` so an append invalidates them
+MANIFEST_CACHE: dict[tuple[str, int, int], dict[str, "ManifestEntry"]] = {}
+
+
+class ManifestEntry:
+    """The recorded split of one source page."""
+
+    def __init__(self, folder: Path, record: dict[str, Any]) -> None:
+        self.source = folder / record["source"]
+        self.digest: str = record["digest"]
+        self.size: tuple[int, int] = tuple(record["size"])
+        self.skipUniform: bool = record.get("skipUniform", False)
+        self.panels: list[tuple[str, Box]] = [(name, tuple(box)) for name, *box in record["panels"]]
+
+
+def WriteManifest(
+    source: Path,
+    sections: list[tuple[Box, Path]],
+    skipUniform: bool = False,
+) -> Path:
+    """Record the (box, output path) sections of `source` and return the manifest.
+
+    The manifest goes into the folder of the output paths. With `skipUniform`,
+    sections of a single color are left out when they are materialized, as
+    `ExportSections` leaves them out when writing files.
+    """
+    folder = sections[0][1].parent if sections else source.parent
+    manifest = folder / MANIFEST_NAME
+    with Image.open(source) as im:
+        size = im.size
+    record = {
+        "v": MANIFEST_VERSION,
+        "source": os.path.relpath(source, folder),
+        "digest": ContentHash(source),
+        "size": size,
+        "skipUniform": skipUniform,
+        "panels": [[output.name, *box] for box, output in sections],
+    }
+    with LOCK:
+        created = not manifest.exists()
+        with manifest.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+    if created:
+        RecordFileAdded(manifest)
+    return manifest
+
+
+def ReadManifest(folder: Path) -> dict[str, ManifestEntry]:
+    """Return the entries of the manifest in `folder` by source name, in the order first saved."""
+    manifest = folder / MANIFEST_NAME
+    try:
+        stat = manifest.stat()
+    except FileNotFoundError:
+        return {}
+    key = (str(manifest), stat.st_size, stat.st_mtime_ns)
+    if key in MANIFEST_CACHE:
+        return MANIFEST_CACHE[key]
+    entries: dict[str, ManifestEntry] = {}
+    with manifest.open(encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = ManifestEntry(folder, json.loads(line))
+            except (ValueError, KeyError, TypeError):
+                logging.debug("Skipping manifest line %r", line)
+                continue
+            entries[entry.source.name] = entry
+    MANIFEST_CACHE[key] = entries
+    return entries
+
+
+def Panels(folder: Path) -> Iterator[tuple[str, ManifestEntry]]:
+    """Yield the name of every panel recorded in `folder`, in reading order, with its entry."""
+    for entry in ReadManifest(folder).values():
+        for name, _box in entry.panels:
+            yield name, entry
+
+
+def MaterializePanels(
+    entry: ManifestEntry,
+    names: list[str] | None = None,
+) -> Iterator[tuple[str, Image.Image]]:
+    """Yield the panels of `entry`, or those in `names`, cropped from its source.
+
+    Raises ValueError if the source changed since it was split.
+    """
+    if ContentHash(entry.source) != entry.digest:
+        raise ValueError(f"{entry.source} changed since it was split")
+    panels = [(name, box) for name, box in entry.panels if names is None or name in names]
+    with RegionReader(entry.source) as reader:
+        for idx, region in reader.Crops([box for _, box in panels]):
+            if entry.skipUniform and Uniform(region):
+                continue
+            yield panels[idx][0], region
+
+
+def MaterializePanel(folder: Path, name: str) -> Image.Image | None:
+    """Return the panel `name` recorded in `folder`, or None if there is no such panel.
+
+    An empty grid cell the file export would have skipped is None too.
+    """
+    entry = next((entry for panel, entry in Panels(folder) if panel == name), None)
+    if entry is None:
+        return None
+    return next((image for _, image in MaterializePanels(entry, [name])), None)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Write out panels recorded in a split manifest.")
+    parser.add_argument("folder", type=Path, help=f"folder holding {MANIFEST_NAME}")
+    parser.add_argument("names", nargs="*", help="panels to write, default all")
+    parser.add_argument("--out", type=Path, help="output folder, default the manifest's")
+    args = parser.parse_args()
+    Image.MAX_IMAGE_PIXELS = None
+    out: Path = args.out or args.folder
+    out.mkdir(parents=True, exist_ok=True)
+    for entry in ReadManifest(args.folder).values():
+        wanted = [name for name, _ in entry.panels if not args.names or name in args.names]
+        if not wanted:
+            continue
+        for name, image in MaterializePanels(entry, wanted):
+            Storable(image, Path(name).suffix).save(out / name)
+            print(out / name, flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,142 @@
+"""Opt-in timing and allocation spans for the hot paths.
+
+Enabled with ``IMAGE_SPLITTER_PROFILE=1`` or the ``--profile`` flag. When
+disabled `Span` hands back a shared no-op context, so instrumented code pays
+only a function call.
+
+tracemalloc keeps one peak for the whole process, so only spans on the GUI
+thread record a peak: the process-wide peak while the span ran, including
+what scheduler jobs allocated meanwhile. Spans on worker threads record time
+only, as resetting the peak there would clobber the GUI span's.
+"""
+
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import Any
+
+ENABLED = os.environ.get("IMAGE_SPLITTER_PROFILE", "") not in ("", "0") or "--profile" in sys.argv
+# samples kept per stage for the rolling breakdown
+WINDOW = 50
+MAX_EVENTS = 200_000
+
+STATS: dict[str, deque[tuple[float, int | None]]] = {}
+EVENTS: deque[dict] = deque(maxlen=MAX_EVENTS)
+LOCK = threading.Lock()
+LOCAL = threading.local()
+ORIGIN = time.perf_counter()
+PROFILER: cProfile.Profile | None = None
+NOOP = contextlib.nullcontext()
+
+if ENABLED:
+    tracemalloc.start()
+
+
+@contextlib.contextmanager
+def Measure(name: str) -> Iterator[None]:
+    stack: list[list[Any]] = LOCAL.__dict__.setdefault("stack", [])
+    traced = threading.current_thread() is threading.main_thread()
+    if traced:
+        tracemalloc.reset_peak()
+    # [name, start, highest child peak]; peaks are absolute until recorded
+    frame: list[Any] = [name, time.perf_counter(), 0]
+    base = tracemalloc.get_traced_memory()[0]
+    stack.append(frame)
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        stack.pop()
+        peak = None
+        if traced:
+            peak = max(tracemalloc.get_traced_memory()[1], frame[2])
+            if stack:
+                # the child's reset hid whatever the parent peaked at before it
+                stack[-1][2] = max(stack[-1][2], peak)
+            peak -= base
+        Record(name, frame[1], end, peak)
+
+
+def Record(name: str, start: float, end: float, peak: int | None) -> None:
+    with LOCK:
+        STATS.setdefault(name, deque(maxlen=WINDOW)).append((end - start, peak))
+        EVENTS.append(
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - ORIGIN) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": {} if peak is None else {"peakBytes": peak},
+            },
+        )
+
+
+def Span(name: str) -> contextlib.AbstractContextManager:
+    """Time the enclosed block as stage `name`, nested under any open span."""
+    return Measure(name) if ENABLED else NOOP
+
+
+def Timed(name: str) -> Callable:
+    """Wrap a function in a `Span`."""
+
+    def Decorator(func: Callable) -> Callable:
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def Wrapper(*args: Any, **kwargs: Any) -> Any:
+            with Measure(name):
+                return func(*args, **kwargs)
+
+        return Wrapper
+
+    return Decorator
+
+
+def Breakdown() -> str:
+    """Return the rolling mean time and latest GUI thread peak per stage, slowest first."""
+    with LOCK:
+        rows = [
+            (
+                sum(s for s, _ in samples) / len(samples),
+                next((p for _, p in reversed(samples) if p is not None), None),
+                name,
+            )
+            for name, samples in STATS.items()
+        ]
+    return "  ".join(
+        f"{name} {mean * 1000:.1f}ms" + ("" if peak is None else f"/{peak / 2**20:.1f}MiB")
+        for mean, peak, name in sorted(rows, key=lambda row: row[0], reverse=True)
+    )
+
+
+def DumpChromeTrace(path: Path) -> Path:
+    """Write recorded spans in Chrome trace format (chrome://tracing, Perfetto)."""
+    with LOCK:
+        events = list(EVENTS)
+    path.write_text(json.dumps({"traceEvents": events}))
+    return path
+
+
+def ToggleCProfile(path: Path) -> Path | None:
+    """Start cProfile, or stop it and dump its stats to `path`; return the dump path."""
+    global PROFILER
+    if PROFILER is None:
+        PROFILER = cProfile.Profile()
+        PROFILER.enable()
+        return None
+    PROFILER.disable()
+    PROFILER.dump_stats(path)
+    PROFILER = None
+    return path
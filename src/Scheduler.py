@@ -0,0 +1,367 @@
+"""Shared priority scheduler for everything that runs off the GUI thread.
+
+Jobs are queued in one of four classes, highest priority first: work on
+the open image (INTERACTIVE), exports the user asked for (EXPORT), and
+speculative work: thumbnails and look-ahead (PREFETCH) and folder indexing
+(INDEX). Workers stay within a CPU budget, except for one slot kept for
+INTERACTIVE work, so what the user is waiting for never queues behind
+background work. A running speculative job that holds a slot a more urgent
+class needs is preempted at its next `Checkpoint` and requeued. Jobs that
+declare the memory they need are held back while the budget is spent.
+
+Threads a job fans out to, like auto-draw's slicing pool, take free slots
+through `Helpers` and count against the budget as well. The journal's one
+trash thread is the only other thread outside it; it mostly waits on disk.
+"""
+
+import contextlib
+import logging
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future
+from typing import Any
+
+from .Profiling import ENABLED as PROFILING
+from .Profiling import Record
+
+INTERACTIVE = 0
+EXPORT = 1
+PREFETCH = 2
+INDEX = 3
+CLASS_NAMES = ("interactive", "export", "prefetch", "index")
+# classes that may be preempted, and that run newest request first
+SPECULATIVE = (PREFETCH, INDEX)
+
+CPU_BUDGET = os.cpu_count() or 1
+# extra workers only INTERACTIVE jobs may use once the budget is taken
+INTERACTIVE_RESERVE = 1
+MEMORY_BUDGET = 2 * 1024**3
+
+SCHEDULER: "Scheduler | None" = None
+LOCAL = threading.local()
+
+
+class Cancelled(Exception):
+    """Raised by `Checkpoint` in a task that was cancelled."""
+
+
+class CancelToken:
+    """Cancellation flag and progress sink shared by a task and its runner."""
+
+    def __init__(self, report: Callable[[int, int], None] | None = None) -> None:
+        self.event = threading.Event()
+        self.report = report
+        self.percent = -1
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def Cancel(self) -> None:
+        self.event.set()
+
+    def Report(self, done: int, total: int) -> None:
+        # only whole-percent changes reach the GUI
+        percent = done * 100 // total if total else 0
+        if self.report is not None and percent != self.percent:
+            self.percent = percent
+            self.report(done, total)
+
+
+def Checkpoint(done: int = 0, total: int = 0) -> None:
+    """Stop the current task if it was cancelled, and report `done` of `total` steps.
+
+    Outside a task, and on threads a task did not start, this does nothing.
+    """
+    token: CancelToken | None = getattr(LOCAL, "token", None)
+    if token is None:
+        return
+    if token.cancelled:
+        raise Cancelled
+    if total:
+        token.Report(done, total)
+
+
+def CurrentToken() -> CancelToken | None:
+    """Return the token of the task running on this thread, to hand to helper threads."""
+    return getattr(LOCAL, "token", None)
+
+
+def Adopt(token: CancelToken | None) -> None:
+    """Make `Checkpoint` on this thread follow `token`, for helpers working for a task."""
+    LOCAL.token = token
+
+
+class ScheduledJob:
+    """A queued or running call; `future` holds its result."""
+
+    def __init__(
+        self,
+        scheduler: "Scheduler",
+        priority: int,
+        fn: Callable[[], Any],
+        name: str,
+        memory: int,
+        token: CancelToken | None,
+    ) -> None:
+        self.scheduler = scheduler
+        self.priority = priority
+        self.fn = fn
+        self.name = name
+        self.memory = memory
+        self.token = token or CancelToken()
+        self.future: Future = Future()
+        self.submitted = time.perf_counter()
+        self.started = False
+        self.preempted = False
+
+    def Cancel(self) -> None:
+        """Drop the job if it is still queued, otherwise stop it at its next checkpoint."""
+        self.scheduler.Cancel(self)
+
+
+class ClassMetrics:
+    """Queue and outcome counters for one priority class."""
+
+    def __init__(self) -> None:
+        self.running = 0
+        self.maxDepth = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.preempted = 0
+        self.waited = 0.0
+
+
+class Scheduler:
+    """Priority queues drained by a fixed set of worker threads."""
+
+    def __init__(self, cpu: int = CPU_BUDGET, memory: int = MEMORY_BUDGET) -> None:
+        self.cpu = max(1, cpu)
+        self.memory = memory
+        self.queues: list[deque[ScheduledJob]] = [deque() for _ in CLASS_NAMES]
+        self.metrics = [ClassMetrics() for _ in CLASS_NAMES]
+        self.running: list[ScheduledJob] = []
+        self.memoryInUse = 0
+        # slots lent to threads of running jobs through `Helpers`
+        self.helpers = 0
+        self.condition = threading.Condition()
+        self.workers: list[threading.Thread] = []
+
+    def Submit(
+        self,
+        priority: int,
+        fn: Callable[[], Any],
+        name: str = "",
+        memory: int = 0,
+        token: CancelToken | None = None,
+    ) -> ScheduledJob:
+        """Queue `fn` in `priority` and return its handle.
+
+        `memory` is the peak bytes the job is expected to hold. `token` lets
+        the caller cancel it and see its progress; speculative jobs must not
+        pass one, since they are preempted through their token.
+        """
+        if priority in SPECULATIVE and token is not None:
+            raise ValueError("Speculative jobs are preempted through their own token")
+        name = name or getattr(fn, "__name__", "job")
+        job = ScheduledJob(self, priority, fn, name, memory, token)
+        with self.condition:
+            self.queues[priority].append(job)
+            metrics = self.metrics[priority]
+            metrics.submitted += 1
+            metrics.maxDepth = max(metrics.maxDepth, len(self.queues[priority]))
+            if len(self.running) + self.helpers >= self.cpu:
+                self.Preempt(priority)
+            self.StartWorkers()
+            self.condition.notify_all()
+        return job
+
+    def StartWorkers(self) -> None:
+        while len(self.workers) < self.cpu + INTERACTIVE_RESERVE:
+            worker = threading.Thread(
+                target=self.Work,
+                name=f"scheduler-{len(self.workers)}",
+                daemon=True,
+            )
+            self.workers.append(worker)
+            worker.start()
+
+    def Preempt(self, priority: int) -> None:
+        """Ask the least urgent, most recently started speculative job below `priority` to yield."""
+        if any(x.preempted for x in self.running):
+            return
+        candidates = [
+            x for x in self.running if x.priority in SPECULATIVE and x.priority > priority
+        ]
+        if not candidates:
+            return
+        job = max(candidates, key=lambda x: (x.priority, self.running.index(x)))
+        job.preempted = True
+        job.token.Cancel()
+
+    def Admits(self, job: ScheduledJob) -> bool:
+        slots = self.cpu + (INTERACTIVE_RESERVE if job.priority == INTERACTIVE else 0)
+        if len(self.running) + self.helpers >= slots:
+            return False
+        # a job larger than the whole budget still runs once nothing else holds memory
+        return (
+            job.priority == INTERACTIVE
+            or self.memoryInUse == 0
+            or self.memoryInUse + job.memory <= self.memory
+        )
+
+    def Next(self) -> ScheduledJob | None:
+        """Take the most urgent job that may start now; lower classes never overtake it."""
+        for priority, queue in enumerate(self.queues):
+            if not queue:
+                continue
+            job = queue[-1] if priority in SPECULATIVE else queue[0]
+            if not self.Admits(job):
+                return None
+            if priority in SPECULATIVE:
+                queue.pop()
+            else:
+                queue.popleft()
+            return job
+        return None
+
+    def Work(self) -> None:
+        while True:
+            with self.condition:
+                job = self.Next()
+                while job is None:
+                    self.condition.wait()
+                    job = self.Next()
+                self.running.append(job)
+                self.memoryInUse += job.memory
+                metrics = self.metrics[job.priority]
+                metrics.running += 1
+                if not job.started:
+                    job.started = True
+                    # futures are only cancelled through `Cancel`, which dequeues them first
+                    job.future.set_running_or_notify_cancel()
+                    metrics.waited += time.perf_counter() - job.submitted
+                    if PROFILING:
+                        Record(f"wait {job.name}", job.submitted, time.perf_counter(), 0)
+            self.Run(job)
+
+    def Run(self, job: ScheduledJob) -> None:
+        Adopt(job.token)
+        requeue = False
+        try:
+            result = job.fn()
+        except Cancelled:
+            with self.condition:
+                requeue = job.preempted
+            if not requeue:
+                job.future.set_exception(Cancelled())
+        except Exception as e:
+            logging.exception("Scheduled job %s failed", job.name)
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
+        finally:
+            Adopt(None)
+        with self.condition:
+            self.running.remove(job)
+            self.memoryInUse -= job.memory
+            metrics = self.metrics[job.priority]
+            metrics.running -= 1
+            if requeue:
+                # it was started first, so it runs again before newer requests
+                metrics.preempted += 1
+                job.preempted = False
+                job.token = CancelToken()
+                if job.priority in SPECULATIVE:
+                    self.queues[job.priority].append(job)
+                else:
+                    self.queues[job.priority].appendleft(job)
+                metrics.maxDepth = max(metrics.maxDepth, len(self.queues[job.priority]))
+            elif job.future.exception() is None:
+                metrics.completed += 1
+            elif isinstance(job.future.exception(), Cancelled):
+                metrics.cancelled += 1
+            else:
+                metrics.failed += 1
+            self.condition.notify_all()
+
+    def Cancel(self, job: ScheduledJob) -> None:
+        with self.condition:
+            queue = self.queues[job.priority]
+            if job in queue:
+                queue.remove(job)
+                if job.started:
+                    # a preempted job's future is already running and can no longer be cancelled
+                    job.future.set_exception(Cancelled())
+                else:
+                    job.future.cancel()
+                self.metrics[job.priority].cancelled += 1
+                return
+            # a preempted job is no longer requeued once cancelled
+            job.preempted = False
+            job.token.Cancel()
+
+    @contextlib.contextmanager
+    def Helpers(self, wanted: int) -> Iterator[int]:
+        """Lend up to `wanted` free slots to extra threads, and yield how many were granted.
+
+        The slots count as running until the block exits. The interactive
+        reserve is never lent, so a job may be granted none.
+        """
+        with self.condition:
+            granted = max(0, min(wanted, self.cpu - len(self.running) - self.helpers))
+            self.helpers += granted
+        try:
+            yield granted
+        finally:
+            with self.condition:
+                self.helpers -= granted
+                self.condition.notify_all()
+
+    def Metrics(self) -> dict[str, dict[str, float]]:
+        """Return the queue depth, running count and counters of every class."""
+        with self.condition:
+            return {
+                name: {
+                    "queued": len(self.queues[idx]),
+                    **vars(self.metrics[idx]),
+                }
+                for idx, name in enumerate(CLASS_NAMES)
+            }
+
+    def Summary(self) -> str:
+        """Return "<class> <queued>/<running>" for every busy class, for the status bar."""
+        return "  ".join(
+            f"{name} {stats['queued']}/{stats['running']}"
+            for name, stats in self.Metrics().items()
+            if stats["queued"] or stats["running"]
+        )
+
+
+def GetScheduler() -> Scheduler:
+    """Return the shared scheduler, creating it on first use."""
+    global SCHEDULER
+    if SCHEDULER is None:
+        SCHEDULER = Scheduler()
+    return SCHEDULER
+
+
+def Submit(
+    priority: int,
+    fn: Callable[[], Any],
+    name: str = "",
+    memory: int = 0,
+    token: CancelToken | None = None,
+) -> ScheduledJob:
+    """Queue `fn` on the shared scheduler, see `Scheduler.Submit`."""
+    return GetScheduler().Submit(priority, fn, name, memory, token)
+
+
+def Helpers(wanted: int) -> contextlib.AbstractContextManager[int]:
+    """Lend free slots of the shared scheduler, see `Scheduler.Helpers`."""
+    return GetScheduler().Helpers(wanted)
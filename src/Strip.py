@@ -0,0 +1,173 @@
+"""Streaming split of very tall vertical strips (webtoons).
+
+A strip is read top to bottom in windows of rows through `RegionReader`, so
+neither the strip nor its detection arrays are ever held whole. `CutPoints`
+finds panels from the rows as they arrive and each panel is written as soon
+as the gutter below it is found.
+
+Run ``python -m src.Strip strip.png`` to split from the command line.
+"""
+
+import argparse
+import logging
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from PIL import Image
+
+from .Export import RegionReader
+from .Profiling import Span, Timed
+from .Scheduler import Checkpoint
+from .Utility import RecordFileAdded
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# rows decoded and scanned at a time
+STRIP_WINDOW = 2048
+# solid rows needed between two panels; shorter runs are flat art inside a panel
+MIN_GUTTER = 16
+# panels without a gutter for this many rows are cut at their quietest row
+MAX_PANEL_ROWS = 16384
+# images at least this tall and this many times taller than wide count as strips
+STRIP_MIN_HEIGHT = 8192
+STRIP_RATIO = 4
+
+
+def IsStrip(path: Path) -> bool:
+    """Return True if the image at `path` is a tall vertical strip, reading only its header."""
+    try:
+        with Image.open(path) as im:
+            width, height = im.size
+    except OSError:
+        return False
+    return height >= STRIP_MIN_HEIGHT and height >= STRIP_RATIO * width
+
+
+def RowNoise(band: Image.Image) -> "np.ndarray":
+    """Return how many samples of each row differ from its left pixel by more than TOLERANCE."""
+    import numpy as np
+
+    from .LineCalcs import TOLERANCE
+
+    arr = np.asarray(band.convert("RGB"))
+    ref = arr[:, 0:1, :]
+    # max - min is the absolute difference without leaving uint8
+    far = (np.maximum(arr, ref) - np.minimum(arr, ref)) > TOLERANCE
+    return far.reshape(len(far), -1).sum(axis=1)
+
+
+def CutPoints(rows: Iterable[tuple[int, "np.ndarray"]]) -> Iterator[tuple[int, int]]:
+    """Yield the (top, bottom) rows of each panel as soon as its end is known.
+
+    `rows` yields consecutive (top, noise) pairs, noise being the `RowNoise` of
+    the rows from top on. A panel ends at a run of at least `MIN_GUTTER` solid
+    rows; content shorter than that is dust and dropped. Panels longer than
+    `MAX_PANEL_ROWS` are cut at the quietest row of the current window.
+    """
+    import numpy as np
+
+    start: int | None = None
+    end = 0
+    gutter = 0
+    for top, noise in rows:
+        solid = noise == 0
+        # [first, last) runs of equal solidity within the window
+        edges = np.flatnonzero(np.diff(solid)) + 1
+        for first, last in zip([0, *edges.tolist()], [*edges.tolist(), len(solid)], strict=True):
+            if not solid[first]:
+                start = top + first if start is None else start
+                end = top + last
+                gutter = 0
+                continue
+            gutter += last - first
+            if start is not None and gutter >= MIN_GUTTER:
+                if end - start >= MIN_GUTTER:
+                    yield start, end
+                start = None
+        if start is not None and top + len(noise) - start > MAX_PANEL_ROWS:
+            cut = top + int(np.argmin(noise))
+            if cut > start:
+                yield start, cut
+                start = cut
+    if start is not None:
+        yield start, end
+
+
+@Timed("SplitStrip")
+def SplitStrip(
+    path: Path,
+    dst: Path | None = None,
+    window: int = STRIP_WINDOW,
+) -> Iterator[Path]:
+    """Write every panel of the strip at `path` into `dst` and yield each file when written.
+
+    Panels are saved as "<stem> 001.png", ... like box mode, by default into a
+    subfolder named after the strip. Only the rows of the panel being
+    assembled and the current window are kept in memory.
+    """
+    dst = dst or path.parent / path.stem
+    if not dst.exists():
+        dst.mkdir()
+        RecordFileAdded(dst)
+    with RegionReader(path) as reader:
+        # windows still needed by the open panel, oldest first
+        kept: list[tuple[int, Image.Image]] = []
+
+        def Scan() -> Iterator[tuple[int, "np.ndarray"]]:
+            blank = False
+            for top, band in reader.Bands(window):
+                Checkpoint(top, reader.size[1])
+                if blank:
+                    # the blank window before this one closed any open panel
+                    kept.clear()
+                with Span("RowNoise"):
+                    noise = RowNoise(band)
+                blank = not noise.any()
+                kept.append((top, band))
+                yield top, noise
+
+        for idx, (top, bottom) in enumerate(CutPoints(Scan()), start=1):
+            panel = Image.new(kept[0][1].mode, (reader.size[0], bottom - top))
+            if panel.mode == "P":
+                panel.putpalette(kept[0][1].getpalette() or [])
+            for bandTop, band in kept:
+                if bandTop < bottom and bandTop + band.height > top:
+                    panel.paste(
+                        band.crop(
+                            (
+                                0,
+                                max(top - bandTop, 0),
+                                band.width,
+                                min(bottom - bandTop, band.height),
+                            ),
+                        ),
+                        (0, max(bandTop - top, 0)),
+                    )
+            kept[:] = [(t, b) for t, b in kept if t + b.height > bottom]
+            output = dst / f"{path.stem} {idx:03d}.png"
+            try:
+                with Span("encode"):
+                    panel.save(output)
+            except OSError:
+                logging.exception("Failed to write %s", output)
+                continue
+            RecordFileAdded(output)
+            yield output
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Split a tall vertical strip into panels.")
+    parser.add_argument("strip", type=Path)
+    parser.add_argument("--out", type=Path, help="output folder, default <strip stem>/")
+    parser.add_argument("--window", type=int, default=STRIP_WINDOW, help="rows decoded at once")
+    args = parser.parse_args()
+    Image.MAX_IMAGE_PIXELS = None
+    for output in SplitStrip(args.strip, args.out, args.window):
+        print(output, flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
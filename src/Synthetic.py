@@ -0,0 +1,282 @@
+"""Synthetic comic pages with known panels, and a scorer for auto-splits.
+
+``uv run python -m src.Synthetic out/ --count 20`` writes pages next to a
+``.json`` of their true panel rectangles and prints how well `SliceImage`
+recovers them. With ``--engine`` another auto-draw engine is scored, along
+with its agreement with the full-resolution grid. ``--rescore`` scores the
+pages already in the folder against their ``.json`` instead of writing new
+ones. ``--templates`` checks that pages of different grids get layout
+signatures that do not match each other.
+"""
+
+import argparse
+import io
+import json
+import random
+import sys
+from collections.abc import Iterator
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+from .AutoDraw import Detect, SliceImage
+from .Components import AUTODRAW_ENGINES, Polygon
+from .Templates import LayoutSignature, SignatureDistance
+
+Rect = tuple[int, int, int, int]
+Color = tuple[int, int, int]
+
+IOU_THRESHOLD = 0.5
+# (cols, rows) of the pages `TemplateCollisions` compares
+TEMPLATE_GRIDS = [(1, 1), (2, 2), (2, 3), (2, 4), (3, 3), (3, 4)]
+
+
+# region Generation
+def SplitPanel(rect: Rect, gutter: int, rng: random.Random) -> list[Rect]:
+    """Split `rect` in two along its longer side, leaving a `gutter` gap."""
+    left, top, right, bottom = rect
+    before, after = gutter // 2, gutter - gutter // 2
+    if right - left >= bottom - top:
+        cut = rng.randint(left + (right - left) // 3, right - (right - left) // 3)
+        return [(left, top, cut - before, bottom), (cut + after, top, right, bottom)]
+    cut = rng.randint(top + (bottom - top) // 3, bottom - (bottom - top) // 3)
+    return [(left, top, right, cut - before), (left, cut + after, right, bottom)]
+
+
+def PanelRects(
+    width: int,
+    height: int,
+    cols: int,
+    rows: int,
+    gutter: int,
+    nested: float,
+    rng: random.Random,
+) -> list[Rect]:
+    """Lay out a cols x rows grid inside a `gutter` margin, row by row."""
+    panelW = (width - gutter * (cols + 1)) / cols
+    panelH = (height - gutter * (rows + 1)) / rows
+    rects: list[Rect] = []
+    for row in range(rows):
+        for col in range(cols):
+            left = round(gutter + col * (panelW + gutter))
+            top = round(gutter + row * (panelH + gutter))
+            rect = (left, top, round(left + panelW), round(top + panelH))
+            if rng.random() < nested:
+                rects.extend(SplitPanel(rect, max(gutter // 2, 2), rng))
+            else:
+                rects.append(rect)
+    return rects
+
+
+def DrawContent(draw: ImageDraw.ImageDraw, rect: Rect, rng: random.Random) -> None:
+    """Scribble lines and ellipses inside `rect` so panels are not uniform."""
+    left, top, right, bottom = rect
+    inset = max(min(right - left, bottom - top) // 10, 2)
+    for _ in range(6):
+        x0, x1 = sorted(rng.randint(left + inset, right - inset) for _ in range(2))
+        y0, y1 = sorted(rng.randint(top + inset, bottom - inset) for _ in range(2))
+        shade = (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255))
+        if rng.random() < 0.5:
+            draw.ellipse((x0, y0, x1, y1), outline=shade, width=3)
+        else:
+            draw.line((x0, y0, x1, y1), fill=shade, width=3)
+
+
+def GeneratePage(
+    width: int = 1200,
+    height: int = 1700,
+    cols: int = 3,
+    rows: int = 4,
+    gutter: int = 30,
+    gutterColor: Color = (255, 255, 255),
+    panelColor: Color = (200, 200, 200),
+    border: int = 2,
+    nested: float = 0.0,
+    jpegQuality: int | None = None,
+    seed: int = 0,
+) -> tuple[Image.Image, list[Rect]]:
+    """Return a synthetic page and its true panel rectangles (left, top, right, bottom).
+
+    `border` is the width of each panel's black outline, `nested` the chance a
+    panel is split into two sub-panels, and `jpegQuality` round-trips the page
+    through JPEG to add compression noise to the gutters.
+    """
+    rng = random.Random(seed)
+    im = Image.new("RGB", (width, height), gutterColor)
+    draw = ImageDraw.Draw(im)
+    rects = PanelRects(width, height, cols, rows, gutter, nested, rng)
+    for rect in rects:
+        draw.rectangle(
+            (rect[0], rect[1], rect[2] - 1, rect[3] - 1),
+            fill=panelColor,
+            outline=(0, 0, 0) if border else None,
+            width=border,
+        )
+        DrawContent(draw, rect, rng)
+
+    if jpegQuality is not None:
+        buffer = io.BytesIO()
+        im.save(buffer, "JPEG", quality=jpegQuality)
+        im = Image.open(buffer)
+        im.load()
+    return im, rects
+
+
+def WriteTruth(path: Path, size: tuple[int, int], rects: list[Rect]) -> None:
+    path.write_text(json.dumps({"size": list(size), "panels": [list(r) for r in rects]}))
+
+
+def ReadTruth(path: Path) -> list[Rect]:
+    return [tuple(r) for r in json.loads(path.read_text())["panels"]]
+
+
+def GeneratedPages(
+    out: Path,
+    count: int,
+    seed: int,
+    nested: float,
+    jpegQuality: int | None,
+) -> Iterator[tuple[Path, Image.Image, list[Rect]]]:
+    """Write `count` random pages and their truth into `out`, yielding each with its panels."""
+    rng = random.Random(seed)
+    for idx in range(count):
+        im, rects = GeneratePage(
+            width=rng.choice([800, 1200, 2400]),
+            height=rng.choice([1100, 1700, 3400, 12000]),
+            cols=rng.randint(1, 4),
+            rows=rng.randint(1, 5),
+            gutter=rng.randint(20, 60),
+            nested=nested,
+            jpegQuality=jpegQuality,
+            seed=rng.getrandbits(32),
+        )
+        page = out / f"page{idx:04d}.png"
+        im.save(page)
+        WriteTruth(page.with_suffix(".json"), im.size, rects)
+        yield page, im, rects
+
+
+def ExistingPages(folder: Path) -> Iterator[tuple[Path, Image.Image, list[Rect]]]:
+    """Yield the pages in `folder` that have a truth file, with their panels."""
+    for truth in sorted(folder.glob("*.json")):
+        page = truth.with_suffix(".png")
+        if not page.is_file():
+            continue
+        with Image.open(page) as im:
+            im.load()
+            yield page, im, ReadTruth(truth)
+
+
+# endregion
+# region Scoring
+def IoU(a: Rect, b: Rect) -> float:
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    inter = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union
+
+
+def PolygonRects(polygons: list[Polygon]) -> list[Rect]:
+    return [p.bounding_points for p in polygons if p.bounding_points is not None]  # pyright: ignore[reportReturnType]
+
+
+def Score(predicted: list[Rect], truth: list[Rect], threshold: float = IOU_THRESHOLD) -> dict:
+    """Greedily match predictions to truth by IoU and report precision and recall."""
+    pairs = sorted(
+        ((IoU(p, t), pi, ti) for pi, p in enumerate(predicted) for ti, t in enumerate(truth)),
+        reverse=True,
+    )
+    usedP: set[int] = set()
+    usedT: set[int] = set()
+    ious: list[float] = []
+    for iou, pi, ti in pairs:
+        if iou < threshold:
+            break
+        if pi in usedP or ti in usedT:
+            continue
+        usedP.add(pi)
+        usedT.add(ti)
+        ious.append(iou)
+    return {
+        "precision": len(ious) / len(predicted) if predicted else 0.0,
+        "recall": len(ious) / len(truth) if truth else 0.0,
+        "meanIoU": sum(ious) / len(ious) if ious else 0.0,
+    }
+
+
+def TemplateCollisions(seeds: int = 3) -> list[str]:
+    """Return the grid pairs whose signatures match although their layouts differ.
+
+    Pages of the same grid, drawn with different content and JPEG noise,
+    must match each other; a failure to do so is reported too.
+    """
+    signatures = {
+        (grid, seed): LayoutSignature(
+            GeneratePage(1200, 1700, *grid, jpegQuality=70 if seed else None, seed=seed)[0],
+        )
+        for grid in TEMPLATE_GRIDS
+        for seed in range(seeds)
+    }
+    problems = []
+    for (gridA, seedA), a in signatures.items():
+        for (gridB, seedB), b in signatures.items():
+            if (gridA, seedA) >= (gridB, seedB):
+                continue
+            matched = SignatureDistance(a, b) is not None
+            if matched != (gridA == gridB):
+                verb = "matches" if matched else "does not match"
+                problems.append(f"{gridA} seed {seedA} {verb} {gridB} seed {seedB}")
+    return problems
+
+
+# endregion
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("out", type=Path, nargs="?")
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--nested", type=float, default=0.2)
+    parser.add_argument("--jpeg", type=int, default=None, help="JPEG quality for noisy pages")
+    parser.add_argument("--engine", choices=AUTODRAW_ENGINES, default=AUTODRAW_ENGINES[0])
+    parser.add_argument("--rescore", action="store_true", help="score the pages already in out")
+    parser.add_argument("--templates", action="store_true", help="check layout signatures")
+    args = parser.parse_args()
+    if args.templates:
+        problems = TemplateCollisions()
+        for problem in problems:
+            print(problem)
+        print(f"{len(problems)} signature problems across {len(TEMPLATE_GRIDS)} grids")
+        return 1 if problems else 0
+    if args.out is None:
+        parser.error("an output folder is required unless --templates is given")
+    compare = args.engine != AUTODRAW_ENGINES[0]
+
+    if args.rescore:
+        pages = ExistingPages(args.out)
+    else:
+        args.out.mkdir(parents=True, exist_ok=True)
+        pages = GeneratedPages(args.out, args.count, args.seed, args.nested, args.jpeg)
+    scores = []
+    for page, im, rects in pages:
+        predicted = PolygonRects(Detect(im, False, args.engine))
+        score = Score(predicted, rects)
+        if compare:
+            # how often the engine reproduces the full-resolution grid's panels
+            score["agreement"] = Score(predicted, PolygonRects(SliceImage(im)))["meanIoU"]
+        scores.append(score)
+        print(f"{page.name}: " + " ".join(f"{k}={v:.2f}" for k, v in score.items()))
+    if not scores:
+        print(f"no pages with a truth file in {args.out}")
+        return 1
+    totals = {key: sum(score[key] for score in scores) / len(scores) for key in scores[0]}
+    print("mean: " + " ".join(f"{k}={v:.3f}" for k, v in totals.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""Background execution of slow operations with progress and cancellation.
+
+`TaskRunner.Run` calls a function on the scheduler and hands its result
+back to the GUI thread, unless the image it was computed for is no longer
+the open one. Long loops call `Checkpoint`, which reports progress and raises
+`Cancelled` once the task was cancelled, so work stops at the next safe point.
+Batch loops that drive the widgets themselves run through `TaskRunner.Step`
+on the GUI thread instead, one item per event loop turn.
+"""
+
+import logging
+from collections.abc import Callable, Iterator
+from typing import Any
+
+from PyQt6.QtCore import QObject, QThread, QTimer, pyqtSignal
+
+from .Scheduler import INTERACTIVE, Cancelled, CancelToken, ScheduledJob, Submit
+
+# (work, apply): work may run on any thread, apply runs on the GUI thread with its result
+type Job = tuple[Callable[[], Any], Callable[[Any], None]]
+
+
+def RunNow(job: Job | None) -> None:
+    """Run both halves of `job` on this thread."""
+    if job is not None:
+        work, apply = job
+        apply(work())
+
+
+class GuiBridge(QObject):
+    """Runs callables posted from any thread on the GUI thread."""
+
+    posted = pyqtSignal(object)
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.posted.connect(self.Call)
+
+    def Call(self, fn: Callable[[], Any]) -> None:
+        fn()
+
+
+# created on import, which happens on the GUI thread
+BRIDGE = GuiBridge()
+
+
+def OnGuiThread() -> bool:
+    return QThread.currentThread() == BRIDGE.thread()
+
+
+def GuiCall(fn: Callable[[], Any]) -> None:
+    """Call `fn` on the GUI thread: now if already there, else when the event loop gets to it."""
+    if OnGuiThread():
+        fn()
+    else:
+        BRIDGE.posted.emit(fn)
+
+
+class TaskSignals(QObject):
+    """Carries a task's progress and outcome back to the GUI thread."""
+
+    progress = pyqtSignal(int, int, int)
+    done = pyqtSignal(int, object)
+    failed = pyqtSignal(int)
+
+
+class TaskRunner(QObject):
+    """Runs one operation at a time off the GUI thread.
+
+    Starting an operation cancels the one in flight. A result is applied only
+    if `key()` still matches its value when the operation started, so
+    navigating away discards it; `Revalidate` cancels such work early.
+    """
+
+    started = pyqtSignal(str)
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal()
+
+    def __init__(self, key: Callable[[], object], parent: QObject | None = None) -> None:
+        super().__init__(parent)
+        self.key = key
+        self.generation = 0
+        self.token: CancelToken | None = None
+        self.job: ScheduledJob | None = None
+        self.startKey: object = None
+        self.apply: Callable[[Any], None] | None = None
+        self.steps: Iterator[tuple[int, int]] | None = None
+        self.signals = TaskSignals(self)
+        self.signals.progress.connect(self.OnProgress)
+        self.signals.done.connect(self.OnDone)
+        self.signals.failed.connect(self.OnFailed)
+
+    @property
+    def busy(self) -> bool:
+        return self.token is not None
+
+    def Run(
+        self,
+        name: str,
+        work: Callable[[], Any],
+        apply: Callable[[Any], None],
+        priority: int = INTERACTIVE,
+        memory: int = 0,
+    ) -> None:
+        """Call `work` on the scheduler, then `apply` its result on the GUI thread."""
+        token = self.Start(name)
+        self.apply = apply
+        generation = self.generation
+        signals = self.signals
+
+        def Work() -> None:
+            try:
+                result = work()
+            except Cancelled:
+                signals.failed.emit(generation)
+            except Exception:
+                logging.exception("Background task failed")
+                signals.failed.emit(generation)
+            else:
+                signals.done.emit(generation, result)
+
+        self.job = Submit(priority, Work, name, memory, token)
+
+    def Step(self, name: str, steps: Iterator[tuple[int, int]]) -> None:
+        """Advance `steps` on the GUI thread, one item per event loop turn.
+
+        `steps` yields (done, total) after each item; the window stays
+        responsive in between and Cancel stops it before the next item.
+        """
+        self.Start(name)
+        self.steps = steps
+        QTimer.singleShot(0, lambda generation=self.generation: self.NextStep(generation))
+
+    def Start(self, name: str) -> CancelToken:
+        self.Cancel()
+        self.generation += 1
+        generation = self.generation
+        self.token = CancelToken(
+            lambda done, total: self.signals.progress.emit(generation, done, total),
+        )
+        self.startKey = self.key()
+        self.started.emit(name)
+        return self.token
+
+    def NextStep(self, generation: int) -> None:
+        if generation != self.generation or self.steps is None or self.token is None:
+            return
+        if self.token.cancelled:
+            self.Finish()
+            return
+        try:
+            done, total = next(self.steps)
+        except StopIteration:
+            self.Finish()
+            return
+        except Exception:
+            logging.exception("Batch step failed")
+            self.Finish()
+            return
+        self.progress.emit(done, total)
+        QTimer.singleShot(0, lambda: self.NextStep(generation))
+
+    def Cancel(self) -> None:
+        """Cancel the running operation; its result, if any arrives, is dropped."""
+        if self.token is None:
+            return
+        self.token.Cancel()
+        if self.job is not None:
+            # still queued behind other work, so it never starts
+            self.job.Cancel()
+        if self.steps is not None:
+            self.steps.close()
+        self.Finish()
+
+    def Revalidate(self) -> None:
+        """Cancel the running operation if the image it works on is no longer open.
+
+        Batches from `Step` open images themselves and are left running.
+        """
+        if self.token is not None and self.steps is None and self.key() != self.startKey:
+            self.Cancel()
+
+    def Finish(self) -> None:
+        self.token = None
+        self.job = None
+        self.apply = None
+        self.steps = None
+        self.finished.emit()
+
+    def OnProgress(self, generation: int, done: int, total: int) -> None:
+        if generation == self.generation and self.token is not None:
+            self.progress.emit(done, total)
+
+    def OnDone(self, generation: int, result: object) -> None:
+        if generation != self.generation or self.apply is None:
+            return
+        apply = self.apply
+        stale = self.key() != self.startKey
+        self.Finish()
+        if stale:
+            logging.info("Dropping a result computed for another image")
+            return
+        apply(result)
+
+    def OnFailed(self, generation: int) -> None:
+        if generation == self.generation:
+            self.Finish()
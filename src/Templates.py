@@ -0,0 +1,276 @@
+"""Library of known page layouts matched by a cheap gutter signature."""
+
+import json
+import logging
+import sqlite3
+import threading
+
+import numpy as np
+from PIL import Image
+
+from .Components import Polygon
+from .LineCalcs import TOLERANCE
+from .Utility import AppDataDir
+
+TEMPLATE_DB = "templates.db"
+# guards `LIBRARY`, which auto-draw jobs and the autopilot use from worker threads
+LOCK = threading.RLock()
+# bumped when the signature format changes; older templates are dropped
+SIGNATURE_VERSION = 2
+PROXY_SIZE = 256
+# relative aspect ratio difference still considered the same page shape
+ASPECT_TOLERANCE = 0.05
+# distance, as a fraction of the page, under which two gutters are the same
+POSITION_TOLERANCE = 0.02
+# deepest nesting of gutters the signature follows
+MAX_DEPTH = 4
+# values per gutter in a signature: axis, position, start, end
+CUT_FIELDS = 4
+
+
+class Template:
+    """Normalized layout of a previously split page."""
+
+    def __init__(
+        self,
+        key: int,
+        mode: str,
+        aspect: float,
+        signature: np.ndarray,
+        polygons: list[dict],
+    ) -> None:
+        self.key = key
+        self.mode = mode
+        self.aspect = aspect
+        self.signature = signature
+        self.polygons = polygons
+
+    def Apply(self, width: int, height: int) -> list[Polygon]:
+        """Scale the normalized polygons onto an image of the given size."""
+        return [
+            Polygon.FromDict(
+                {
+                    "points": [(round(x * width), round(y * height)) for x, y in p["points"]],
+                    "color": p["color"],
+                },
+            )
+            for p in self.polygons
+        ]
+
+
+class TemplateLibrary:
+    """SQLite-backed set of templates, held in memory for matching."""
+
+    def __init__(self) -> None:
+        self.db = self.Connect()
+        self.templates: list[Template] = [
+            Template(key, mode, aspect, np.frombuffer(sig, dtype=np.float32), json.loads(data))
+            for key, mode, aspect, sig, data in self.db.execute(
+                "SELECT id, mode, aspect, signature, data FROM templates",
+            )
+        ]
+
+    @staticmethod
+    def Connect() -> sqlite3.Connection:
+        # the library may be opened by a background auto-draw and written from the GUI thread
+        try:
+            conn = sqlite3.connect(AppDataDir() / TEMPLATE_DB, check_same_thread=False)
+        except (OSError, sqlite3.Error):
+            logging.exception("Falling back to in-memory template library")
+            conn = sqlite3.connect(":memory:", check_same_thread=False)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS templates ("
+            "id INTEGER PRIMARY KEY, mode TEXT NOT NULL, aspect REAL NOT NULL, "
+            "signature BLOB NOT NULL, data TEXT NOT NULL)",
+        )
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SIGNATURE_VERSION:
+            # signatures of another format cannot be compared
+            conn.execute("DELETE FROM templates")
+            conn.execute(f"PRAGMA user_version = {SIGNATURE_VERSION}")
+        conn.commit()
+        return conn
+
+    def Nearest(self, mode: str, aspect: float, signature: np.ndarray) -> Template | None:
+        """Return the closest template with the same layout, if any."""
+        with LOCK:
+            matches = [
+                (distance, t)
+                for t in self.templates
+                if t.mode == mode and abs(t.aspect - aspect) <= aspect * ASPECT_TOLERANCE
+                if (distance := SignatureDistance(t.signature, signature)) is not None
+            ]
+        return min(matches, key=lambda x: x[0])[1] if matches else None
+
+    def Remember(
+        self,
+        mode: str,
+        aspect: float,
+        signature: np.ndarray,
+        polygons: list[dict],
+    ) -> None:
+        """Store a layout, replacing the template it already matches."""
+        data = json.dumps(polygons)
+        with LOCK, self.db:
+            existing = self.Nearest(mode, aspect, signature)
+            if existing is not None:
+                self.db.execute("UPDATE templates SET data = ? WHERE id = ?", (data, existing.key))
+                existing.polygons = polygons
+            else:
+                cursor = self.db.execute(
+                    "INSERT INTO templates (mode, aspect, signature, data) VALUES (?, ?, ?, ?)",
+                    (mode, aspect, signature.astype(np.float32).tobytes(), data),
+                )
+                self.templates.append(
+                    Template(cursor.lastrowid or 0, mode, aspect, signature, polygons),
+                )
+
+
+LIBRARY: TemplateLibrary | None = None
+
+
+def GetLibrary() -> TemplateLibrary:
+    global LIBRARY
+    with LOCK:
+        if LIBRARY is None:
+            LIBRARY = TemplateLibrary()
+        return LIBRARY
+
+
+def Runs(mask: np.ndarray) -> list[tuple[int, int]]:
+    """Return the [start, end) runs of True in `mask`."""
+    padded = np.concatenate([[False], mask, [False]])
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist(), strict=True))
+
+
+def Background(region: np.ndarray, axis: int, shade: int) -> np.ndarray:
+    """Return which lines of `region` along `axis` are all the page's background `shade`."""
+    return (np.abs(region - shade) <= TOLERANCE).all(axis=1 - axis)
+
+
+def XYCut(
+    arr: np.ndarray,
+    box: tuple[int, int, int, int],
+    shade: int,
+    depth: int,
+    cuts: list[tuple[int, float, float, float]],
+) -> int:
+    """Record the gutters inside `box` of `arr` in `cuts` and return its panel count.
+
+    Gutters are full-width rows or full-height columns of the background
+    `shade` between content; the region is cut along them, rows first, and
+    each piece is cut again. Background margins at the edges are not gutters.
+    """
+    left, top, right, bottom = box
+    region = arr[top:bottom, left:right]
+    if not region.size:
+        return 0
+    rows = np.flatnonzero(~Background(region, 0, shade))
+    cols = np.flatnonzero(~Background(region, 1, shade))
+    if not len(rows) or not len(cols):
+        return 0
+    # the content bounds, without margins
+    left, right = left + int(cols[0]), left + int(cols[-1]) + 1
+    top, bottom = top + int(rows[0]), top + int(rows[-1]) + 1
+    if depth == MAX_DEPTH:
+        return 1
+    height, width = arr.shape
+    for axis in (0, 1):
+        gutters = Runs(Background(arr[top:bottom, left:right], axis, shade))
+        if not gutters:
+            continue
+        origin, size = (top, height) if axis == 0 else (left, width)
+        start, end, span = (left, right, width) if axis == 0 else (top, bottom, height)
+        for first, last in gutters:
+            center = (origin + (first + last) / 2) / size
+            cuts.append((axis, center, start / span, end / span))
+        bounds = [origin + x for gutter in gutters for x in gutter]
+        pieces = [origin, *bounds, (bottom if axis == 0 else right)]
+        count = 0
+        for lo, hi in zip(pieces[::2], pieces[1::2], strict=True):
+            piece = (left, lo, right, hi) if axis == 0 else (lo, top, hi, bottom)
+            count += XYCut(arr, piece, shade, depth + 1, cuts)
+        return count
+    return 1
+
+
+def LayoutSignature(img: Image.Image) -> np.ndarray:
+    """Return the panel count and the gutters of a small grayscale proxy.
+
+    The signature is [panels, axis, position, start, end, ...] with one
+    group of `CUT_FIELDS` per gutter, positions as fractions of the page.
+    The background shade is the most common one around the page edge.
+    """
+    # shrunk by whole factors first, so nothing is converted at full resolution
+    factor = max(1, max(img.size) // PROXY_SIZE)
+    try:
+        proxy = img.reduce(factor) if factor > 1 else img
+    except ValueError:
+        # bilevel, palette and 16-bit pages, which reduce does not take
+        proxy = img
+    proxy = proxy.convert("L")
+    proxy.thumbnail((PROXY_SIZE, PROXY_SIZE))
+    arr = np.asarray(proxy, dtype=np.int16)
+    edge = np.concatenate([arr[0], arr[-1], arr[:, 0], arr[:, -1]])
+    shade = int(np.bincount(edge).argmax())
+    cuts: list[tuple[int, float, float, float]] = []
+    panels = XYCut(arr, (0, 0, arr.shape[1], arr.shape[0]), shade, 0, cuts)
+    return np.array([panels, *(x for cut in cuts for x in cut)], dtype=np.float32)
+
+
+def SignatureDistance(a: np.ndarray, b: np.ndarray) -> float | None:
+    """Return how far apart the gutters of two signatures are, or None if the layouts differ.
+
+    Layouts are the same when they have as many panels and gutters and every
+    gutter of one lies within `POSITION_TOLERANCE` of its own gutter in the other.
+    """
+    if len(a) != len(b) or a[0] != b[0]:
+        return None
+    cutsA = a[1:].reshape(-1, CUT_FIELDS)
+    cutsB = list(b[1:].reshape(-1, CUT_FIELDS))
+    total = 0.0
+    for cut in cutsA:
+        offsets = [
+            float(np.abs(other[1:] - cut[1:]).max()) if other[0] == cut[0] else np.inf
+            for other in cutsB
+        ]
+        best = int(np.argmin(offsets)) if offsets else -1
+        if best < 0 or offsets[best] > POSITION_TOLERANCE:
+            return None
+        total += offsets[best]
+        cutsB.pop(best)
+    return total
+
+
+def NormalizeLayout(polygons: list[Polygon], width: int, height: int) -> list[dict]:
+    return [
+        {
+            "points": [(x / width, y / height) for x, y in p.RawPoints],
+            "color": p.ToDict()["color"],
+        }
+        for p in polygons
+    ]
+
+
+def MatchTemplate(img: Image.Image, mode: str) -> list[Polygon] | None:
+    """Return polygons from the nearest stored template, or None if nothing matches."""
+    width, height = img.size
+    if not width or not height:
+        return None
+    template = GetLibrary().Nearest(mode, width / height, LayoutSignature(img))
+    return template.Apply(width, height) if template else None
+
+
+def RememberTemplate(img: Image.Image, mode: str, polygons: list[Polygon]) -> None:
+    width, height = img.size
+    if not polygons or not width or not height:
+        return
+    try:
+        GetLibrary().Remember(
+            mode,
+            width / height,
+            LayoutSignature(img),
+            NormalizeLayout(polygons, width, height),
+        )
+    except sqlite3.Error:
+        logging.exception("Failed to store layout template")
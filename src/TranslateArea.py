@@ -6,11 +6,13 @@ from PIL import Image, ImageDraw, ImageFont
 from translate import Translator
 
 from .Components import Polygon
+from .Scheduler import Checkpoint
 
 
 def ExtractText(image: Image.Image, polygons: list[Polygon]) -> list[str]:
     results = []
-    for poly in polygons:
+    for idx, poly in enumerate(polygons):
+        Checkpoint(idx, len(polygons))
         # Get bounding box for the polygon
         bbox = poly.bounding_rect
         # Crop the region from the image
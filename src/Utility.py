@@ -1,9 +1,12 @@
 """Utility functions."""
 
+import bisect
 import logging
 import os
+import threading
 import traceback
 from collections import OrderedDict
+from collections.abc import Callable
 from pathlib import Path
 from typing import Any
 
@@ -11,8 +14,12 @@ if os.name == "nt":
     import winshell
 else:
     import subprocess as sp
+from PyQt6.QtCore import QCoreApplication, QFileSystemWatcher, QThread
 from PyQt6.QtWidgets import QMessageBox, QWidget
 
+from .Profiling import Timed
+from .Tasks import GuiCall
+
 
 def RestoreFromRecycle(parent: Any) -> None:
     if os.name == "nt":
@@ -33,13 +40,14 @@ def RestoreFromRecycle(parent: Any) -> None:
     btn = dlg.exec()
     if btn == QMessageBox.StandardButton.Yes:
         if Path(file).exists():
-            Path(file).rename(
-                Path(file).parent / ((Path(file).stem + " (edited)") + Path(file).suffix),
-            )
+            edited = Path(file).parent / ((Path(file).stem + " (edited)") + Path(file).suffix)
+            Path(file).rename(edited)
+            RecordFileAdded(edited)
         if os.name == "nt":
             winshell.undelete(file)
         else:
             sp.run(["mv", str(files[-1]), file])
+        RecordFileAdded(Path(file))
         parent.ImageViewer.LoadImage(file)
 
 
@@ -48,40 +56,158 @@ ALLOWED_EXTS = {".png", ".jpg", ".jpeg", ".bmp", ".tiff", ".webp"}
 # simple module-level LRU cache for directory listings
 DIR_FILES_CACHE: OrderedDict[str, tuple[list[Path], float | None]] = OrderedDict()
 DIR_FILES_CACHE_MAX = 1024
+DIR_LOCK = threading.RLock()
+
+# directories whose cache entries are kept current by DIR_WATCHER events
+DIR_WATCHER: QFileSystemWatcher | None = None
+WATCHED_DIRS: set[str] = set()
+
+# callbacks told about (added, removed) files whenever a cached listing changes
+DIR_LISTENERS: dict[str, list[Callable[[list[Path], list[Path]], None]]] = {}
 
 
+@Timed("GetImageFiles")
 def GetImageFiles(p: Path, use_cache: bool = True) -> list[Path]:
     """Return sorted image files in directory `p`.
 
-    Uses `os.scandir` for speed and a small LRU cache keyed by directory
-    modification time (mtime). If `use_cache` is False the directory will be
-    scanned unconditionally.
+    Uses `os.scandir` for speed and a small LRU cache. Listings of directories
+    watched by `DIR_WATCHER` are trusted as-is, since watcher events and the
+    `RecordFile*` helpers keep them current; other entries are revalidated
+    against the directory modification time (mtime). If `use_cache` is False
+    the directory will be scanned unconditionally.
     """
     if p is None or not p.exists():
         return []
 
     dir_key = str(p)
 
+    with DIR_LOCK:
+        cached = DIR_FILES_CACHE.get(dir_key) if use_cache else None
+        if cached and dir_key in WATCHED_DIRS:
+            DIR_FILES_CACHE.move_to_end(dir_key)
+            return list(cached[0])
+
+        mtime = DirMTime(p)
+
+        # return cached value early when mtime matches
+        if cached and cached[1] == mtime:
+            DIR_FILES_CACHE.move_to_end(dir_key)
+            return list(cached[0])
+
+        files = ScanDir(p)
+
+        if use_cache:
+            UpdateDirCache(dir_key, files, mtime)
+            if cached:
+                NotifyDirListeners(dir_key, cached[0], files)
+            WatchDirectory(p)
+
+    return files
+
+
+def DirMTime(p: Path) -> float | None:
     try:
-        mtime = p.stat().st_mtime
+        return p.stat().st_mtime
     except Exception:
         logging.exception("Failed to stat directory %s", p)
-        mtime = None
+        return None
 
-    # return cached value early when mtime matches
-    if use_cache:
-        cached = DIR_FILES_CACHE.get(dir_key)
-        if cached and cached[1] == mtime:
-            DIR_FILES_CACHE.pop(dir_key)
-            DIR_FILES_CACHE[dir_key] = cached
-            return list(cached[0])
 
-    files = ScanDir(p)
+def WatchDirectory(p: Path) -> None:
+    """Start watching `p` when running on the Qt GUI thread.
+
+    Without an event loop, or when the OS refuses another watch (inotify limit),
+    the directory simply stays on mtime revalidation.
+    """
+    global DIR_WATCHER
+    app = QCoreApplication.instance()
+    if app is None or QThread.currentThread() != app.thread() or str(p) in WATCHED_DIRS:
+        return
+    if DIR_WATCHER is None:
+        DIR_WATCHER = QFileSystemWatcher()
+        DIR_WATCHER.directoryChanged.connect(OnDirectoryChanged)
+    if DIR_WATCHER.addPath(str(p)):
+        WATCHED_DIRS.add(str(p))
 
-    if use_cache:
+
+def OnDirectoryChanged(dir_key: str) -> None:
+    """Rescan a watched directory unless the change was one we already recorded."""
+    p = Path(dir_key)
+    with DIR_LOCK:
+        cached = DIR_FILES_CACHE.get(dir_key)
+        if cached is None:
+            return
+        mtime = DirMTime(p)
+        if cached[1] is not None and cached[1] == mtime:
+            return
+        if not p.exists():
+            ForgetDirectory(dir_key)
+            return
+        files = ScanDir(p)
         UpdateDirCache(dir_key, files, mtime)
+        NotifyDirListeners(dir_key, cached[0], files)
+
+
+def ForgetDirectory(dir_key: str) -> None:
+    with DIR_LOCK:
+        DIR_FILES_CACHE.pop(dir_key, None)
+        if dir_key in WATCHED_DIRS:
+            WATCHED_DIRS.discard(dir_key)
+            if DIR_WATCHER is not None:
+                DIR_WATCHER.removePath(dir_key)
+
+
+def AddDirListener(p: Path, callback: Callable[[list[Path], list[Path]], None]) -> None:
+    DIR_LISTENERS.setdefault(str(p), []).append(callback)
+
+
+def NotifyDirListeners(dir_key: str, before: list[Path], after: list[Path]) -> None:
+    old, new = set(before), set(after)
+    added, removed = sorted(new - old), sorted(old - new)
+    if added or removed:
+        for callback in DIR_LISTENERS.get(dir_key, []):
+            callback(added, removed)
+
+
+def RecordFileAdded(path: Path) -> None:
+    """Insert a file we just wrote into its cached listing instead of rescanning.
+
+    Also accepts non-image paths (new subfolders, overwrites) so the cached
+    mtime follows our own change.
+    """
+    RecordChange(path, added=True)
 
-    return files
+
+def RecordFileRemoved(path: Path) -> None:
+    """Drop a file we just moved or deleted from its cached listing."""
+    RecordChange(path, added=False)
+
+
+def RecordChange(path: Path, added: bool) -> None:
+    dir_key = str(path.parent)
+    with DIR_LOCK:
+        cached = DIR_FILES_CACHE.get(dir_key)
+        if cached is None:
+            return
+        files = cached[0]
+        changed: list[Path] = []
+        if path.suffix.lower() in ALLOWED_EXTS:
+            idx = bisect.bisect_left(files, path)
+            present = idx < len(files) and files[idx] == path
+            if added and not present:
+                files.insert(idx, path)
+                changed.append(path)
+            elif not added and present:
+                del files[idx]
+                changed.append(path)
+        DIR_FILES_CACHE[dir_key] = (files, DirMTime(path.parent))
+        if changed:
+            # listeners update widgets, so they run on the GUI thread whoever saved the file
+            for callback in DIR_LISTENERS.get(dir_key, []):
+                if added:
+                    GuiCall(lambda cb=callback: cb(changed, []))
+                else:
+                    GuiCall(lambda cb=callback: cb([], changed))
 
 
 def ScanDir(p: Path) -> list[Path]:
@@ -110,12 +236,31 @@ def UpdateDirCache(dir_key: str, files: list[Path], mtime: float | None) -> None
     """Safely update the module-level directory listing cache."""
     try:
         DIR_FILES_CACHE[dir_key] = (list(files), mtime)
+        DIR_FILES_CACHE.move_to_end(dir_key)
         if len(DIR_FILES_CACHE) > DIR_FILES_CACHE_MAX:
-            DIR_FILES_CACHE.popitem(last=False)
+            ForgetDirectory(next(iter(DIR_FILES_CACHE)))
     except Exception:
         logging.exception("Failed to update dir cache for %s", dir_key)
 
 
+def SeedDirCache(p: Path, files: list[Path], mtime: float | None) -> None:
+    """Cache a listing of `p` known to be current, such as a folder index's, instead of scanning."""
+    with DIR_LOCK:
+        if str(p) not in DIR_FILES_CACHE:
+            UpdateDirCache(str(p), sorted(files), mtime)
+        WatchDirectory(p)
+
+
+def AppDataDir() -> Path:
+    """Return the per-user directory for data shared across folders.
+
+    `IMAGE_SPLITTER_HOME` overrides the location, e.g. for benchmarks.
+    """
+    path = Path(os.environ.get("IMAGE_SPLITTER_HOME", Path.home() / ".image-splitter"))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
 def ThrowNotImplemented(parent: QWidget) -> None:
     dlg = QMessageBox(parent)
     dlg.setWindowTitle("Not implemented")